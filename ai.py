@@ -1,30 +1,36 @@
+import math
 import threading
+import time
+from contextlib import nullcontext
 from datetime import datetime
-from queue import Queue
 
-import numpy as np
 import torch
-from matplotlib import pyplot as plt
-from torch.nn.functional import interpolate
 from torchvision import transforms
 import json
 from models import get_model
+from models.artifact import load_artifact
+from models.weights import load_weights, assign_state_dict
+from models.quantization import quantize_dynamic_int8, quantize_static_int8, linear_parameter_fraction
+from models.onnx_export import OnnxModel
 from PIL import Image
 from camera import CameraManager
 from pathlib import Path
-from utils.camera_utils import resize_density_map
-import matplotlib
-matplotlib.use('Agg')
+from utils.camera_utils import ResolutionPolicy, FrameChangeDetector
+from utils.eval_utils import sliding_window_predict, resize_density_map
+from utils.render_utils import save_density_overlay, save_frame
+from image_writer import ImageWriterPool
+from prediction_history import PredictionHistory
 import logging
 
-logging.getLogger('matplotlib.font_manager').setLevel(logging.WARNING)
-plt.rcParams['font.family'] = 'DejaVu Sans'
-
 def resize_image(image, max_width: int, max_height: int):
     image_copy = image.copy()
     image_copy.thumbnail((max_width, max_height), Image.LANCZOS)
     return image_copy
 
+
+def round_up(value: int, multiple: int) -> int:
+    return int(math.ceil(value / multiple) * multiple)
+
 class AI:
 
     def __init__(self, camera_manager: CameraManager,
@@ -34,7 +40,36 @@ class AI:
                  dataset_name: str = "qnrf",
                  truncation: int = 4,
                  granularity: str = "fine",
-                 device: str = "cuda"):
+                 device: str = "cuda",
+                 batch_inference: bool = True,
+                 bucket_size: int = 64,
+                 max_batch_size: int = 8,
+                 max_frame_age: float = None,
+                 density_map_max_side: int = None,
+                 image_writer_workers: int = 4,
+                 image_writer_queue_size: int = 64,
+                 image_writer_backend: str = "thread",
+                 history_depth: int = 10,
+                 history_thumbnail_size: tuple = (320, 240),
+                 precomputed_text_features: bool = False,
+                 checkpoint_path: str = "checkpoints/qnrf/clip_resnet50_word_448_8_4_fine_1.0_dmcount_aug/best_mae.pth",
+                 artifact_path: str = None,
+                 precision: str = "fp32",
+                 calibration_dir: str = None,
+                 calibration_size: int = 32,
+                 backend: str = "torch",
+                 onnx_path: str = None,
+                 intra_op_threads: int = 0,
+                 inter_op_threads: int = 0,
+                 onnx_providers: list = None,
+                 resolution_policy: dict = None,
+                 camera_resolution_policies: dict = None,
+                 change_detection: bool = False,
+                 change_threshold: float = 4.0,
+                 change_refresh_interval: float = 600.0,
+                 window_size: int = None,
+                 window_stride: int = None,
+                 window_batch_size: int = 8):
 
         self.camera_manager = camera_manager
         if device == "cuda" and not torch.cuda.is_available():
@@ -42,6 +77,99 @@ class AI:
             device = "cpu"
         self.device = torch.device(device)
 
+        assert backend in ["torch", "onnxruntime"], f"Expected backend to be 'torch' or 'onnxruntime', got {backend}"
+        self.backend = backend
+        if backend == "onnxruntime":
+            assert onnx_path is not None, "The onnxruntime backend needs an onnx_path, see export_model.py --format onnx"
+            assert precision == "fp32", f"The onnxruntime backend runs the exported fp32 graph, got precision {precision}"
+            # Inputs and outputs of the ONNX Runtime session are CPU tensors, whichever provider runs the graph
+            self.device = torch.device("cpu")
+            self._load_onnx(onnx_path, intra_op_threads, inter_op_threads, onnx_providers)
+        elif artifact_path is not None:
+            self._load_artifact(artifact_path)
+        else:
+            self._load_checkpoint(checkpoint_path, model_name, input_size, reduction, dataset_name, truncation,
+                                  granularity, precomputed_text_features)
+        if hasattr(self.model, "fuse_head"):
+            self.model.fuse_head()
+
+        # Define the preprocessing transforms
+        self.to_tensor = transforms.ToTensor()
+        self.normalize = transforms.Normalize(mean=self.mean, std=self.std)
+        # Value of a black pixel after normalization, used to pad images in a batch
+        self.pad_value = torch.tensor([-m / s for m, s in zip(self.mean, self.std)]).view(1, 3, 1, 1)
+
+        # Batched inference: images are padded to a multiple of the encoder reduction and grouped
+        # into buckets of the same padded size, one forward pass per bucket.
+        self.batch_inference = batch_inference
+        self.reduction = self.model.reduction
+        pad_multiple = getattr(self.model, "encoder_reduction", self.reduction)
+        self.bucket_size = round_up(bucket_size, pad_multiple)
+        self.max_batch_size = max_batch_size
+
+        # Inputs larger than window_size are predicted with overlapping windows of that size, in batches of
+        # window_batch_size windows, None runs the model on the whole input
+        self.window_size = window_size
+        self.window_stride = window_stride
+        self.window_batch_size = window_batch_size
+
+        # Inference precision: fp16/bf16 autocast on GPU, INT8 quantization on CPU
+        self._set_precision(precision, calibration_dir, calibration_size)
+
+        # Per camera input resolution, see ResolutionPolicy. camera_resolution_policies maps camera names to
+        # ResolutionPolicy arguments overriding the default resolution_policy arguments
+        self.resolution_policy = resolution_policy if resolution_policy is not None else {}
+        self.camera_resolution_policies = camera_resolution_policies if camera_resolution_policies is not None else {}
+        self.resolution_policies = {}
+        self.resolution_policies_lock = threading.Lock()  # preprocess and predict run in different pipeline stages
+
+        # Frames that barely changed since the last computed frame of their camera reuse its count and density map
+        self.change_detector = FrameChangeDetector(threshold=change_threshold, refresh_interval=change_refresh_interval) \
+            if change_detection else None
+        self.cached_predictions = {}
+
+        # Frames captured more than max_frame_age seconds ago are skipped, None disables the check
+        self.max_frame_age = max_frame_age
+        self.last_frame_seq = {}
+
+        # Saved density maps are downscaled to this longest side, None keeps the frame resolution
+        self.density_map_max_side = density_map_max_side
+        # Images are saved by a long-lived pool so predicting never waits for the encoding
+        self.image_writer = ImageWriterPool(num_workers=image_writer_workers, max_queue_size=image_writer_queue_size,
+                                            drop_policy="drop_oldest", backend=image_writer_backend)
+
+        # Store the last history_depth prediction results per camera, with thumbnails instead of full frames
+        self.last_prediction_result = PredictionHistory(depth=history_depth, thumbnail_size=history_thumbnail_size)
+
+    def _load_artifact(self, artifact_path: str):
+        """Load the model, bins and normalization constants from a single-file artifact, see export_model.py."""
+        try:
+            self.model, config = load_artifact(artifact_path, device=self.device)
+        except Exception as e:
+            print(f"Error loading model artifact: {e}")
+            raise e
+        self.bins = [(float(b[0]), float(b[1])) for b in config["bins"]]
+        self.anchor_points = [float(p) for p in config["anchor_points"]]
+        self.mean = config["mean"]
+        self.std = config["std"]
+
+    def _load_onnx(self, onnx_path: str, intra_op_threads: int, inter_op_threads: int, providers: list = None):
+        """Run an exported ONNX graph with ONNX Runtime, the bins and normalization constants come from its metadata."""
+        try:
+            self.model = OnnxModel(onnx_path, intra_op_threads=intra_op_threads, inter_op_threads=inter_op_threads,
+                                   providers=providers)
+        except Exception as e:
+            print(f"Error loading ONNX model: {e}")
+            raise e
+        # Frames are resized keeping their aspect ratio and padded into size buckets, so they never match a fixed size
+        assert self.model.fixed_size is None, f"ONNX model {onnx_path} only accepts {self.model.fixed_size[0]}x{self.model.fixed_size[1]} inputs (ViT backbone) and cannot be used by AI. Use the torch backend for ViT models."
+        self.bins = self.model.bins
+        self.anchor_points = self.model.metadata["anchor_points"]
+        self.mean = self.model.metadata["mean"]
+        self.std = self.model.metadata["std"]
+
+    def _load_checkpoint(self, checkpoint_path: str, model_name: str, input_size: int, reduction: int,
+                         dataset_name: str, truncation: int, granularity: str, precomputed_text_features: bool):
         try:
             with open(f"configs/reduction_{reduction}.json", "r") as f:
                 config = json.load(f)[str(truncation)][dataset_name]
@@ -55,19 +183,19 @@ class AI:
         self.anchor_points = [float(p) for p in self.anchor_points]
 
         try:
-            # Load the model
+            # Load the model, the CLIP image encoder weights are replaced by the checkpoint anyway
             self.model = get_model(
                 backbone=model_name,
                 input_size=input_size,
                 reduction=reduction,
                 bins=self.bins,
                 anchor_points=self.anchor_points,
-                prompt_type="word"
+                prompt_type="word",
+                precomputed_text_features=precomputed_text_features,
+                pretrained=False
             )
-            # Load the model checkpoint
-            ckpt = torch.load("checkpoints/qnrf/clip_resnet50_word_448_8_4_fine_1.0_dmcount_aug/best_mae.pth",
-                              map_location=self.device)
-            self.model.load_state_dict(ckpt)
+            # Load the model checkpoint memory mapped, the parameters use the loaded tensors instead of copies
+            assign_state_dict(self.model, load_weights(checkpoint_path))
             self.model = self.model.to(self.device)
             self.model.eval()
         except Exception as e:
@@ -77,218 +205,256 @@ class AI:
         # Define the mean and std for normalization
         self.mean = [0.485, 0.456, 0.406]
         self.std = [0.229, 0.224, 0.225]
-        # Define the preprocessing transforms
-        self.to_tensor = transforms.ToTensor()
-        self.normalize = transforms.Normalize(mean=self.mean, std=self.std)
 
-        # Store the last prediction result
-        self.last_prediction_result = []
-
-    def _predict(self, image: Image) -> tuple:
-        image_width, image_height = image.size
-        image = self.normalize(self.to_tensor(image)).unsqueeze(0).to(self.device)
+    def _set_precision(self, precision: str, calibration_dir: str = None, calibration_size: int = 32):
+        precisions = ["fp32", "fp16", "bf16", "int8_dynamic", "int8_static"]
+        assert precision in precisions, f"Expected precision to be in {precisions}, got {precision}"
+        self.precision = precision
+        self.autocast_dtype = {"fp16": torch.float16, "bf16": torch.bfloat16}.get(precision)
+        if self.autocast_dtype is not None:
+            assert self.device.type == "cuda", f"{precision} inference needs a CUDA device, got {self.device}"
+        elif precision.startswith("int8"):
+            assert self.device.type == "cpu", f"INT8 inference only runs on CPU, got {self.device}"
+            if precision == "int8_dynamic":
+                if linear_parameter_fraction(self.model) < 0.1:
+                    logging.warning("int8_dynamic only quantizes Linear layers, which hold little of this model. Expect little speedup.")
+                self.model = quantize_dynamic_int8(self.model)
+            else:
+                logging.warning("int8_static is experimental and not validated on every backbone. Compare it with fp32 with benchmarks/precision_report.py first.")
+                assert calibration_dir is not None, "Static INT8 quantization needs a calibration_dir with saved camera frames"
+                self.model = quantize_static_int8(self.model, self._calibration_batches(calibration_dir, calibration_size))
+            print(f"Quantized model to {precision}.")
+
+    def _calibration_batches(self, calibration_dir: str, calibration_size: int) -> list:
+        """Batches of up to calibration_size saved camera frames, bucketed and padded like live frames."""
+        paths = sorted(path for path in Path(calibration_dir).rglob("*") if path.suffix.lower() in [".jpg", ".jpeg", ".png"])
+        assert len(paths) > 0, f"No images found in calibration_dir {calibration_dir}"
+        # Spread the calibration frames over the whole folder, e.g. different cameras and times of day
+        step = max(1, len(paths) // calibration_size)
+        images = [Image.open(path).convert("RGB") for path in paths[::step][:calibration_size]]
+        return [batch for _, batch in self._make_batches(images)]
+
+    def _forward(self, images: torch.Tensor) -> torch.Tensor:
+        """Run the model in the configured precision, always returning float32 density maps."""
+        context = torch.autocast(self.device.type, dtype=self.autocast_dtype) if self.autocast_dtype is not None else nullcontext()
+        images = images.to(self.device)
+        with torch.no_grad(), context:
+            if self.window_size is not None and min(images.shape[-2:]) > self.window_size:
+                return sliding_window_predict(self.model, images, self.window_size, self.window_stride,
+                                              batch_size=self.window_batch_size).float()
+            return self.model(images).float()
+
+    def _get_resolution_policy(self, camera_name: str) -> ResolutionPolicy:
+        with self.resolution_policies_lock:
+            if camera_name not in self.resolution_policies:
+                kwargs = {**self.resolution_policy, **self.camera_resolution_policies.get(camera_name, {})}
+                self.resolution_policies[camera_name] = ResolutionPolicy(**kwargs)
+            return self.resolution_policies[camera_name]
+
+    def _model_input(self, camera_frame: dict) -> Image:
+        """The frame resized according to the resolution policy of its camera."""
+        frame = camera_frame["frame"]
+        size = self._get_resolution_policy(camera_frame["camera"]).target_size(*frame.size)
+        if size == frame.size:
+            return frame
+        return frame.resize(size, Image.BILINEAR)
+
+    def _predict(self, image: Image, output_size: tuple = None) -> tuple:
+        """Predict on one image, the density map is resized to output_size (width, height), by default the image size."""
+        image_width, image_height = image.size if output_size is None else output_size
+        image = self.normalize(self.to_tensor(image)).unsqueeze(0)
         with torch.no_grad():
-            pred_density = self.model(image)
+            pred_density = self._forward(image)
             pred_count = pred_density.sum().item()
             resized_pred_density = resize_density_map(pred_density, (image_height, image_width)).cpu()
         return round(pred_count), resized_pred_density.squeeze().numpy()
 
-    def _predict_batch(self, images: list) -> list:
-        """Predict on a batch of images, resizing them to a consistent size."""
-        # Resize all images to the model's input size
-        resized_images = [image.resize((448, 488), Image.LANCZOS) for image in
-                          images]
-
-        # Convert images to tensors and normalize them
-        batch = torch.stack([self.normalize(self.to_tensor(image)) for image in resized_images]).to(self.device)
-
-        with torch.no_grad():
-            pred_densities = self.model(batch)
-            pred_counts = pred_densities.sum(dim=[1, 2, 3]).cpu().tolist()
-
-            # Resize densities back to the original image sizes
-            resized_pred_densities = [
-                interpolate(pred_density.unsqueeze(0), size=(image.size[1], image.size[0]), mode='bilinear',
-                            align_corners=False).squeeze(0).squeeze(0).cpu().numpy()
-                for pred_density, image in zip(pred_densities, images)
-            ]
-
-        return [(round(pred_count), pred_density) for pred_count, pred_density in
-                zip(pred_counts, resized_pred_densities)]
-
-    def capture_and_predict(self, save_images: bool = False, save_folder: str = None) -> dict:
-        todays_date = datetime.now().strftime("%Y%m%d")
-
-        if save_images:
-            if save_folder is None:
-                save_folder = Path("predictions")
-                save_folder.mkdir(parents=True, exist_ok=True)
+    def _make_batches(self, images: list):
+        """Group images into buckets of the same padded size and yield (indices, batch) per forward pass."""
+        buckets = {}
+        for index, image in enumerate(images):
+            image_width, image_height = image.size
+            key = (round_up(image_height, self.bucket_size), round_up(image_width, self.bucket_size))
+            buckets.setdefault(key, []).append(index)
+
+        for (bucket_height, bucket_width), indices in buckets.items():
+            for start in range(0, len(indices), self.max_batch_size):
+                chunk = indices[start:start + self.max_batch_size]
+                # Pad at the bottom/right with black, same as the area outside the crop polygon
+                batch = self.pad_value.repeat(len(chunk), 1, bucket_height, bucket_width)
+                for i, index in enumerate(chunk):
+                    image = self.normalize(self.to_tensor(images[index]))
+                    batch[i, :, :image.shape[1], :image.shape[2]] = image
+                yield chunk, batch
+
+    def _predict_batch(self, images: list, batches: list = None, output_sizes: list = None) -> list:
+        """
+        Predict on a list of images of different sizes, keeping their aspect ratio.
+
+        Images are padded into size buckets and each bucket is run through the model in one forward pass.
+        The padded area is cut away from the predicted density maps before they are resized back to the
+        original image sizes, so the counts match the single image path. If the images were downscaled,
+        output_sizes gives the (width, height) of the original frames to resize the density maps to.
+        """
+        if batches is None:
+            batches = self._make_batches(images)
+
+        predictions = [None] * len(images)
+        for indices, batch in batches:
+            with torch.no_grad():
+                pred_densities = self._forward(batch)
+                for index, pred_density in zip(indices, pred_densities):
+                    image_width, image_height = images[index].size
+                    density_height = math.ceil(image_height / self.reduction)
+                    density_width = math.ceil(image_width / self.reduction)
+                    pred_density = pred_density[:, :density_height, :density_width].unsqueeze(0)
+                    pred_count = pred_density.sum().item()
+                    if output_sizes is not None:
+                        image_width, image_height = output_sizes[index]
+                    # Count preserving, so the density map of a downscaled input sums to the count on the original frame
+                    resized_pred_density = resize_density_map(pred_density, (image_height, image_width)).cpu()
+                    predictions[index] = (round(pred_count), resized_pred_density.squeeze().numpy())
+
+        return predictions
+
+    def preprocess(self, camera_frames: list, batch_inference: bool = None) -> tuple:
+        """
+        Drop cameras without a frame or with a stale frame, mark unchanged frames to reuse the last prediction and build
+        the model input batches of the other frames. Returns (camera_frames, batches). batch_inference overrides
+        self.batch_inference for this call.
+        """
+        batch_inference = self.batch_inference if batch_inference is None else batch_inference
+        camera_frames = [camera_frame for camera_frame in camera_frames
+                         if camera_frame["frame"] is not None and not self._is_stale(camera_frame)]
+        # The resized frame is kept with the frame, so predict() uses the same input size even if the
+        # resolution policy changes in between
+        for camera_frame in camera_frames:
+            camera_frame["reference_id"] = self.change_detector.match(camera_frame["camera"], camera_frame["frame"]) \
+                if self.change_detector is not None else None
+            camera_frame["reuse"] = camera_frame["reference_id"] is not None
+            if not camera_frame["reuse"]:
+                camera_frame["model_input"] = self._model_input(camera_frame)
+        batches = None
+        if batch_inference:
+            batches = list(self._make_batches([camera_frame["model_input"] for camera_frame in camera_frames
+                                               if not camera_frame["reuse"]]))
+        return camera_frames, batches
+
+    def _is_stale(self, camera_frame: dict) -> bool:
+        """Check whether the frame is older than max_frame_age, and warn if the camera returned the same frame as last cycle."""
+        camera_name = camera_frame["camera"]
+        frame_seq = camera_frame.get("frame_seq")
+        if frame_seq is not None:
+            if self.last_frame_seq.get(camera_name) == frame_seq:
+                logging.warning(f"Camera {camera_name} returned the same frame ({frame_seq}) as the last cycle.")
+            self.last_frame_seq[camera_name] = frame_seq
+
+        captured_at = camera_frame.get("captured_at")
+        if self.max_frame_age is not None and captured_at is not None:
+            frame_age = time.time() - captured_at
+            if frame_age > self.max_frame_age:
+                logging.warning(f"Skipping stale frame from {camera_name}, captured {frame_age:.1f} seconds ago.")
+                return True
+        return False
+
+    def predict(self, camera_frames: list, batches: list = None, batch_inference: bool = None) -> tuple:
+        """
+        Run the model on the frames of a cycle. Returns (results, predictions) where predictions are (count, density) per
+        frame. batch_inference overrides self.batch_inference for this call.
+        """
+        batch_inference = self.batch_inference if batch_inference is None else batch_inference
+        # The batches from preprocess() contain exactly the frames that are not marked for reuse
+        computed = [index for index, camera_frame in enumerate(camera_frames) if not camera_frame.get("reuse", False)]
+        inputs = [camera_frames[index]["model_input"] if "model_input" in camera_frames[index]
+                  else self._model_input(camera_frames[index]) for index in computed]
+        output_sizes = [camera_frames[index]["frame"].size for index in computed]
+        try:
+            if batch_inference:
+                computed_predictions = self._predict_batch(inputs, batches, output_sizes)
             else:
-                save_folder = Path(save_folder)
-                save_folder.mkdir(parents=True, exist_ok=True)
-
-            original_images_folder = save_folder / "original_images" / f"{todays_date}"
-            density_maps_folder = save_folder / "density_maps" / f"{todays_date}"
-            original_images_folder.mkdir(parents=True, exist_ok=True)
-            density_maps_folder.mkdir(parents=True, exist_ok=True)
+                computed_predictions = [self._predict(image, output_size) for image, output_size in zip(inputs, output_sizes)]
+
+            predictions = [None] * len(camera_frames)
+            for index, prediction in zip(computed, computed_predictions):
+                predictions[index] = prediction
+            for index, camera_frame in enumerate(camera_frames):
+                if predictions[index] is None:
+                    cached = self.cached_predictions.get(camera_frame["camera"])
+                    if cached is not None and cached[0] == camera_frame["reference_id"] and cached[1] == camera_frame["frame"].size:
+                        predictions[index] = cached[2]
+                        continue
+                    # The prediction of the reference the frame was compared against is gone or was never made
+                    predictions[index] = self._predict(self._model_input(camera_frame), camera_frame["frame"].size)
+                if self.change_detector is not None:
+                    # The reference is only replaced now that its prediction is cached
+                    reference_id = self.change_detector.update(camera_frame["camera"], camera_frame["frame"])
+                    self.cached_predictions[camera_frame["camera"]] = (reference_id, camera_frame["frame"].size, predictions[index])
+        except Exception:
+            self.discard(camera_frames)
+            raise
 
         results = {}
-        camera_frames: dict = self.camera_manager.get_frames()
+        for camera_frame, (pred_count, _) in zip(camera_frames, predictions):
+            results[camera_frame["camera"]] = pred_count
+            self._get_resolution_policy(camera_frame["camera"]).update(pred_count)
 
-        # Create a queue to handle image saving tasks
-        image_queue = Queue()
-        num_worker_threads = 4  # Number of threads for saving images
-        threads = []
-        for _ in range(num_worker_threads):
-            t = threading.Thread(target=self.save_image_worker, args=(image_queue,))
-            t.start()
-            threads.append(t)
-
-        for camera_frame in camera_frames:
-            frame = camera_frame["frame"]
-            camera_name = camera_frame["camera"]
-            timestamp = camera_frame["timestamp"]
-            if frame is not None:
-                pred_count, pred_density = self._predict(frame)
-                results[camera_name] = pred_count
-
-                self.last_prediction_result.append({
-                    "camera": camera_name,
-                    "timestamp": timestamp,
-                    "frame": frame,
-                    "count": pred_count
-                })
-
-                camera_name = camera_name.lower().replace(" ", "_")
-                timestamp = timestamp.replace(":", "").replace("-", "")
-
-                if save_images:
-                    original_image_path = original_images_folder / f"{camera_name}_{timestamp}_count_{pred_count}.png"
-                    density_map_path = density_maps_folder / f"{camera_name}_{timestamp}_count_{pred_count}.png"
-
-                    # Add image saving tasks to the queue
-                    image_queue.put((self.save_original_image, (frame, original_image_path)))
-                    image_queue.put((self.save_density_map, (frame, pred_density, density_map_path)))
-
-        # Wait for all image saving tasks to complete
-        image_queue.join()
-
-        # Stop the worker threads
-        for _ in range(num_worker_threads):
-            image_queue.put(None)
-        for t in threads:
-            t.join()
+            self.last_prediction_result.add(camera_frame["camera"], camera_frame["timestamp"], pred_count, camera_frame["frame"])
 
         # Count the total number of people
         results["total"] = sum(results.values())
 
-        return results
+        return results, predictions
 
-    def save_image_worker(self, queue: Queue):
-        while True:
-            item = queue.get()
-            if item is None:
-                break
-            save_function, args = item
-            try:
-                save_function(*args)
-            except Exception as e:
-                logging.error(f"Error saving image: {e}")
-            queue.task_done()
+    def discard(self, camera_frames: list) -> None:
+        """Called for a cycle that was dropped or failed after preprocess, so the next frames of its cameras are computed."""
+        if self.change_detector is not None:
+            for camera_frame in camera_frames:
+                self.change_detector.reset(camera_frame["camera"])
 
-    def capture_and_predict_batch(self, save_images: bool = False, save_folder: str = None) -> dict:
+    def save_images(self, camera_frames: list, predictions: list, save_folder: str = None) -> None:
+        """Queue the original frames and density maps of a cycle to be saved by the image writer pool."""
         todays_date = datetime.now().strftime("%Y%m%d")
 
-        if save_images:
-            if save_folder is None:
-                save_folder = Path("predictions")
-                save_folder.mkdir(parents=True, exist_ok=True)
-            else:
-                save_folder = Path(save_folder)
-                save_folder.mkdir(parents=True, exist_ok=True)
-
-            original_images_folder = save_folder / "original_images" / f"{todays_date}"
-            density_maps_folder = save_folder / "density_maps" / f"{todays_date}"
-            original_images_folder.mkdir(parents=True, exist_ok=True)
-            density_maps_folder.mkdir(parents=True, exist_ok=True)
-
-        results = {}
-        camera_frames: dict = self.camera_manager.get_frames()
-
-        frames = [camera_frame["frame"] for camera_frame in camera_frames if camera_frame["frame"] is not None]
-        metadata = [(camera_frame["camera"], camera_frame["timestamp"]) for camera_frame in camera_frames if
-                    camera_frame["frame"] is not None]
-
-        predictions = self._predict_batch(frames)
-
-        # Create a queue to handle image saving tasks
-        image_queue = Queue()
-        num_worker_threads = 4  # Number of threads for saving images
-        threads = []
-        for _ in range(num_worker_threads):
-            t = threading.Thread(target=self.save_image_worker, args=(image_queue,))
-            t.start()
-            threads.append(t)
+        if save_folder is None:
+            save_folder = Path("predictions")
+            save_folder.mkdir(parents=True, exist_ok=True)
+        else:
+            save_folder = Path(save_folder)
+            save_folder.mkdir(parents=True, exist_ok=True)
 
-        for (camera_name, timestamp), (pred_count, pred_density), frame in zip(metadata, predictions, frames):
-            results[camera_name] = pred_count
+        original_images_folder = save_folder / "original_images" / f"{todays_date}"
+        density_maps_folder = save_folder / "density_maps" / f"{todays_date}"
+        original_images_folder.mkdir(parents=True, exist_ok=True)
+        density_maps_folder.mkdir(parents=True, exist_ok=True)
 
-            self.last_prediction_result.append({
-                "camera": camera_name,
-                "timestamp": timestamp,
-                "frame": frame,
-                "count": pred_count
-            })
-
-            camera_name = camera_name.lower().replace(" ", "_")
-            timestamp = timestamp.replace(":", "").replace("-", "")
+        for camera_frame, (pred_count, pred_density) in zip(camera_frames, predictions):
+            frame = camera_frame["frame"]
+            camera_name = camera_frame["camera"].lower().replace(" ", "_")
+            timestamp = camera_frame["timestamp"].replace(":", "").replace("-", "")
 
-            if save_images:
-                original_image_path = original_images_folder / f"{camera_name}_{timestamp}_count_{pred_count}.png"
-                density_map_path = density_maps_folder / f"{camera_name}_{timestamp}_count_{pred_count}.png"
+            original_image_path = original_images_folder / f"{camera_name}_{timestamp}_count_{pred_count}.png"
+            density_map_path = density_maps_folder / f"{camera_name}_{timestamp}_count_{pred_count}.png"
+            self.last_prediction_result.set_paths(camera_frame["camera"], camera_frame["timestamp"],
+                                                  original_image_path.with_suffix(".jpg"), density_map_path)
 
-                # Add image saving tasks to the queue
-                image_queue.put((self.save_original_image, (frame, original_image_path)))
-                # image_queue.put((self.save_density_map, (frame, pred_density, density_map_path)))
+            # Module level functions so they can also run in the process backend of the pool
+            self.image_writer.submit(save_frame, frame, original_image_path, "JPEG", 70)
+            self.image_writer.submit(save_density_overlay, frame, pred_density, density_map_path,
+                                     0.5, 0.5, self.density_map_max_side)
 
-        # Wait for all image saving tasks to complete
-        image_queue.join()
+    def capture_and_predict(self, save_images: bool = False, save_folder: str = None, batch_inference: bool = None) -> dict:
+        camera_frames, batches = self.preprocess(self.camera_manager.get_frames(), batch_inference)
+        results, predictions = self.predict(camera_frames, batches, batch_inference)
 
-        # Stop the worker threads
-        for _ in range(num_worker_threads):
-            image_queue.put(None)
-        for t in threads:
-            t.join()
+        if save_images:
+            self.save_images(camera_frames, predictions, save_folder)
 
-        results["total"] = sum(results.values())
         return results
 
-    def save_original_image(self, frame, path, max_width=800, max_height=600, format="JPEG", quality=70):
-        try:
-            resized_frame = frame # resize_image(frame, max_width, max_height)
-            if format == "JPEG":
-                jpeg_path = path.with_suffix(".jpg")
-                resized_frame.save(jpeg_path, format, quality=quality)
-            else:
-                resized_frame.save(path, format, optimize=True, compress_level=9)
-        except Exception as e:
-            logging.error(f"Error saving original image: {e}")
-
-
-    def save_density_map(self, frame, pred_density, path):
-        try:
-            frame_np = np.array(frame)
-            if pred_density.ndim == 3 and pred_density.shape[0] == 1:
-                frame_np = frame_np.squeeze()
-
-            fig, ax = plt.subplots(figsize=(12, 8))
-            ax.imshow(frame_np)
-            ax.imshow(pred_density, cmap="jet", alpha=0.5, vmin=0, vmax=np.max(pred_density) * 0.5)
-            ax.axis("off")
-            plt.savefig(path, bbox_inches='tight', pad_inches=0, dpi=150)  # Reduced DPI for smaller size
-            plt.close(fig)
-        except Exception as e:
-            logging.error(f"Error saving density map: {e}")
-
-
+    def capture_and_predict_batch(self, save_images: bool = False, save_folder: str = None) -> dict:
+        """Same as capture_and_predict, but always runs the batched inference path."""
+        return self.capture_and_predict(save_images=save_images, save_folder=save_folder, batch_inference=True)
 
+    def close(self):
+        """Wait for the queued images to be written and stop the image writer pool."""
+        self.image_writer.shutdown(wait=True)
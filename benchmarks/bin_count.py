@@ -0,0 +1,64 @@
+# Compare the speed of DACELoss._bin_count with the previous per-bin loop on every bin configuration.
+# The parity check is benchmarks/check_bin_count.py.
+import os, sys
+import json
+import time
+from argparse import ArgumentParser
+
+import torch
+
+parent_dir = os.path.abspath(os.path.join(os.path.dirname(__file__), ".."))
+sys.path.append(parent_dir)
+
+from losses import DACELoss
+from check_bin_count import bin_count_loop
+
+
+parser = ArgumentParser(description="Benchmark of the bin assignment in DACELoss.")
+parser.add_argument("--input_size", type=int, default=448, help="The crop size.")
+parser.add_argument("--batch_size", type=int, default=8, help="Density maps per call.")
+parser.add_argument("--repeats", type=int, default=100, help="Number of timed calls.")
+parser.add_argument("--device", type=str, default="cuda" if torch.cuda.is_available() else "cpu", help="The device.")
+parser.add_argument("--seed", type=int, default=42, help="Random seed.")
+
+
+def make_density(args, reduction: int, max_count: float) -> torch.Tensor:
+    generator = torch.Generator().manual_seed(args.seed)
+    size = args.input_size // reduction
+    shape = (args.batch_size, 1, size, size)
+    # Integer counts as in the training targets
+    return torch.randint(0, int(max_count) + 2, shape, generator=generator).float().to(args.device)
+
+
+def benchmark(fn, density: torch.Tensor, repeats: int, device: str) -> float:
+    fn(density)
+    if device.startswith("cuda"):
+        torch.cuda.synchronize()
+    start = time.perf_counter()
+    for _ in range(repeats):
+        fn(density)
+    if device.startswith("cuda"):
+        torch.cuda.synchronize()
+    return (time.perf_counter() - start) / repeats
+
+
+def main():
+    args = parser.parse_args()
+    print(f"{'reduction':>9} {'truncation':>10} {'dataset':<8} {'granularity':<12} {'bins':>5} {'loop':>10} {'bucketize':>10} {'speedup':>8}")
+    for reduction in [8, 16, 32]:
+        with open(os.path.join(parent_dir, "configs", f"reduction_{reduction}.json"), "r") as f:
+            config = json.load(f)
+        for truncation, datasets in config.items():
+            for dataset, dataset_config in datasets.items():
+                for granularity, bins in dataset_config["bins"].items():
+                    bins = [(float(b[0]), float(b[1])) for b in bins]
+                    loss_fn = DACELoss(bins, reduction).to(args.device)
+                    density = make_density(args, reduction, bins[-1][0])
+
+                    loop_time = benchmark(lambda d: bin_count_loop(bins, d), density, args.repeats, args.device)
+                    bucketize_time = benchmark(loss_fn._bin_count, density, args.repeats, args.device)
+                    print(f"{reduction:>9} {truncation:>10} {dataset:<8} {granularity:<12} {len(bins):>5} {loop_time * 1e6:>8.0f}us {bucketize_time * 1e6:>8.0f}us {loop_time / bucketize_time:>7.2f}x")
+
+
+if __name__ == "__main__":
+    main()
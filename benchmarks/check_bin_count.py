@@ -0,0 +1,62 @@
+# Parity check of DACELoss._bin_count against the previous per-bin loop. Exits with an error on any mismatch.
+import os, sys
+import json
+
+import torch
+
+parent_dir = os.path.abspath(os.path.join(os.path.dirname(__file__), ".."))
+sys.path.append(parent_dir)
+
+from losses import DACELoss
+
+
+def bin_count_loop(bins: list, density_map: torch.Tensor) -> torch.Tensor:
+    """The previous implementation of DACELoss._bin_count, one masked assignment per bin."""
+    class_map = torch.zeros_like(density_map, dtype=torch.long)
+    for idx, (low, high) in enumerate(bins):
+        mask = (density_map >= low) & (density_map <= high)
+        class_map[mask] = idx
+    return class_map.squeeze(1)
+
+
+def check(bins: list, values: torch.Tensor, name: str) -> None:
+    density_map = values.view(1, 1, 1, -1)
+    expected = bin_count_loop(bins, density_map)
+    actual = DACELoss(bins, reduction=8)._bin_count(density_map)
+    if not torch.equal(expected, actual):
+        mismatch = (expected != actual).view(-1)
+        raise ValueError(f"{name}: bin assignment differs for values {values[mismatch].tolist()}, "
+                         f"expected {expected.view(-1)[mismatch].tolist()}, got {actual.view(-1)[mismatch].tolist()}")
+    print(f"{name}: ok ({values.numel()} values)")
+
+
+def main():
+    inf, nan = float("inf"), float("nan")
+    # Equal-endpoint bins and an inf upper edge, as in configs/reduction_*.json
+    fine = [(0., 0.), (1., 1.), (2., 2.), (3., 3.), (4., inf)]
+    check(fine, torch.tensor([0., 1., 2., 3., 4., 5., 100., inf]), "equal-endpoint bins and inf upper edge")
+    # Values in the gaps between bins and outside of all bins go to class 0
+    check(fine, torch.tensor([0.5, 1.5, 2.999, 3.5, -1., -inf, 1e-6]), "gaps between bins and values below the first bin")
+    check(fine, torch.tensor([nan, 1., nan]), "NaN")
+    # Wider bins with gaps, and a finite last bin
+    coarse = [(0., 0.), (1., 2.), (3., 5.), (6., 10.)]
+    check(coarse, torch.tensor([0., 0.5, 1., 2., 2.5, 3., 5., 5.5, 6., 10., 10.5, inf, nan]), "wide bins with a finite last bin")
+
+    # Every bin configuration shipped with the repo, on integer counts plus non-integer values in between
+    generator = torch.Generator().manual_seed(0)
+    for reduction in [8, 16, 32]:
+        with open(os.path.join(parent_dir, "configs", f"reduction_{reduction}.json"), "r") as f:
+            config = json.load(f)
+        for truncation, datasets in config.items():
+            for dataset, dataset_config in datasets.items():
+                for granularity, bins in dataset_config["bins"].items():
+                    bins = [(float(b[0]), float(b[1])) for b in bins]
+                    values = torch.arange(0, bins[-1][0] + 3, 0.25)
+                    values = torch.cat([values, torch.rand(1000, generator=generator) * (bins[-1][0] + 3), torch.tensor([inf, nan])])
+                    check(bins, values, f"reduction {reduction}, truncation {truncation}, {dataset}, {granularity}")
+
+    print("All bin assignments match.")
+
+
+if __name__ == "__main__":
+    main()
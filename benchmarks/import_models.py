@@ -0,0 +1,44 @@
+# Measure how long `import models` takes in a fresh interpreter, and which modules dominate the import time
+import os, sys
+import subprocess
+import time
+import statistics
+from argparse import ArgumentParser
+
+parent_dir = os.path.abspath(os.path.join(os.path.dirname(__file__), ".."))
+
+
+parser = ArgumentParser(description="Benchmark the import time of the models package.")
+parser.add_argument("--module", type=str, default="models", help="The module to import.")
+parser.add_argument("--repeats", type=int, default=5, help="Number of fresh interpreters to time.")
+parser.add_argument("--top", type=int, default=15, help="Number of slowest modules to show from -X importtime.")
+parser.add_argument("--offline", action="store_true", help="Set CLIP_OFFLINE=1 so a missing CLIP weight fails instead of downloading.")
+
+
+def main():
+    args = parser.parse_args()
+    env = dict(os.environ)
+    if args.offline:
+        env["CLIP_OFFLINE"] = "1"
+
+    times = []
+    for _ in range(args.repeats):
+        start = time.perf_counter()
+        subprocess.run([sys.executable, "-c", f"import {args.module}"], cwd=parent_dir, env=env, check=True)
+        times.append(time.perf_counter() - start)
+    print(f"import {args.module}: median {statistics.median(times):.2f}s, min {min(times):.2f}s over {args.repeats} runs")
+
+    result = subprocess.run([sys.executable, "-X", "importtime", "-c", f"import {args.module}"], cwd=parent_dir, env=env, check=True, capture_output=True, text=True)
+    entries = []
+    for line in result.stderr.splitlines():
+        if not line.startswith("import time:") or "cumulative" in line:
+            continue
+        self_us, cumulative_us, name = line[len("import time:"):].split("|")
+        entries.append((int(cumulative_us), int(self_us), name.rstrip()))
+    print(f"{'cumulative (ms)':>16} {'self (ms)':>10}  module")
+    for cumulative_us, self_us, name in sorted(entries, reverse=True)[:args.top]:
+        print(f"{cumulative_us / 1000:>16.1f} {self_us / 1000:>10.1f}  {name}")
+
+
+if __name__ == "__main__":
+    main()
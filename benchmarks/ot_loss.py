@@ -0,0 +1,76 @@
+# Compare the batched OT loss (optionally log-domain or separable) with the per-sample loop: time per call, iterations and difference of the results
+import os, sys
+import time
+from argparse import ArgumentParser
+
+import torch
+
+parent_dir = os.path.abspath(os.path.join(os.path.dirname(__file__), ".."))
+sys.path.append(parent_dir)
+
+from losses.dm_loss import OTLoss
+
+
+parser = ArgumentParser(description="Benchmark the batched OT loss against the per-sample loop.")
+parser.add_argument("--input_size", type=int, default=448, help="The crop size.")
+parser.add_argument("--reduction", type=int, default=8, help="The reduction factor of the model.")
+parser.add_argument("--batch_size", type=int, default=8, help="Images per minibatch.")
+parser.add_argument("--max_points", type=int, default=500, help="Maximum number of annotated points per image.")
+parser.add_argument("--repeats", type=int, default=10, help="Number of timed calls.")
+parser.add_argument("--device", type=str, default="cuda" if torch.cuda.is_available() else "cpu", help="The device.")
+parser.add_argument("--seed", type=int, default=42, help="Random seed.")
+parser.add_argument("--num_of_iter_in_ot", type=int, default=100, help="Maximum number of Sinkhorn iterations.")
+parser.add_argument("--ot_tol", type=float, default=1e-9, help="Stopping tolerance of Sinkhorn.")
+parser.add_argument("--log_domain", action="store_true", help="Use the log-domain solver for the batched loss.")
+parser.add_argument("--separable", action="store_true", help="Use the separable-kernel solver for the batched loss.")
+
+
+def make_inputs(args) -> tuple:
+    generator = torch.Generator().manual_seed(args.seed)
+    size = args.input_size // args.reduction
+    pred_density = torch.rand(args.batch_size, 1, size, size, generator=generator).to(args.device)
+    normed_pred_density = pred_density / pred_density.sum(dim=(1, 2, 3), keepdim=True)
+    # Different numbers of points per image, including an empty one
+    num_points = torch.randint(0, args.max_points + 1, (args.batch_size,), generator=generator).tolist()
+    num_points[0] = 0
+    target_points = [(torch.rand(n, 2, generator=generator) * args.input_size).to(args.device) for n in num_points]
+    return pred_density, normed_pred_density, target_points
+
+
+def benchmark(loss_fn: OTLoss, inputs: tuple, repeats: int, device: str) -> tuple:
+    outputs = loss_fn(*inputs)
+    if device.startswith("cuda"):
+        torch.cuda.synchronize()
+    start = time.perf_counter()
+    for _ in range(repeats):
+        loss_fn(*inputs)
+    if device.startswith("cuda"):
+        torch.cuda.synchronize()
+    return outputs, (time.perf_counter() - start) / repeats
+
+
+def main():
+    args = parser.parse_args()
+    inputs = make_inputs(args)
+    if args.device.startswith("cuda"):
+        torch.cuda.reset_peak_memory_stats()
+
+    (loss, wd, ot_obj), per_sample_time = benchmark(OTLoss(args.input_size, args.reduction, norm_cood=False, num_of_iter_in_ot=args.num_of_iter_in_ot, batched=False, stop_thr=args.ot_tol), inputs, args.repeats, args.device)
+    if args.device.startswith("cuda"):
+        per_sample_memory = torch.cuda.max_memory_allocated()
+        torch.cuda.reset_peak_memory_stats()
+    batched_loss_fn = OTLoss(args.input_size, args.reduction, norm_cood=False, num_of_iter_in_ot=args.num_of_iter_in_ot, batched=True, log_domain=args.log_domain, separable=args.separable, stop_thr=args.ot_tol)
+    (batched_loss, batched_wd, batched_ot_obj), batched_time = benchmark(batched_loss_fn, inputs, args.repeats, args.device)
+
+    print(f"per-sample: {per_sample_time * 1000:.1f}ms, batched: {batched_time * 1000:.1f}ms, speedup {per_sample_time / batched_time:.2f}x")
+    print(f"mean iterations of the batched solver: {batched_loss_fn.iterations.item():.1f}")
+    if args.device.startswith("cuda"):
+        print(f"peak memory: {per_sample_memory / 2 ** 20:.0f} MB vs {torch.cuda.max_memory_allocated() / 2 ** 20:.0f} MB")
+    print(f"loss: {loss.item():.6e} vs {batched_loss.item():.6e}")
+    print(f"wasserstein distance: {wd:.6e} vs {batched_wd:.6e}")
+    print(f"ot objective: {ot_obj.item():.6e} vs {batched_ot_obj.item():.6e}")
+    assert torch.allclose(loss, batched_loss, rtol=1e-4, atol=1e-6), "Batched OT loss differs from the per-sample loss"
+
+
+if __name__ == "__main__":
+    main()
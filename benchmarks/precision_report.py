@@ -0,0 +1,104 @@
+# Compare the accuracy and latency of the AI precision options (fp16, bf16, int8) against the fp32 model.
+# int8_static is experimental: FX tracing may fail on some backbones (e.g. CLIP ModifiedResNet), which is reported instead of aborting.
+import os, sys
+import time
+from argparse import ArgumentParser
+from pathlib import Path
+
+import numpy as np
+import torch
+import torchvision.transforms.functional as TF
+from PIL import Image
+
+parent_dir = os.path.abspath(os.path.join(os.path.dirname(__file__), ".."))
+sys.path.append(parent_dir)
+
+from ai import AI
+from datasets import Crowd
+from utils.eval_utils import calculate_errors
+
+
+parser = ArgumentParser(description="Accuracy and latency report of the AI precision options.")
+parser.add_argument("--images", type=str, default=None, help="Folder of saved camera frames, errors are measured against the fp32 counts.")
+parser.add_argument("--dataset", type=str, default=None, help="Dataset whose val split is used, errors are also measured against the ground truth.")
+parser.add_argument("--max_images", type=int, default=100, help="Maximum number of images to evaluate.")
+parser.add_argument("--precisions", type=str, nargs="+", default=["fp16", "bf16", "int8_dynamic", "int8_static"], help="The precisions to compare with fp32.")
+parser.add_argument("--device", type=str, default="cuda", help="Device for fp32, fp16 and bf16. INT8 always runs on CPU.")
+parser.add_argument("--calibration_dir", type=str, default=None, help="Saved camera frames for static INT8 calibration, defaults to --images.")
+parser.add_argument("--calibration_size", type=int, default=32, help="Number of calibration frames.")
+parser.add_argument("--artifact", type=str, default=None, help="Model artifact to load instead of the default checkpoint.")
+
+
+def load_images(args) -> tuple:
+    """Returns (images, ground truth counts or None)."""
+    if args.images is not None:
+        paths = sorted(path for path in Path(args.images).rglob("*") if path.suffix.lower() in [".jpg", ".jpeg", ".png"])
+        return [Image.open(path).convert("RGB") for path in paths[:args.max_images]], None
+
+    dataset = Crowd(args.dataset, split="val")
+    mean, std = torch.tensor([0.485, 0.456, 0.406]).view(3, 1, 1), torch.tensor([0.229, 0.224, 0.225]).view(3, 1, 1)
+    images, gt_counts = [], []
+    for idx in range(min(len(dataset), args.max_images)):
+        image, labels, _ = dataset[idx]
+        images.append(TF.to_pil_image((image[0] * std + mean).clamp(0, 1)))
+        gt_counts.append(len(labels[0]))
+    return images, np.array(gt_counts, dtype=np.float32)
+
+
+def run(ai: AI, images: list) -> tuple:
+    """Returns (counts, seconds per image), after one warm-up pass."""
+    ai._predict_batch(images[:ai.max_batch_size])
+    start = time.perf_counter()
+    predictions = ai._predict_batch(images)
+    latency = (time.perf_counter() - start) / len(images)
+    return np.array([count for count, _ in predictions], dtype=np.float32), latency
+
+
+def make_ai(args, precision: str, device: str) -> AI:
+    return AI(camera_manager=None, device=device, precision=precision, artifact_path=args.artifact,
+              calibration_dir=args.calibration_dir or args.images, calibration_size=args.calibration_size)
+
+
+def main():
+    args = parser.parse_args()
+    assert args.images is not None or args.dataset is not None, "Either --images or --dataset is required."
+    images, gt_counts = load_images(args)
+    print(f"Evaluating on {len(images)} images.")
+
+    references = {}
+    rows = []
+    for precision in ["fp32"] + args.precisions:
+        device = "cpu" if precision.startswith("int8") else args.device
+        try:
+            ai = make_ai(args, precision, device)
+        except Exception as e:
+            print(f"{precision}: failed to prepare the model: {e}")
+            continue
+        try:
+            counts, latency = run(ai, images)
+        finally:
+            ai.close()
+        device = ai.device.type
+        if precision == "fp32":
+            references[device] = (counts, latency)
+        elif device not in references:
+            ai = make_ai(args, "fp32", device)
+            try:
+                references[device] = run(ai, images)
+            finally:
+                ai.close()
+        rows.append((precision, device, counts, latency))
+
+    print(f"{'precision':<14} {'device':<6} {'latency':>10} {'speedup':>8} {'MAE vs fp32':>12} {'MAE vs gt':>10} {'RMSE vs gt':>11}")
+    for precision, device, counts, latency in rows:
+        reference_counts, reference_latency = references[device]
+        vs_fp32 = calculate_errors(counts, reference_counts)
+        line = f"{precision:<14} {device:<6} {latency * 1000:>8.1f}ms {reference_latency / latency:>7.2f}x {vs_fp32['mae']:>12.2f}"
+        if gt_counts is not None:
+            vs_gt = calculate_errors(counts, gt_counts)
+            line += f" {vs_gt['mae']:>10.2f} {vs_gt['rmse']:>11.2f}"
+        print(line)
+
+
+if __name__ == "__main__":
+    main()
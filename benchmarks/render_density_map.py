@@ -0,0 +1,58 @@
+# Compare the time to render and save a density map with matplotlib (the old AI.save_density_map) and utils.render_utils
+import os, sys
+import time
+import tempfile
+from argparse import ArgumentParser
+
+import numpy as np
+import matplotlib
+matplotlib.use("Agg")
+from matplotlib import pyplot as plt
+
+parent_dir = os.path.abspath(os.path.join(os.path.dirname(__file__), ".."))
+sys.path.append(parent_dir)
+
+from utils.render_utils import save_density_overlay
+
+
+parser = ArgumentParser(description="Benchmark density map rendering.")
+parser.add_argument("--sizes", type=str, nargs="+", default=["640x480", "1280x720", "1920x1080", "2560x1440"], help="Frame sizes as WIDTHxHEIGHT.")
+parser.add_argument("--repeats", type=int, default=10, help="Number of renders per size.")
+parser.add_argument("--max_side", type=int, default=None, help="Downscale the OpenCV render to this longest side.")
+
+
+def save_density_map_matplotlib(frame: np.ndarray, density: np.ndarray, path: str) -> None:
+    fig, ax = plt.subplots(figsize=(12, 8))
+    ax.imshow(frame)
+    ax.imshow(density, cmap="jet", alpha=0.5, vmin=0, vmax=np.max(density) * 0.5)
+    ax.axis("off")
+    plt.savefig(path, bbox_inches="tight", pad_inches=0, dpi=150)
+    plt.close(fig)
+
+
+def benchmark(fn, repeats: int) -> float:
+    start = time.perf_counter()
+    for _ in range(repeats):
+        fn()
+    return (time.perf_counter() - start) / repeats
+
+
+def main():
+    args = parser.parse_args()
+    rng = np.random.default_rng(0)
+
+    print(f"{'size':>12} {'matplotlib (ms)':>16} {'opencv (ms)':>12} {'speedup':>8}")
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        for size in args.sizes:
+            width, height = map(int, size.split("x"))
+            frame = rng.integers(0, 256, size=(height, width, 3), dtype=np.uint8)
+            density = rng.random((height, width), dtype=np.float32) * 1e-3
+            path = os.path.join(tmp_dir, "density_map.png")
+
+            matplotlib_time = benchmark(lambda: save_density_map_matplotlib(frame, density, path), args.repeats)
+            opencv_time = benchmark(lambda: save_density_overlay(frame, density, path, max_side=args.max_side), args.repeats)
+            print(f"{size:>12} {matplotlib_time * 1000:>16.1f} {opencv_time * 1000:>12.1f} {matplotlib_time / opencv_time:>7.1f}x")
+
+
+if __name__ == "__main__":
+    main()
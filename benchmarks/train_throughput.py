@@ -0,0 +1,77 @@
+# Training throughput (images/sec) of FP32, FP16 and BF16 autocast, with and without channels-last, on synthetic batches
+import os, sys
+import json
+from argparse import ArgumentParser
+
+import torch
+from torch.optim import Adam
+
+parent_dir = os.path.abspath(os.path.join(os.path.dirname(__file__), ".."))
+sys.path.append(parent_dir)
+
+from models import get_model
+from losses import DACELoss
+from train import train
+
+
+parser = ArgumentParser(description="Benchmark the training throughput of the mixed-precision and channels-last options.")
+parser.add_argument("--models", type=str, nargs="+", default=["vgg19_ae", "resnet50_ae", "clip_resnet50", "clip_vit_b_16"], help="The models to benchmark.")
+parser.add_argument("--amp", type=str, nargs="+", default=["off", "fp16", "bf16"], choices=["off", "fp16", "bf16"], help="The precisions to compare.")
+parser.add_argument("--input_size", type=int, default=448, help="The crop size.")
+parser.add_argument("--reduction", type=int, default=8, choices=[8, 16, 32], help="The reduction factor of the model.")
+parser.add_argument("--truncation", type=int, default=4, help="The truncation of the count bins.")
+parser.add_argument("--batch_size", type=int, default=8, help="Images per step.")
+parser.add_argument("--max_points", type=int, default=300, help="Maximum number of annotated points per image.")
+parser.add_argument("--steps", type=int, default=20, help="Number of timed training steps, after as many warm-up steps.")
+parser.add_argument("--seed", type=int, default=42, help="Random seed.")
+
+
+def make_batches(args, num_batches: int) -> list:
+    generator = torch.Generator().manual_seed(args.seed)
+    batches = []
+    for _ in range(num_batches):
+        images = torch.randn(args.batch_size, 3, args.input_size, args.input_size, generator=generator)
+        points = [torch.rand(int(torch.randint(1, args.max_points + 1, (1,), generator=generator)), 2, generator=generator) * args.input_size for _ in range(args.batch_size)]
+        densities = torch.zeros(args.batch_size, 1, args.input_size, args.input_size)
+        for idx, p in enumerate(points):
+            p = p.long().clamp(0, args.input_size - 1)
+            densities[idx, 0].index_put_((p[:, 1], p[:, 0]), torch.ones(len(p)), accumulate=True)
+        batches.append((images, points, densities))
+    return batches
+
+
+def main():
+    args = parser.parse_args()
+    assert torch.cuda.is_available(), "This benchmark needs a CUDA device."
+    device = torch.device("cuda")
+
+    with open(os.path.join(parent_dir, "configs", f"reduction_{args.reduction}.json"), "r") as f:
+        config = json.load(f)[str(args.truncation)]["sha"]
+    bins = [(float(b[0]), float(b[1])) for b in config["bins"]["fine"]]
+    anchor_points = [float(p) for p in config["anchor_points"]["fine"]["average"]]
+    warmup, timed = make_batches(args, args.steps), make_batches(args, args.steps)
+
+    print(f"{'model':<16} {'amp':<5} {'channels_last':<14} {'images/sec':>11} {'speedup':>8}")
+    for name in args.models:
+        baseline = None
+        for amp in args.amp:
+            for channels_last in [False, True]:
+                model = get_model(name, input_size=args.input_size, reduction=args.reduction, bins=bins, anchor_points=anchor_points, prompt_type="number")
+                model = model.to(device, memory_format=torch.channels_last) if channels_last else model.to(device)
+                loss_fn = DACELoss(bins, args.reduction, count_loss="dmcount", input_size=args.input_size).to(device)
+                optimizer = Adam(filter(lambda p: p.requires_grad, model.parameters()), lr=1e-5)
+                scaler = torch.cuda.amp.GradScaler() if amp == "fp16" else None
+
+                train(model, warmup, loss_fn, optimizer, device, 0, 1, amp, scaler, channels_last)
+                torch.cuda.synchronize()
+                _, _, info = train(model, timed, loss_fn, optimizer, device, 0, 1, amp, scaler, channels_last)
+                throughput = info["images_per_sec"]
+                baseline = throughput if baseline is None else baseline
+                print(f"{name:<16} {amp:<5} {str(channels_last):<14} {throughput:>11.1f} {throughput / baseline:>7.2f}x")
+
+                del model, optimizer, loss_fn
+                torch.cuda.empty_cache()
+
+
+if __name__ == "__main__":
+    main()
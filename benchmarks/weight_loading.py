@@ -0,0 +1,83 @@
+# Measure load time and peak RSS of the CLIP weights with a regular torch.load, a memory mapped torch.load and safetensors
+import os, sys
+import json
+import resource
+import subprocess
+import time
+from argparse import ArgumentParser
+
+parent_dir = os.path.abspath(os.path.join(os.path.dirname(__file__), ".."))
+sys.path.append(parent_dir)
+
+modes = ["torch_load", "mmap", "safetensors"]
+
+parser = ArgumentParser(description="Benchmark loading the CLIP weights.")
+parser.add_argument("--models", type=str, nargs="+", default=None, help="The CLIP backbones, e.g. resnet50 vit_b_16. All prepared ones if not given.")
+parser.add_argument("--modes", type=str, nargs="+", default=modes, choices=modes, help="The loading methods to compare.")
+parser.add_argument("--convert", action="store_true", help="Convert the prepared .pth weights to .safetensors first.")
+parser.add_argument("--worker", type=str, nargs=2, default=None, metavar=("MODEL", "MODE"), help="Internal: measure one model and mode in this process.")
+
+
+def peak_rss_mb() -> float:
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024  # kilobytes on Linux
+
+
+def worker(name: str, mode: str) -> dict:
+    import torch
+    from models.clip import _clip
+    from models.weights import load_weights, assign_state_dict
+
+    weights_dir = os.path.join(os.path.dirname(os.path.abspath(_clip.__file__)), "weights")
+    path = os.path.join(weights_dir, f"clip_{name}.safetensors" if mode == "safetensors" else f"clip_{name}.pth")
+    if not os.path.exists(path):
+        return {"model": name, "mode": mode, "error": f"missing {os.path.basename(path)}"}
+
+    model = _clip._clip(name, pretrained=False)
+    baseline = peak_rss_mb()
+    start = time.perf_counter()
+    if mode == "torch_load":
+        model.load_state_dict(torch.load(path, map_location="cpu"))
+    else:
+        assign_state_dict(model, load_weights(path))
+    load_time = time.perf_counter() - start
+
+    # Run a forward pass so memory mapped pages that are actually used are counted as well
+    with torch.no_grad():
+        model.encode_image(torch.zeros(1, 3, *model.visual.input_resolution))
+    return {
+        "model": name,
+        "mode": mode,
+        "load_time": load_time,
+        "load_peak_rss_mb": peak_rss_mb() - baseline,
+        "file_size_mb": os.path.getsize(path) / 2 ** 20,
+    }
+
+
+def main():
+    args = parser.parse_args()
+    if args.worker is not None:
+        print(json.dumps(worker(*args.worker)))
+        return
+
+    if args.convert:
+        from models.clip._clip.prepare import convert_to_safetensors
+        convert_to_safetensors()
+
+    from models.clip._clip import clip_model_names
+    names = args.models if args.models is not None else [name[5:] for name in clip_model_names]
+
+    print(f"{'model':<16} {'mode':<12} {'load time':>10} {'peak RSS':>12} {'file size':>12}")
+    for name in names:
+        for mode in args.modes:
+            # A fresh interpreter per measurement, so the peak RSS of one run does not hide the next one
+            output = subprocess.run([sys.executable, os.path.abspath(__file__), "--worker", name, mode],
+                                    cwd=parent_dir, capture_output=True, text=True, check=True).stdout
+            result = json.loads(output.strip().splitlines()[-1])
+            if "error" in result:
+                print(f"{name:<16} {mode:<12} {result['error']}")
+                continue
+            print(f"{name:<16} {mode:<12} {result['load_time']:>9.2f}s {result['load_peak_rss_mb']:>9.0f} MB {result['file_size_mb']:>9.0f} MB")
+
+
+if __name__ == "__main__":
+    main()
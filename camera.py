@@ -3,11 +3,11 @@ import time
 import cv2
 import threading
 from dataclasses import dataclass, field
+from typing import Optional
 import logging
 
-import numpy as np
 from PIL import Image
-from utils.camera_utils import convert_to_pixel_coords, create_polygon_mask, apply_mask
+from utils.camera_utils import convert_to_pixel_coords, create_polygon_mask
 
 logger = logging.getLogger(__name__)
 
@@ -24,6 +24,10 @@ class CameraConfig:
                                                         [100, 0],
                                                         [100, 100]
                                                         ])
+    # "continuous" decodes every frame, "on_demand" only grabs packets and decodes when a snapshot is requested
+    decode_mode: str = "continuous"
+    # In "on_demand" mode, also decode a frame every decode_interval seconds (None to only decode on request)
+    decode_interval: Optional[float] = None
 
 
 class Camera:
@@ -35,6 +39,9 @@ class Camera:
         self.crop_polygon = camera_config.crop_polygon
         self.max_retries = max_retries
         self.retry_delay = retry_delay
+        assert camera_config.decode_mode in ["continuous", "on_demand"], f"Expected decode_mode to be 'continuous' or 'on_demand', got {camera_config.decode_mode}"
+        self.decode_mode = camera_config.decode_mode
+        self.decode_interval = camera_config.decode_interval
 
         self.__rtsp_url_with_auth = self.construct_url_with_auth()
 
@@ -42,12 +49,25 @@ class Camera:
         if not self.capture.isOpened():
             raise Exception(f"Error: Could not open video stream: {self.__rtsp_url_with_auth}")
 
-        self.frame = None
+        # Latest frame as a (frame, sequence number, capture time) tuple. The capture thread replaces the whole
+        # tuple, which is atomic, so readers never wait for capture.read() and always see a consistent frame.
+        self._latest = (None, 0, None)
         self.lock = threading.Lock()
+        self._snapshot_requested = threading.Event()
+        self._frame_ready = threading.Event()
+        self._last_decode_time = 0.0
+        self.decoded_frames = 0
+        self.skipped_frames = 0
+        # Crop box and cropped polygon mask, cached per stream resolution
+        self._roi_cache = None
         self.running = True
         self.thread = threading.Thread(target=self.update, daemon=True)
         self.thread.start()
 
+    @property
+    def frame(self):
+        return self._latest[0]
+
     @property
     def polygon_pixels(self):
         if self.crop_polygon is None:
@@ -79,14 +99,29 @@ class Camera:
 
     def update(self):
         """Continuously read frames from the camera in a separate thread."""
+        sequence = 0
         try:
             while self.running:
-                with self.lock:
+                if self.decode_mode == "continuous":
                     ret, frame = self.capture.read()
-                    if ret:
-                        self.frame = frame
-                    else:
-                        logger.error(f"Error capturing frame from {self.name}")
+                else:
+                    # Only grab the packet to keep the stream current, decode it when a frame is needed
+                    frame = None
+                    ret = self.capture.grab()
+                    if ret and self._should_decode():
+                        ret, frame = self.capture.retrieve()
+                        self._last_decode_time = time.time()
+
+                if ret and frame is None:
+                    self.skipped_frames += 1
+                elif ret:
+                    sequence += 1
+                    self.decoded_frames += 1
+                    self._latest = (frame, sequence, time.time())
+                    self._frame_ready.set()
+                else:
+                    logger.error(f"Error capturing frame from {self.name}")
+                    with self.lock:
                         if not self.reinitialize_capture():
                             logger.error(f"Camera {self.name} will stop due to persistent failure.")
                             self.running = False
@@ -94,30 +129,81 @@ class Camera:
             logger.exception(f"Unexpected error in camera {self.name}: {e}")
             self.running = False
 
-    def get_frame(self) -> Image:
-        with self.lock:
-            if self.frame is None:
-                return None
+    def _should_decode(self) -> bool:
+        if self._snapshot_requested.is_set():
+            self._snapshot_requested.clear()
+            return True
+        return self.decode_interval is not None and time.time() - self._last_decode_time >= self.decode_interval
 
-            # Convert frame to RGB
-            frame = cv2.cvtColor(self.frame, cv2.COLOR_BGR2RGB)
+    def request_snapshot(self):
+        """Ask the capture thread to decode the next grabbed frame. Does nothing in continuous mode."""
+        if self.decode_mode == "on_demand":
+            self._frame_ready.clear()
+            self._snapshot_requested.set()
 
-            # Create the polygon mask
-            mask = create_polygon_mask(frame.shape, self.polygon_pixels)
+    def wait_for_snapshot(self, timeout: float) -> bool:
+        """Wait until the requested frame has been decoded. Returns False on timeout."""
+        if self.decode_mode == "continuous":
+            return True
+        return self._frame_ready.wait(timeout)
+
+    def get_stats(self) -> dict:
+        return {
+            "decode_mode": self.decode_mode,
+            "decoded_frames": self.decoded_frames,
+            "skipped_frames": self.skipped_frames,
+        }
 
-            # Apply the mask to the frame to set pixels outside the polygon to black
-            masked_frame = apply_mask(frame, mask, fill_color=(0, 0, 0))
+    def _get_roi(self, frame_shape):
+        """
+        Return the bounding box (x, y, w, h) of the crop polygon and a boolean mask of the pixels outside the polygon
+        within that box. Computed once per stream resolution, since the polygon is fixed.
+        """
+        height, width = frame_shape[:2]
+        if self._roi_cache is not None and self._roi_cache[0] == (height, width):
+            return self._roi_cache[1], self._roi_cache[2]
+
+        if self.crop_polygon is None:
+            box, outside = (0, 0, width, height), None
+        else:
+            # Create the polygon mask
+            polygon = convert_to_pixel_coords(self.crop_polygon, width, height)
+            mask = create_polygon_mask(frame_shape, polygon)
 
             # Find the bounding box of the mask
             # The mask is binary, so the boundingRect function will return the rectangle
             # surrounding all non-zero pixels
-            x, y, w, h = cv2.boundingRect(mask.astype(np.uint8))
+            x, y, w, h = cv2.boundingRect(mask)
+            box, outside = (x, y, w, h), mask[y:y + h, x:x + w] == 0
 
-            # Crop the masked frame to the bounding box
-            cropped_frame = masked_frame[y:y + h, x:x + w]
+        logger.info(f"Computed crop box {box} for camera {self.name} at resolution {width}x{height}")
+        self._roi_cache = ((height, width), box, outside)
+        return box, outside
 
-            # Convert the cropped frame to a PIL Image and return it
-            return Image.fromarray(cropped_frame)
+    def get_snapshot(self):
+        """Return the latest frame with its sequence number and capture time, or None if no frame has been read yet."""
+        raw_frame, sequence, captured_at = self._latest
+        if raw_frame is None:
+            return None
+
+        # Crop to the bounding box of the polygon first so only the ROI pixels are converted and masked
+        (x, y, w, h), outside = self._get_roi(raw_frame.shape)
+        cropped_frame = cv2.cvtColor(raw_frame[y:y + h, x:x + w], cv2.COLOR_BGR2RGB)
+
+        # Set pixels outside the polygon to black, cvtColor returns a new array so this does not touch the raw frame
+        if outside is not None:
+            cropped_frame[outside] = 0
+
+        # Convert the cropped frame to a PIL Image
+        return {
+            "frame": Image.fromarray(cropped_frame),
+            "frame_seq": sequence,
+            "captured_at": captured_at,
+        }
+
+    def get_frame(self) -> Image:
+        snapshot = self.get_snapshot()
+        return snapshot["frame"] if snapshot is not None else None
 
     def release(self):
         self.running = False
@@ -132,9 +218,10 @@ class Camera:
 
 
 class CameraManager:
-    def __init__(self):
+    def __init__(self, snapshot_timeout: float = 2.0):
         self.cameras = []
         self.lock = threading.Lock()
+        self.snapshot_timeout = snapshot_timeout
 
     def add_camera(self, camera: Camera):
         """Add a new camera to the manager."""
@@ -145,18 +232,31 @@ class CameraManager:
         """Retrieve the latest frames from all cameras."""
         camera_frames = []
         with self.lock:
-            for camera in self.cameras:
-                frame = camera.get_frame()
-                if frame is not None:
-                    camera_frames.append({
-                        "camera": camera.name,
-                        "frame": frame,
-                        "timestamp": time.strftime("%Y-%m-%dT%H:%M:%S")
-                    })
-                else:
-                    logger.warning(f"No frame received from {camera.name}")
+            cameras = list(self.cameras)
+        # Request all snapshots first so cameras in on_demand mode decode their next frame in parallel
+        for camera in cameras:
+            camera.request_snapshot()
+        for camera in cameras:
+            if not camera.wait_for_snapshot(self.snapshot_timeout):
+                logger.warning(f"Timed out waiting for a new frame from {camera.name}, using the last decoded frame.")
+            snapshot = camera.get_snapshot()
+            if snapshot is not None:
+                camera_frames.append({
+                    "camera": camera.name,
+                    "frame": snapshot["frame"],
+                    "frame_seq": snapshot["frame_seq"],
+                    "captured_at": snapshot["captured_at"],
+                    "timestamp": time.strftime("%Y-%m-%dT%H:%M:%S")
+                })
+            else:
+                logger.warning(f"No frame received from {camera.name}")
         return camera_frames
 
+    def get_stats(self) -> dict:
+        """Decoded and skipped frame counts per camera."""
+        with self.lock:
+            return {camera.name: camera.get_stats() for camera in self.cameras}
+
     def display_frames(self, window_size=(320, 240)):
         """Display the frames from all cameras in resized windows."""
         while True:
@@ -1,3 +1,7 @@
+import json
+from datetime import datetime
+
+from sqlalchemy import insert, update, delete
 from sqlalchemy.orm import Session
 from . import models
 from database.fabric_lakehouse import save_predictions_to_lakehouse
@@ -51,6 +55,76 @@ def get_camera_by_name(db: Session, camera_name: str):
     return db.query(models.Camera).filter(models.Camera.camera_name == camera_name).first()
 
 
+def get_camera_ids(db: Session) -> dict:
+    """Map camera names to camera ids."""
+    return {camera_name: camera_id for camera_id, camera_name in db.query(models.Camera.camera_id, models.Camera.camera_name).all()}
+
+
+def create_prediction_bulk(db: Session, area_id: int, results: dict, camera_ids: dict, timestamp: datetime = None,
+                           outbox: bool = False):
+    """
+    Save a prediction and all its prediction details in a single transaction.
+    The camera ids are taken from camera_ids (see get_camera_ids) and the details are inserted with one executemany.
+    With outbox, the prediction is also added to the lakehouse outbox, see lakehouse_exporter.LakehouseExporter.
+    """
+    timestamp = timestamp if timestamp is not None else datetime.utcnow()
+    try:
+        db_prediction = models.Prediction(area_id=area_id, total_estimate=results["total"], timestamp=timestamp)
+        db.add(db_prediction)
+        db.flush()  # assigns prediction_id without committing
+
+        prediction_details = []
+        for camera_name, count in results.items():
+            if camera_name == "total":
+                continue
+            if camera_name not in camera_ids:
+                logger.warning(f"Unknown camera {camera_name}, skipping its prediction detail.")
+                continue
+            prediction_details.append({
+                "prediction_id": db_prediction.prediction_id,
+                "camera_id": camera_ids[camera_name],
+                "estimated_count": count,
+                "image_path": f"camera_{camera_name}_{timestamp.strftime('%Y-%m-%dT%H%M%S')}_count_{count}.jpg",
+                "timestamp": timestamp,
+            })
+        if len(prediction_details) > 0:
+            detail_ids = db.scalars(
+                insert(models.PredictionDetail).returning(models.PredictionDetail.detail_id, sort_by_parameter_order=True),
+                prediction_details
+            ).all()
+            for detail, detail_id in zip(prediction_details, detail_ids):
+                detail["detail_id"] = detail_id
+
+        # Queue the prediction for the lakehouse export in the same transaction
+        if outbox:
+            db.add(models.LakehouseOutbox(
+                prediction_id=db_prediction.prediction_id,
+                payload=json.dumps({
+                    "prediction_id": db_prediction.prediction_id,
+                    "area_id": area_id,
+                    "prediction_timestamp": timestamp.isoformat(),
+                    "total_estimate": results["total"],
+                    "details": [
+                        {
+                            "detail_id": detail["detail_id"],
+                            "image_path": detail["image_path"],
+                            "estimated_count": detail["estimated_count"],
+                        }
+                        for detail in prediction_details
+                    ],
+                }),
+                created_at=datetime.utcnow(),
+            ))
+
+        db.commit()
+    except Exception as e:
+        logger.error(f"Error saving predictions to database: {e}")
+        db.rollback()
+        raise e
+
+    return db_prediction
+
+
 def create_prediction(db: Session, area_id: int, results: dict):
     try:
         total_estimate = results["total"]
@@ -89,3 +163,24 @@ def create_prediction(db: Session, area_id: int, results: dict):
 
 
     return db_prediction
+
+
+def get_pending_outbox(db: Session, limit: int = None):
+    """Outbox rows that have not been exported to the lakehouse yet, oldest first."""
+    query = db.query(models.LakehouseOutbox).filter(models.LakehouseOutbox.exported_at.is_(None)).order_by(models.LakehouseOutbox.outbox_id)
+    return query.limit(limit).all() if limit is not None else query.all()
+
+
+def delete_outbox(db: Session, outbox_ids: list):
+    """Remove exported rows, so the outbox only holds predictions that still have to be exported."""
+    db.execute(delete(models.LakehouseOutbox).where(models.LakehouseOutbox.outbox_id.in_(outbox_ids)))
+    db.commit()
+
+
+def increment_outbox_attempts(db: Session, outbox_ids: list):
+    db.execute(
+        update(models.LakehouseOutbox)
+        .where(models.LakehouseOutbox.outbox_id.in_(outbox_ids))
+        .values(attempts=models.LakehouseOutbox.attempts + 1)
+    )
+    db.commit()
@@ -15,7 +15,10 @@ if "DB_CONNECTION_STR" not in os.environ:
 DATABASE_URL = os.getenv("DB_CONNECTION_STR", "sqlite:///./database/predictions.db")
 
 
-engine = create_engine(DATABASE_URL, connect_args={"check_same_thread": False})
+# Let pyodbc send executemany batches in one round trip to MSSQL
+engine_kwargs = {"fast_executemany": True} if DATABASE_URL.startswith("mssql") else {}
+
+engine = create_engine(DATABASE_URL, connect_args={"check_same_thread": False}, **engine_kwargs)
 
 SessionLocal = sessionmaker(autocommit=False, autoflush=False, bind=engine)
 
@@ -4,7 +4,8 @@ from typing import Literal
 from datetime import datetime, timezone
 
 import pandas as pd
-from deltalake import DeltaTable, write_deltalake
+from deltalake import DeltaTable, WriterProperties, write_deltalake
+from deltalake.exceptions import TableNotFoundError
 from pyarrow.dataset import ParquetFileFormat
 
 
@@ -14,13 +15,47 @@ STORAGE_OPTIONS = {
 }
 
 
+def lakehouse_table_uri(table_name: str) -> str:
+    """Location of a lakehouse table. Set LAKEHOUSE_PATH to write to a local folder instead of Fabric."""
+    local_path = os.getenv("LAKEHOUSE_PATH")
+    if local_path:
+        return os.path.join(local_path, table_name)
+    workspace = os.getenv("FABRIC_WORKSPACE", "FabricTest")
+    lakehouse = os.getenv("FABRIC_LAKEHOUSE", "AdHocLakeHouse")
+    return f"abfss://{workspace}@onelake.dfs.fabric.microsoft.com/{lakehouse}.Lakehouse/Tables/{table_name}"
+
+
+def _storage_options(table_uri: str):
+    return STORAGE_OPTIONS if table_uri.startswith("abfss://") else None
+
+
 def write_to_lakehouse(table_name: str, df: pd.DataFrame, mode: Literal["append", "overwrite"] = "append"):
-    workspace = "FabricTest"
-    lakehouse = "AdHocLakeHouse"
-    abfss_path = f"abfss://{workspace}@onelake.dfs.fabric.microsoft.com/{lakehouse}.Lakehouse/Tables/"
+    table_uri = lakehouse_table_uri(table_name)
     # Fabric don't support dictionary encoding
     file_options = ParquetFileFormat().make_write_options(use_dictionary=False)
-    write_deltalake(abfss_path + table_name, df, mode=mode, storage_options=STORAGE_OPTIONS, file_options=file_options)
+    write_deltalake(table_uri, df, mode=mode, storage_options=_storage_options(table_uri), file_options=file_options)
+
+
+def upsert_to_lakehouse(table_name: str, df: pd.DataFrame, key: str):
+    """
+    Insert the rows of df whose key is not in the table yet, in a single Delta commit.
+    Writing the same rows twice is a no-op, which makes retried exports idempotent.
+    """
+    table_uri = lakehouse_table_uri(table_name)
+    df = df.drop_duplicates(subset=[key])
+    try:
+        table = DeltaTable(table_uri, storage_options=_storage_options(table_uri))
+    except TableNotFoundError:
+        write_to_lakehouse(table_name, df, mode="append")
+        return
+
+    table.merge(
+        source=df,
+        predicate=f"target.{key} = source.{key}",
+        source_alias="source",
+        target_alias="target",
+        writer_properties=WriterProperties(dictionary_enabled=False),
+    ).when_not_matched_insert_all().execute()
 
 
 def save_predictions_to_lakehouse(prediction, prediction_details):
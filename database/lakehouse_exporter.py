@@ -0,0 +1,116 @@
+import json
+import threading
+import logging
+from datetime import datetime
+
+import pandas as pd
+from sqlalchemy.orm import Session
+
+from database.db import SessionLocal
+from database import crud
+from database.fabric_lakehouse import upsert_to_lakehouse
+
+logger = logging.getLogger(__name__)
+
+
+class LakehouseExporter:
+    """
+    Exports predictions from the lakehouse outbox table to the lakehouse in batches.
+
+    Every poll_interval seconds the pending outbox rows are checked and flushed as one Delta commit per table when
+    there are at least flush_size of them, or when the oldest has waited flush_interval seconds. A backlog is exported
+    in batches of at most flush_size rows. Rows are merged on prediction_id / detail_id, so a batch that is exported
+    again after a failure does not create duplicates. Exported rows are deleted from the outbox, rows that fail stay
+    in the outbox and are retried on the next flush.
+    """
+
+    def __init__(self, flush_size: int = 100, flush_interval: float = 900.0, poll_interval: float = 30.0,
+                 predictions_table: str = "crowdcounting_predictions",
+                 prediction_details_table: str = "crowdcounting_prediction_details"):
+        self.flush_size = flush_size
+        self.flush_interval = flush_interval
+        self.poll_interval = poll_interval
+        self.predictions_table = predictions_table
+        self.prediction_details_table = prediction_details_table
+
+        self.stop_event = threading.Event()
+        self.thread = None
+        self.exported = 0
+        self.failed_flushes = 0
+
+    def start(self):
+        self.stop_event.clear()
+        self.thread = threading.Thread(target=self.run, name="lakehouse-exporter", daemon=True)
+        self.thread.start()
+
+    def stop(self, timeout: float = 30.0):
+        self.stop_event.set()
+        if self.thread is not None:
+            self.thread.join(timeout)
+
+    def run(self):
+        while not self.stop_event.wait(self.poll_interval):
+            try:
+                self.flush()
+            except Exception as e:
+                logger.error(f"Error exporting predictions to lakehouse: {e}")
+
+    def flush(self, force: bool = False) -> int:
+        """Export the pending outbox rows if the size or time trigger is reached. Returns the number of exported predictions."""
+        db: Session = SessionLocal()
+        try:
+            pending = crud.get_pending_outbox(db, limit=self.flush_size)
+            if len(pending) == 0:
+                return 0
+            oldest_age = (datetime.utcnow() - pending[0].created_at).total_seconds()
+            if not force and len(pending) < self.flush_size and oldest_age < self.flush_interval:
+                return 0
+
+            exported = 0
+            while len(pending) > 0:
+                outbox_ids = [row.outbox_id for row in pending]
+                try:
+                    self.export([json.loads(row.payload) for row in pending])
+                except Exception as e:
+                    self.failed_flushes += 1
+                    crud.increment_outbox_attempts(db, outbox_ids)
+                    raise e
+
+                crud.delete_outbox(db, outbox_ids)
+                self.exported += len(outbox_ids)
+                exported += len(outbox_ids)
+                logger.info(f"Exported {len(outbox_ids)} predictions to lakehouse.")
+                if len(pending) < self.flush_size or self.stop_event.is_set():
+                    break
+                pending = crud.get_pending_outbox(db, limit=self.flush_size)
+            return exported
+        finally:
+            db.close()
+
+    def export(self, payloads: list):
+        prediction_df = pd.DataFrame([
+            {
+                "prediction_id": payload["prediction_id"],
+                "area_id": payload["area_id"],
+                "prediction_timestamp": datetime.fromisoformat(payload["prediction_timestamp"]),
+                "total_estimate": payload["total_estimate"],
+            }
+            for payload in payloads
+        ])
+
+        prediction_details_df = pd.DataFrame([
+            {
+                "detail_id": detail["detail_id"],
+                "prediction_id": payload["prediction_id"],
+                "image_path": detail["image_path"],
+                "estimated_count": detail["estimated_count"],
+                "prediction_timestamp": datetime.fromisoformat(payload["prediction_timestamp"]).strftime('%Y-%m-%d %H:%M:%S'),
+            }
+            for payload in payloads
+            for detail in payload["details"]
+        ])
+
+        # Details first: if the predictions commit fails, the whole batch is retried and the merge skips existing details
+        if len(prediction_details_df) > 0:
+            upsert_to_lakehouse(self.prediction_details_table, prediction_details_df, key="detail_id")
+        upsert_to_lakehouse(self.predictions_table, prediction_df, key="prediction_id")
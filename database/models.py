@@ -54,3 +54,16 @@ class PredictionDetail(Base):
 
     prediction = relationship("Prediction", back_populates="prediction_details")
     camera = relationship("Camera", back_populates="prediction_details")
+
+
+class LakehouseOutbox(Base):
+    __tablename__ = 'lakehouse_outbox'
+
+    outbox_id = Column(Integer, primary_key=True, autoincrement=True)
+    prediction_id = Column(Integer, ForeignKey('predictions.prediction_id'), nullable=False, unique=True)
+    payload = Column(Text, nullable=False)  # JSON with the prediction and its details
+    created_at = Column(DateTime, default=datetime.utcnow, nullable=False)
+    exported_at = Column(DateTime)
+    attempts = Column(Integer, default=0, nullable=False)
+
+    prediction = relationship("Prediction")
@@ -0,0 +1,142 @@
+import json
+import os
+import threading
+import time
+import logging
+from datetime import datetime
+from pathlib import Path
+from queue import Queue, Empty
+
+from sqlalchemy.exc import IntegrityError, DataError
+from sqlalchemy.orm import Session
+from database.db import SessionLocal
+from database import crud
+
+logger = logging.getLogger(__name__)
+
+
+class PredictionWriter:
+    """
+    Writes predictions to the database from a background thread.
+
+    Every submitted prediction is first written as a JSON file to a local spool folder and removed once it has
+    been committed, so predictions survive database outages and restarts. Spooled predictions left over from a
+    previous run are written when the writer starts. Failed writes are retried with exponential backoff, except for
+    permanent errors (constraint violations, bad data), whose spool files are moved to the quarantine folder so they do
+    not block the predictions queued after them. With outbox, every prediction is also queued for the lakehouse export.
+    """
+
+    def __init__(self, spool_dir: str = "database/spool", retry_delay: float = 5.0, max_retry_delay: float = 300.0,
+                 outbox: bool = False):
+        self.spool_dir = Path(spool_dir)
+        self.spool_dir.mkdir(parents=True, exist_ok=True)
+        self.quarantine_dir = self.spool_dir / "quarantine"  # unreadable spool files are moved here
+        self.retry_delay = retry_delay
+        self.max_retry_delay = max_retry_delay
+        self.outbox = outbox
+
+        self.queue = Queue()
+        self.camera_ids = {}
+        self.stop_event = threading.Event()
+        self.thread = None
+        self.written = 0
+        self.failed_attempts = 0
+        self.quarantined = 0
+
+    def start(self):
+        self.load_camera_ids()
+        spooled = sorted(self.spool_dir.glob("*.json"))
+        if len(spooled) > 0:
+            logger.info(f"Found {len(spooled)} spooled predictions from a previous run.")
+        for path in spooled:
+            self.queue.put(path)
+
+        self.stop_event.clear()
+        self.thread = threading.Thread(target=self.run, name="prediction-writer", daemon=True)
+        self.thread.start()
+
+    def stop(self, timeout: float = 10.0):
+        """Stop the writer. Predictions that could not be written stay in the spool folder for the next start."""
+        self.stop_event.set()
+        if self.thread is not None:
+            self.thread.join(timeout)
+
+    def load_camera_ids(self):
+        db: Session = SessionLocal()
+        try:
+            self.camera_ids = crud.get_camera_ids(db)
+        finally:
+            db.close()
+
+    def submit(self, area_id: int, results: dict, timestamp: datetime = None):
+        """Spool a prediction to disk and queue it for writing. Does not wait for the database."""
+        timestamp = timestamp if timestamp is not None else datetime.utcnow()
+        job = {"area_id": area_id, "results": results, "timestamp": timestamp.isoformat()}
+        path = self.spool_dir / f"{time.time_ns()}.json"
+        tmp_path = path.with_suffix(".tmp")
+        with open(tmp_path, "w", encoding="utf-8") as f:
+            json.dump(job, f)
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmp_path, path)
+        self.queue.put(path)
+
+    def pending(self) -> int:
+        return self.queue.qsize()
+
+    def run(self):
+        while not self.stop_event.is_set():
+            try:
+                path = self.queue.get(timeout=0.5)
+            except Empty:
+                continue
+            self.write(path)
+
+    def quarantine(self, path: Path):
+        """Move a spool file that cannot be read or written out of the spool folder, so it is not retried on every start."""
+        self.quarantine_dir.mkdir(parents=True, exist_ok=True)
+        try:
+            os.replace(path, self.quarantine_dir / path.name)
+            self.quarantined += 1
+        except OSError as e:
+            logger.error(f"Error moving spooled prediction {path.name} to quarantine: {e}")
+
+    def write(self, path: Path):
+        try:
+            with open(path, "r", encoding="utf-8") as f:
+                job = json.load(f)
+            assert isinstance(job, dict) and all(key in job for key in ["area_id", "results", "timestamp"]), f"missing keys in {job}"
+        except FileNotFoundError:
+            logger.warning(f"Spooled prediction {path.name} no longer exists, skipping it.")
+            return
+        except (OSError, ValueError, AssertionError) as e:  # JSONDecodeError and UnicodeDecodeError are ValueErrors
+            logger.error(f"Corrupt spooled prediction {path.name}, moving it to {self.quarantine_dir}: {e}")
+            self.quarantine(path)
+            return
+        if any(name != "total" and name not in self.camera_ids for name in job["results"]):
+            self.load_camera_ids()
+
+        delay = self.retry_delay
+        while True:
+            db: Session = SessionLocal()
+            try:
+                crud.create_prediction_bulk(db, job["area_id"], job["results"], self.camera_ids,
+                                            datetime.fromisoformat(job["timestamp"]), self.outbox)
+                path.unlink()
+                self.written += 1
+                return
+            except (IntegrityError, DataError, KeyError, ValueError) as e:
+                # Retrying does not help, e.g. a constraint violation or a malformed timestamp
+                self.failed_attempts += 1
+                logger.error(f"Permanent error writing prediction {path.name}, moving it to {self.quarantine_dir}: {e}")
+                self.quarantine(path)
+                return
+            except Exception as e:
+                self.failed_attempts += 1
+                logger.error(f"Error writing prediction {path.name}, retrying in {delay:.0f} seconds: {e}")
+            finally:
+                db.close()
+
+            if self.stop_event.wait(delay):
+                return
+            delay = min(delay * 2, self.max_retry_delay)
@@ -1,12 +1,12 @@
 from .crowd import Crowd, available_datasets, available_percentages, standardize_dataset_name, NWPUTest
 from .transforms import RandomCrop, Resize, RandomResizedCrop, RandomHorizontalFlip, Resize2Multiple, ZeroPad2Multiple
-from .transforms import ColorJitter, RandomGrayscale, GaussianBlur, RandomApply, PepperSaltNoise
+from .transforms import ColorJitter, RandomGrayscale, GaussianBlur, RandomApply, PepperSaltNoise, get_crop_params
 from .utils import collate_fn
 
 
 __all__ = [
     "Crowd", "available_datasets", "available_percentages", "standardize_dataset_name", "NWPUTest",
     "RandomCrop", "Resize", "RandomResizedCrop", "RandomHorizontalFlip", "Resize2Multiple", "ZeroPad2Multiple",
-    "ColorJitter", "RandomGrayscale", "GaussianBlur", "RandomApply", "PepperSaltNoise",
+    "ColorJitter", "RandomGrayscale", "GaussianBlur", "RandomApply", "PepperSaltNoise", "get_crop_params",
     "collate_fn",
 ]
@@ -9,6 +9,7 @@ import numpy as np
 from typing import Optional, Callable, Union, Tuple
 
 from .utils import get_id, generate_density_map
+from .transforms import get_crop_params
 
 curr_dir = os.path.dirname(os.path.abspath(__file__))
 
@@ -47,14 +48,17 @@ class Crowd(Dataset):
         sigma: Optional[float] = None,
         return_filename: bool = False,
         num_crops: int = 1,
+        return_crop_params: bool = False,
     ) -> None:
         """
-        Dataset for crowd counting.
+        Dataset for crowd counting. With return_crop_params=True (requires return_filename=True) the parameters of the
+        geometric transforms of every crop (see get_crop_params) are returned after the image names.
         """
         assert dataset.lower() in available_datasets, f"Dataset {dataset} is not available."
         assert split in ["train", "val"], f"Split {split} is not available."
         assert percentage in available_percentages, f"Percentage {percentage} is not available."
         assert num_crops > 0, f"num_crops should be positive, got {num_crops}."
+        assert return_filename or not return_crop_params, "return_crop_params requires return_filename."
 
         self.dataset = standardize_dataset_name(dataset)
         self.split = split
@@ -72,6 +76,7 @@ class Crowd(Dataset):
         self.sigma = sigma
         self.return_filename = return_filename
         self.num_crops = num_crops
+        self.return_crop_params = return_crop_params
 
     def __find_root__(self) -> None:
         # if self.dataset == "sha":
@@ -165,12 +170,17 @@ class Crowd(Dataset):
 
         label = torch.from_numpy(label).float()
 
+        crop_params = []
         if self.transforms is not None:
-            images_labels = [self.transforms(image.clone(), label.clone()) for _ in range(self.num_crops)]
+            images_labels = []
+            for _ in range(self.num_crops):
+                images_labels.append(self.transforms(image.clone(), label.clone()))
+                crop_params.append(get_crop_params(self.transforms))
             images, labels = zip(*images_labels)
         else:
             images = [image.clone() for _ in range(self.num_crops)]
             labels = [label.clone() for _ in range(self.num_crops)]
+            crop_params = [()] * self.num_crops
 
         images = [self.normalize(img) for img in images]
         if idx in self.indices:
@@ -182,7 +192,9 @@ class Crowd(Dataset):
         image_names = [image_name] * len(images)
         images = torch.stack(images, 0)
 
-        if self.return_filename:
+        if self.return_crop_params:
+            return images, labels, density_maps, image_names, crop_params
+        elif self.return_filename:
             return images, labels, density_maps, image_names
         else:
             return images, labels, density_maps
@@ -40,10 +40,20 @@ def _resize(
     return image, label
 
 
+def get_crop_params(transforms: Callable) -> Tuple:
+    """
+    Parameters of the last call of the geometric transforms in transforms (a single transform or a Compose), which
+    identify the region of the image a crop shows. Photometric transforms are ignored.
+    """
+    transforms = getattr(transforms, "transforms", [transforms])
+    return tuple(t.last_params for t in transforms if getattr(t, "last_params", None) is not None)
+
+
 class RandomCrop(object):
     def __init__(self, size: Tuple[int, int]) -> None:
         self.size = size
         assert len(self.size) == 2, f"size should be a tuple (h, w), got {self.size}."
+        self.last_params = None  # ("crop", top, left, height, width) of the last call
 
     def __call__(self, image: Tensor, label: Tensor) -> Tuple[Tensor, Tensor]:
         crop_height, crop_width = self.size
@@ -53,6 +63,7 @@ class RandomCrop(object):
         
         top = torch.randint(0, image_height - crop_height + 1, (1,)).item()
         left = torch.randint(0, image_width - crop_width + 1, (1,)).item()
+        self.last_params = ("crop", top, left, crop_height, crop_width)
         return _crop(image, label, top, left, crop_height, crop_width)
 
 
@@ -105,6 +116,7 @@ class RandomResizedCrop(object):
         self.scale = scale
         assert len(self.size) == 2, f"size should be a tuple (h, w), got {self.size}."
         assert 0 < self.scale[0] <= self.scale[1], f"scale should satisfy 0 < scale[0] <= scale[1], got {self.scale}."
+        self.last_params = None  # ("resized_crop", resized height, resized width, top, left, crop height, crop width) of the last call
 
     def __call__(self, image: Tensor, label: Tensor) -> Tuple[Tensor, Tensor]:
         out_height, out_width = self.size
@@ -123,6 +135,7 @@ class RandomResizedCrop(object):
         crop_height, crop_width = int(out_height * scale), int(out_width * scale)
 
         if crop_height <= in_height and crop_width <= in_width:  # directly crop and resize the image
+            resize_height, resize_width = in_height, in_width
             top = torch.randint(0, in_height - crop_height + 1, (1,)).item()
             left = torch.randint(0, in_width - crop_width + 1, (1,)).item()
 
@@ -134,6 +147,7 @@ class RandomResizedCrop(object):
             top = torch.randint(0, resize_height - crop_height + 1, (1,)).item()
             left = torch.randint(0, resize_width - crop_width + 1, (1,)).item()
 
+        self.last_params = ("resized_crop", resize_height, resize_width, top, left, crop_height, crop_width)
         image, label = _crop(image, label, top, left, crop_height, crop_width)
         return _resize(image, label, out_height, out_width)
         
@@ -142,9 +156,12 @@ class RandomHorizontalFlip(object):
     def __init__(self, p: float = 0.5) -> None:
         self.p = p
         assert 0 <= self.p <= 1, f"p should be in range [0, 1], got {self.p}."
+        self.last_params = None  # ("hflip", flipped) of the last call
 
     def __call__(self, image: Tensor, label: Tensor) -> Tuple[Tensor, Tensor]:
-        if torch.rand(1) < self.p:
+        flipped = bool(torch.rand(1) < self.p)
+        self.last_params = ("hflip", flipped)
+        if flipped:
             image = TF.hflip(image)
 
             if len(label) > 0:
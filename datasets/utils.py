@@ -32,7 +32,16 @@ def collate_fn(batch: List[Tensor]) -> Tuple[Tensor, List[Tensor], Tensor]:
     batch = list(zip(*batch))
     images = batch[0]
     assert len(images[0].shape) == 4, f"images should be a 4D tensor, got {images[0].shape}."
-    if len(batch) == 4:  # image, label, density_map, image_name
+    if len(batch) == 5:  # image, label, density_map, image_name, crop_params
+        images = torch.cat(images, 0)
+        points = [p for points_ in batch[1] for p in points_]
+        densities = torch.cat(batch[2], 0)
+        image_names = [name for names_ in batch[3] for name in names_]
+        crop_params = [params for params_ in batch[4] for params in params_]
+
+        return images, points, densities, image_names, crop_params
+
+    elif len(batch) == 4:  # image, label, density_map, image_name
         images = torch.cat(images, 0)
         points = batch[1]  # list of lists of tensors, flatten it
         points = [p for points_ in points for p in points_]
@@ -0,0 +1,84 @@
+import torch
+from argparse import ArgumentParser
+import os, json
+
+from models import get_model
+from models.artifact import export_artifact, load_artifact
+from models.weights import load_weights
+from models.onnx_export import export_onnx, verify_onnx, has_fixed_input_size
+
+
+parser = ArgumentParser(description="Export a trained checkpoint to a single-file model artifact or to ONNX.")
+parser.add_argument("--model", type=str, default="clip_resnet50", help="The model of the checkpoint.")
+parser.add_argument("--input_size", type=int, default=448, help="The size of the input image.")
+parser.add_argument("--reduction", type=int, default=8, choices=[8, 16, 32], help="The reduction factor of the model.")
+parser.add_argument("--truncation", type=int, default=4, help="The truncation of the count. Use -1 for a regression model without bins.")
+parser.add_argument("--anchor_points", type=str, default="average", choices=["average", "middle"], help="The representative count values of bins.")
+parser.add_argument("--prompt_type", type=str, default="word", choices=["word", "number"], help="The prompt type for CLIP.")
+parser.add_argument("--granularity", type=str, default="fine", choices=["fine", "dynamic", "coarse"], help="The granularity of bins.")
+parser.add_argument("--dataset", type=str, default="qnrf", help="The dataset the checkpoint was trained on.")
+parser.add_argument("--checkpoint", type=str, default="checkpoints/qnrf/clip_resnet50_word_448_8_4_fine_1.0_dmcount_aug/best_mae.pth", help="The checkpoint to export.")
+parser.add_argument("--output", type=str, default=None, help="The file to write. Defaults to checkpoints/<model>_<dataset>.safetensors, or .onnx with --format onnx.")
+parser.add_argument("--format", type=str, default="artifact", choices=["artifact", "onnx"], help="Export a safetensors artifact (CLIP models only) or an ONNX graph.")
+parser.add_argument("--opset", type=int, default=17, help="The ONNX opset version.")
+parser.add_argument("--no_verify", action="store_true", help="Do not reload the export and compare its output with the checkpoint.")
+
+
+def main():
+    args = parser.parse_args()
+    if args.output is None:
+        args.output = os.path.join("checkpoints", f"{args.model}_{args.dataset}" + (".onnx" if args.format == "onnx" else ".safetensors"))
+    if args.truncation < 0:
+        bins, anchor_points = None, None
+    else:
+        with open(os.path.join("configs", f"reduction_{args.reduction}.json"), "r") as f:
+            config = json.load(f)[str(args.truncation)][args.dataset]
+        bins = [(float(b[0]), float(b[1])) for b in config["bins"][args.granularity]]
+        anchor_points = [float(p) for p in config["anchor_points"][args.granularity][args.anchor_points]]
+
+    model = get_model(
+        backbone=args.model,
+        input_size=args.input_size,
+        reduction=args.reduction,
+        bins=bins,
+        anchor_points=anchor_points,
+        prompt_type=args.prompt_type,
+        pretrained=False,
+    )
+    model.load_state_dict(load_weights(args.checkpoint))
+    model.eval()
+
+    extra = {
+        "dataset": args.dataset,
+        "truncation": args.truncation,
+        "granularity": args.granularity,
+        "checkpoint": args.checkpoint,
+    }
+    os.makedirs(os.path.dirname(os.path.abspath(args.output)), exist_ok=True)
+    if args.format == "onnx":
+        export_onnx(model, args.output, input_size=args.input_size, opset_version=args.opset)
+        print(f"Exported {args.checkpoint} to {args.output} ({os.path.getsize(args.output) / 2 ** 20:.1f} MB)")
+        if not args.no_verify:
+            sizes = [(args.input_size, args.input_size)]
+            if not has_fixed_input_size(model):
+                sizes.append((args.input_size + 64, args.input_size * 3 // 2))
+            diffs = verify_onnx(model, args.output, sizes=sizes)
+            for (height, width), diff in zip(sizes, diffs):
+                print(f"Max absolute difference between PyTorch and ONNX Runtime density maps at {height}x{width}: {diff:.3e}")
+            assert max(diffs) < 1e-3, f"ONNX output differs from PyTorch by {max(diffs)}"
+        return
+
+    export_artifact(model, args.output, extra=extra)
+    print(f"Exported {args.checkpoint} to {args.output} ({os.path.getsize(args.output) / 2 ** 20:.1f} MB)")
+
+    if not args.no_verify:
+        loaded_model, _ = load_artifact(args.output)
+        image = torch.randn(1, 3, args.input_size, args.input_size)
+        with torch.no_grad():
+            diff = (model(image) - loaded_model(image)).abs().max().item()
+        print(f"Max absolute difference between checkpoint and artifact density maps: {diff:.3e}")
+        assert diff < 1e-4, f"Artifact output differs from the checkpoint by {diff}"
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,120 @@
+import threading
+import logging
+from concurrent.futures import ProcessPoolExecutor
+from queue import Queue, Full, Empty
+
+logger = logging.getLogger(__name__)
+
+
+class ImageWriterPool:
+    """
+    Long-lived pool of workers that save images in the background.
+
+    Tasks are (function, args) pairs put on a bounded queue. When the queue is full, drop_policy decides what happens:
+    "drop_oldest" discards the oldest queued task, "drop_newest" discards the new task and "block" waits for a free slot.
+    With the "process" backend the worker threads hand the encoding to a process pool, so the functions and their
+    arguments must be picklable (module level functions, PIL images and numpy arrays are).
+    """
+
+    def __init__(self, num_workers: int = 4, max_queue_size: int = 64, drop_policy: str = "drop_oldest", backend: str = "thread"):
+        assert num_workers > 0, f"Expected num_workers to be positive, got {num_workers}"
+        assert drop_policy in ["drop_oldest", "drop_newest", "block"], f"Expected drop_policy to be 'drop_oldest', 'drop_newest' or 'block', got {drop_policy}"
+        assert backend in ["thread", "process"], f"Expected backend to be 'thread' or 'process', got {backend}"
+        self.drop_policy = drop_policy
+        self.queue = Queue(maxsize=max_queue_size)
+        self.executor = ProcessPoolExecutor(max_workers=num_workers) if backend == "process" else None
+
+        self.lock = threading.Lock()
+        self.in_progress = 0
+        self.written = 0
+        self.failed = 0
+        self.dropped = 0
+
+        self.threads = []
+        for i in range(num_workers):
+            t = threading.Thread(target=self.worker, name=f"image-writer-{i}", daemon=True)
+            t.start()
+            self.threads.append(t)
+
+    def submit(self, fn, *args) -> bool:
+        """Queue a save task without waiting for it. Returns False if the task was dropped."""
+        item = (fn, args)
+        if self.drop_policy == "block":
+            self.queue.put(item)
+            return True
+        if self.drop_policy == "drop_newest":
+            try:
+                self.queue.put_nowait(item)
+                return True
+            except Full:
+                self._count_dropped()
+                return False
+
+        while True:
+            try:
+                self.queue.put_nowait(item)
+                return True
+            except Full:
+                try:
+                    self.queue.get_nowait()
+                    self.queue.task_done()
+                    self._count_dropped()
+                except Empty:
+                    pass
+
+    def _count_dropped(self):
+        with self.lock:
+            self.dropped += 1
+        logger.warning("Image writer queue is full, dropped an image.")
+
+    def worker(self):
+        while True:
+            item = self.queue.get()
+            if item is None:
+                self.queue.task_done()
+                break
+            fn, args = item
+            with self.lock:
+                self.in_progress += 1
+            try:
+                if self.executor is not None:
+                    self.executor.submit(fn, *args).result()
+                else:
+                    fn(*args)
+                with self.lock:
+                    self.written += 1
+            except Exception as e:
+                logger.error(f"Error saving image: {e}")
+                with self.lock:
+                    self.failed += 1
+            finally:
+                with self.lock:
+                    self.in_progress -= 1
+                self.queue.task_done()
+
+    def pending(self) -> int:
+        with self.lock:
+            return self.queue.qsize() + self.in_progress
+
+    def stats(self) -> dict:
+        with self.lock:
+            return {
+                "pending": self.queue.qsize() + self.in_progress,
+                "written": self.written,
+                "failed": self.failed,
+                "dropped": self.dropped,
+            }
+
+    def join(self):
+        """Wait until all queued images have been written."""
+        self.queue.join()
+
+    def shutdown(self, wait: bool = True):
+        if wait:
+            self.join()
+        for _ in self.threads:
+            self.queue.put(None)
+        for t in self.threads:
+            t.join()
+        if self.executor is not None:
+            self.executor.shutdown(wait=wait)
@@ -1,7 +1,8 @@
 # Code modified from https://github.com/cvlab-stonybrook/DM-Count/blob/master/losses/bregman_pytorch.py
+import math
 import torch
 from torch import Tensor
-from typing import Union, Tuple, Dict
+from typing import Union, Tuple, Dict, Optional
 
 M_EPS = 1e-16
 
@@ -140,3 +141,283 @@ def sinkhorn(
         return P, log
     else:
         return P
+
+
+def sinkhorn_batched(
+    a: Tensor,
+    b: Tensor,
+    C: Tensor,
+    reg: float = 1e-1,
+    maxIter: int = 1000,
+    stopThr: float = 1e-9,
+    eval_freq: int = 10,
+) -> Tuple[Tensor, Dict[str, Tensor]]:
+    """
+    Batched version of `sinkhorn` for a minibatch of OT problems of different sizes, padded to the same size.
+
+    Parameters
+    ----------
+    a : torch.tensor (B, na)
+        samples measures in the target domain, zero for padded samples
+    b : torch.tensor (B, nb)
+        samples measures in the source domain
+    C : torch.tensor (B, na, nb)
+        loss matrices, padded rows must be finite (e.g. zero)
+    reg : float
+        Regularization term > 0
+    maxIter : int, optional
+        Max number of iterations
+    stopThr : float, optional
+        Stop threshold on the error of each problem ( > 0 )
+    eval_freq : int, optional
+        Check the errors every eval_freq iterations
+
+    Every problem stops updating once its own error is below stopThr, or when it runs into numerical errors (it then
+    keeps the previous iterate), so each result matches `sinkhorn` on the unpadded problem. The checks stay on the
+    device, the only synchronization is whether any problem is still running, once every eval_freq iterations.
+
+    Returns
+    -------
+    gamma : (B, na, nb) torch.tensor
+        Optimal transportation matrices
+    log : dict
+        u, v, alpha, beta of every problem, the errors at the last check, the iterations per problem and the total
+        number of iterations. A problem that hit a numerical error stops for good, like the break in `sinkhorn`, and
+        is not checked again: its err stays at the value of its last check before the error (1 if there was none)
+        and does not describe the returned iterate.
+    """
+    batch_size, na, nb = C.shape
+    assert a.shape == (batch_size, na) and b.shape == (batch_size, nb), f"Shape of a ({a.shape}) or b ({b.shape}) does not match that of C ({C.shape})"
+    assert reg > 0, f"reg should be greater than 0. Found reg = {reg}"
+
+    # Same initialization as sinkhorn: uniform over the actual (unpadded) samples
+    num_a = (a > 0).sum(dim=1, keepdim=True).clamp(min=1)
+    u = (a > 0).to(a.dtype) / num_a
+    v = torch.ones_like(b) / nb
+
+    K = torch.exp(C / -reg)
+
+    active = torch.ones(batch_size, dtype=torch.bool, device=C.device)
+    iterations = torch.zeros(batch_size, dtype=torch.long, device=C.device)
+    err = torch.ones(batch_size, dtype=C.dtype, device=C.device)
+
+    it = 1
+    while it <= maxIter:
+        KTu = torch.bmm(u.unsqueeze(1), K).squeeze(1)  # (B, nb)
+        v_new = torch.div(b, KTu + M_EPS)
+        Kv = torch.bmm(K, v_new.unsqueeze(2)).squeeze(2)  # (B, na)
+        u_new = torch.div(a, Kv + M_EPS)
+
+        # Problems with numerical errors keep their previous iterate and stop, like the break in sinkhorn
+        invalid = ~(torch.isfinite(u_new).all(dim=1) & torch.isfinite(v_new).all(dim=1))
+        update = active & ~invalid
+        u = torch.where(update.unsqueeze(1), u_new, u)
+        v = torch.where(update.unsqueeze(1), v_new, v)
+        iterations += update.long()
+        active = update
+
+        if it % eval_freq == 0:
+            b_hat = torch.bmm(u.unsqueeze(1), K).squeeze(1) * v
+            err = torch.where(active, (b - b_hat).pow(2).sum(dim=1), err)
+            active = active & (err > stopThr)
+            if not active.any():
+                break
+
+        it += 1
+
+    log = {
+        "err": err,
+        "u": u,
+        "v": v,
+        "alpha": reg * torch.log(u + M_EPS),
+        "beta": reg * torch.log(v + M_EPS),
+        "iterations": iterations,
+        "it": min(it, maxIter),
+    }
+
+    # transport plans
+    P = u.unsqueeze(2) * K * v.unsqueeze(1)
+    return P, log
+
+
+def sinkhorn_separable_batched(
+    a: Tensor,
+    b: Tensor,
+    Cx: Tensor,
+    Cy: Tensor,
+    reg: float = 1e-1,
+    maxIter: int = 1000,
+    stopThr: float = 1e-9,
+    eval_freq: int = 10,
+) -> Tuple[Tensor, Dict[str, Tensor]]:
+    """
+    Version of `sinkhorn_batched` for a source domain that is an H x W grid and a cost that is separable in y and x,
+    C[i, r * W + c] = Cy[i, r] + Cx[i, c], like the squared Euclidean distance. The Gibbs kernel of every target sample
+    is then the outer product exp(-Cy[i] / reg) x exp(-Cx[i] / reg) and is applied as two small matrix products, so
+    neither C nor K of size (B, na, H * W) is ever materialized and the memory is O(na * (H + W)).
+
+    Parameters
+    ----------
+    a : torch.tensor (B, na)
+        samples measures in the target domain, zero for padded samples
+    b : torch.tensor (B, H * W)
+        samples measures in the source domain, row-major over the grid
+    Cx : torch.tensor (B, na, W)
+        x part of the loss matrices, padded rows must be finite (e.g. zero)
+    Cy : torch.tensor (B, na, H)
+        y part of the loss matrices, padded rows must be finite (e.g. zero)
+    reg, maxIter, stopThr, eval_freq :
+        as in `sinkhorn_batched`
+
+    Returns
+    -------
+    cost : (B,) torch.tensor
+        Transport costs <C, gamma> of the optimal transportation matrices, which are not formed either
+    log : dict
+        as in `sinkhorn_batched`, including that err of a problem stopped by a numerical error is the value of its
+        last check before the error
+    """
+    batch_size, na, width = Cx.shape
+    height = Cy.size(2)
+    nb = height * width
+    assert Cy.shape == (batch_size, na, height), f"Shape of Cy ({Cy.shape}) does not match that of Cx ({Cx.shape})"
+    assert a.shape == (batch_size, na) and b.shape == (batch_size, nb), f"Shape of a ({a.shape}) or b ({b.shape}) does not match the grid {height}x{width}"
+    assert reg > 0, f"reg should be greater than 0. Found reg = {reg}"
+
+    def apply_KT(u: Tensor, Ky: Tensor, Kx: Tensor) -> Tensor:  # (B, na) -> (B, nb)
+        return torch.bmm((Ky * u.unsqueeze(2)).transpose(1, 2), Kx).view(batch_size, nb)
+
+    def apply_K(v: Tensor, Ky: Tensor, Kx: Tensor) -> Tensor:  # (B, nb) -> (B, na)
+        return (torch.bmm(Ky, v.view(batch_size, height, width)) * Kx).sum(dim=2)
+
+    # Same initialization as sinkhorn: uniform over the actual (unpadded) samples
+    num_a = (a > 0).sum(dim=1, keepdim=True).clamp(min=1)
+    u = (a > 0).to(a.dtype) / num_a
+    v = torch.ones_like(b) / nb
+
+    Kx = torch.exp(Cx / -reg)
+    Ky = torch.exp(Cy / -reg)
+
+    active = torch.ones(batch_size, dtype=torch.bool, device=Cx.device)
+    iterations = torch.zeros(batch_size, dtype=torch.long, device=Cx.device)
+    err = torch.ones(batch_size, dtype=Cx.dtype, device=Cx.device)
+
+    it = 1
+    while it <= maxIter:
+        v_new = torch.div(b, apply_KT(u, Ky, Kx) + M_EPS)
+        u_new = torch.div(a, apply_K(v_new, Ky, Kx) + M_EPS)
+
+        # Problems with numerical errors keep their previous iterate and stop, like the break in sinkhorn
+        invalid = ~(torch.isfinite(u_new).all(dim=1) & torch.isfinite(v_new).all(dim=1))
+        update = active & ~invalid
+        u = torch.where(update.unsqueeze(1), u_new, u)
+        v = torch.where(update.unsqueeze(1), v_new, v)
+        iterations += update.long()
+        active = update
+
+        if it % eval_freq == 0:
+            b_hat = apply_KT(u, Ky, Kx) * v
+            err = torch.where(active, (b - b_hat).pow(2).sum(dim=1), err)
+            active = active & (err > stopThr)
+            if not active.any():
+                break
+
+        it += 1
+
+    log = {
+        "err": err,
+        "u": u,
+        "v": v,
+        "alpha": reg * torch.log(u + M_EPS),
+        "beta": reg * torch.log(v + M_EPS),
+        "iterations": iterations,
+        "it": min(it, maxIter),
+    }
+
+    # <C, gamma> = sum_i u_i sum_{r, c} (Cy[i, r] + Cx[i, c]) Ky[i, r] Kx[i, c] v[r, c]
+    cost = (u * (apply_K(v, Cy * Ky, Kx) + apply_K(v, Ky, Cx * Kx))).sum(dim=1)
+    return cost, log
+
+
+def sinkhorn_log_batched(
+    a: Tensor,
+    b: Tensor,
+    C: Tensor,
+    reg: float = 1e-1,
+    maxIter: int = 1000,
+    stopThr: float = 1e-9,
+    eval_freq: int = 10,
+    g_init: Optional[Tensor] = None,
+    warm: Optional[Tensor] = None,
+) -> Tuple[Tensor, Dict[str, Tensor]]:
+    """
+    Log-domain stabilized version of `sinkhorn_batched`. The dual potentials f = reg * log(u) and g = reg * log(v) are
+    updated with logsumexp instead of multiplying with K = exp(-C / reg), so small reg or large costs do not underflow
+    to zero and the iterations never produce NaN or Inf.
+
+    Parameters
+    ----------
+    a, b, C, reg, maxIter, stopThr, eval_freq :
+        as in `sinkhorn_batched`
+    g_init : torch.tensor (B, nb), optional
+        warm start of the source potentials, e.g. log["g"] of an earlier solve of a similar problem
+    warm : torch.tensor (B,) bool, optional
+        which problems use g_init, the others start from uniform u like `sinkhorn`. All of them if not given.
+
+    Returns
+    -------
+    gamma : (B, na, nb) torch.tensor
+        Optimal transportation matrices
+    log : dict
+        f, g, alpha and beta of every problem (beta = reg * log(v + M_EPS), same as `sinkhorn`), the errors at the
+        last check, the iterations per problem and the total number of iterations
+    """
+    batch_size, na, nb = C.shape
+    assert a.shape == (batch_size, na) and b.shape == (batch_size, nb), f"Shape of a ({a.shape}) or b ({b.shape}) does not match that of C ({C.shape})"
+    assert reg > 0, f"reg should be greater than 0. Found reg = {reg}"
+
+    log_a, log_b = torch.log(a), torch.log(b)  # -inf for padded samples and empty cells, which carry no mass
+
+    # Same initialization as sinkhorn, u uniform over the actual (unpadded) samples
+    num_a = (a > 0).sum(dim=1, keepdim=True).clamp(min=1)
+    f = torch.where(a > 0, reg * -torch.log(num_a.to(a.dtype)), torch.full_like(a, -float("inf")))
+    if g_init is not None:
+        f_warm = reg * (log_a - torch.logsumexp((g_init.unsqueeze(1) - C) / reg, dim=2))
+        f = f_warm if warm is None else torch.where(warm.unsqueeze(1), f_warm, f)
+
+    g = torch.zeros_like(b)
+    active = torch.ones(batch_size, dtype=torch.bool, device=C.device)
+    iterations = torch.zeros(batch_size, dtype=torch.long, device=C.device)
+    err = torch.ones(batch_size, dtype=C.dtype, device=C.device)
+
+    it = 1
+    while it <= maxIter:
+        g_new = reg * (log_b - torch.logsumexp((f.unsqueeze(2) - C) / reg, dim=1))
+        f_new = reg * (log_a - torch.logsumexp((g_new.unsqueeze(1) - C) / reg, dim=2))
+        # Problems that converged keep their potentials
+        f = torch.where(active.unsqueeze(1), f_new, f)
+        g = torch.where(active.unsqueeze(1), g_new, g)
+        iterations += active.long()
+
+        if it % eval_freq == 0:
+            b_hat = torch.exp(g / reg + torch.logsumexp((f.unsqueeze(2) - C) / reg, dim=1))
+            err = torch.where(active, (b - b_hat).pow(2).sum(dim=1), err)
+            active = active & (err > stopThr)
+            if not active.any():
+                break
+
+        it += 1
+
+    log = {
+        "err": err,
+        "f": f,
+        "g": g,
+        "alpha": f,
+        "beta": reg * torch.logaddexp(g / reg, torch.full_like(g, math.log(M_EPS))),
+        "iterations": iterations,
+        "it": min(it, maxIter),
+    }
+
+    # transport plans
+    P = torch.nan_to_num(torch.exp((f.unsqueeze(2) + g.unsqueeze(1) - C) / reg))
+    return P, log
@@ -1,6 +1,6 @@
 import torch
 from torch import nn, Tensor
-from typing import Any, List, Tuple, Dict
+from typing import Any, List, Tuple, Dict, Optional
 
 from .dm_loss import DMLoss
 from .utils import _reshape_density
@@ -19,7 +19,13 @@ class DACELoss(nn.Module):
         assert len(bins) > 0, f"Expected at least one bin, got {bins}"
         assert all([len(b) == 2 for b in bins]), f"Expected all bins to be of length 2, got {bins}"
         assert all([b[0] <= b[1] for b in bins]), f"Expected all bins to be in increasing order, got {bins}"
+        # Stricter than before _bin_count used bucketize: unsorted or overlapping bins used to be accepted (later bins
+        # won for values in several of them) and are now rejected. All configs/reduction_*.json bins pass.
+        assert all([bins[i][1] < bins[i + 1][0] for i in range(len(bins) - 1)]), f"Expected bins to be sorted and disjoint, got {bins}"
         self.bins = bins
+        # Bin edges for _bin_count, the last upper edge can be inf
+        self.register_buffer("bin_lows", torch.tensor([float(b[0]) for b in bins]), persistent=False)
+        self.register_buffer("bin_highs", torch.tensor([float(b[1]) for b in bins]), persistent=False)
         self.reduction = reduction
         self.cross_entropy_fn = nn.CrossEntropyLoss(reduction="none")
 
@@ -40,13 +46,22 @@ class DACELoss(nn.Module):
         self.weight_count_loss = weight_count_loss
 
     def _bin_count(self, density_map: Tensor) -> Tensor:
-        class_map = torch.zeros_like(density_map, dtype=torch.long)
-        for idx, (low, high) in enumerate(self.bins):
-            mask = (density_map >= low) & (density_map <= high)
-            class_map[mask] = idx
+        # The last bin whose lower edge is <= the value, values outside every bin (gaps between bins, below the first one) go to class 0
+        lows, highs = self.bin_lows.to(density_map.dtype), self.bin_highs.to(density_map.dtype)
+        class_map = (torch.bucketize(density_map, lows, right=True) - 1).clamp_(0, len(self.bins) - 1)
+        inside = (density_map >= lows[class_map]) & (density_map <= highs[class_map])
+        class_map = torch.where(inside, class_map, torch.zeros_like(class_map))
         return class_map.squeeze(1)  # remove channel dimension
 
-    def forward(self, pred_class: Tensor, pred_density: Tensor, target_density: Tensor, target_points: List[Tensor]) -> Tuple[Tensor, Dict[str, Tensor]]:
+    def forward(
+        self,
+        pred_class: Tensor,
+        pred_density: Tensor,
+        target_density: Tensor,
+        target_points: List[Tensor],
+        image_names: Optional[List[str]] = None,
+        crop_params: Optional[List[Tuple]] = None,
+    ) -> Tuple[Tensor, Dict[str, Tensor]]:
         target_density = _reshape_density(target_density, reduction=self.reduction) if target_density.shape[-2:] != pred_density.shape[-2:] else target_density
         assert pred_density.shape == target_density.shape, f"Expected pred_density and target_density to have the same shape, got {pred_density.shape} and {target_density.shape}"
 
@@ -55,7 +70,7 @@ class DACELoss(nn.Module):
         cross_entropy_loss = self.cross_entropy_fn(pred_class, target_class).sum(dim=(-1, -2)).mean()
 
         if self.use_dm_loss:
-            count_loss, loss_info = self.count_loss_fn(pred_density, target_density, target_points)
+            count_loss, loss_info = self.count_loss_fn(pred_density, target_density, target_points, image_names, crop_params)
             loss_info["ce_loss"] = cross_entropy_loss.detach()
         else:
             count_loss = self.count_loss_fn(pred_density, target_density).sum(dim=(-1, -2, -3)).mean()
@@ -1,8 +1,12 @@
+from collections import OrderedDict
+
 import torch
 from torch import nn, Tensor
-from typing import List, Any, Tuple, Dict
+from typing import List, Any, Tuple, Dict, Optional
+
+from torch.nn.utils.rnn import pad_sequence
 
-from .bregman_pytorch import sinkhorn
+from .bregman_pytorch import sinkhorn, sinkhorn_batched, sinkhorn_log_batched, sinkhorn_separable_batched
 from .utils import _reshape_density
 
 EPS = 1e-8
@@ -15,16 +19,47 @@ class OTLoss(nn.Module):
         reduction: int,
         norm_cood: bool,
         num_of_iter_in_ot: int = 100,
-        reg: float = 10.0
+        reg: float = 10.0,
+        batched: bool = True,
+        log_domain: bool = False,
+        stop_thr: float = 1e-9,
+        warm_start: bool = False,
+        separable: bool = False,
+        warm_start_cache_size: int = 4096,
     ) -> None:
+        """
+        With batched=True the OT problems of all images in the minibatch are solved together by sinkhorn_batched,
+        with the point sets padded to the largest one. batched=False solves them one by one with sinkhorn.
+
+        log_domain=True uses the stabilized sinkhorn_log_batched instead. Every problem stops once the error of its
+        marginal drops below stop_thr, num_of_iter_in_ot is only the upper bound. With warm_start=True the potentials
+        of every crop are kept and used as the starting point when the same crop of the same image comes up again,
+        which needs the image names and crop parameters (see datasets.get_crop_params) in forward. Crop positions are
+        compared in units of density cells. At most warm_start_cache_size crops are kept, least recently used first out.
+
+        separable=True uses sinkhorn_separable_batched, which applies the Gibbs kernel of the squared distance as
+        separate x and y factors and never builds the [B, #gt, #cood * #cood] cost.
+        """
         super().__init__()
         assert input_size % reduction == 0
+        assert batched or not (log_domain or warm_start), "log_domain and warm_start are only supported with batched=True"
+        assert log_domain or not warm_start, "warm_start needs log_domain=True"
+        assert batched or not separable, "separable is only supported with batched=True"
+        assert not (separable and log_domain), "separable and log_domain cannot be combined"
 
         self.input_size = input_size
         self.reduction = reduction
         self.norm_cood = norm_cood
         self.num_of_iter_in_ot = num_of_iter_in_ot
         self.reg = reg
+        self.batched = batched
+        self.log_domain = log_domain
+        self.stop_thr = stop_thr
+        self.warm_start = warm_start
+        self.separable = separable
+        self.warm_start_cache_size = warm_start_cache_size
+        self.potentials = OrderedDict()  # (image name, crop) -> g of the last solve, in least recently used order
+        self.iterations = None  # mean number of Sinkhorn iterations of the last batched call
 
         # coordinate is same to image space, set to constant since crop size is same
         self.cood = torch.arange(0, input_size, step=reduction, dtype=torch.float32) + reduction / 2
@@ -33,7 +68,109 @@ class OTLoss(nn.Module):
         self.cood = self.cood / input_size * 2 - 1 if self.norm_cood else self.cood
         self.output_size = self.cood.size(1)
 
-    def forward(self, pred_density: Tensor, normed_pred_density: Tensor, target_points: List[Tensor]) -> Tuple[Tensor, float, Tensor]:
+    def forward(
+        self,
+        pred_density: Tensor,
+        normed_pred_density: Tensor,
+        target_points: List[Tensor],
+        image_names: Optional[List[str]] = None,
+        crop_params: Optional[List[Tuple]] = None,
+    ) -> Tuple[Tensor, float, Tensor]:
+        if self.batched:
+            return self._forward_batched(pred_density, normed_pred_density, target_points, image_names, crop_params)
+        return self._forward_per_sample(pred_density, normed_pred_density, target_points)
+
+    def _potential_key(self, image_name: str, crop_params: Tuple) -> Tuple:
+        # Offsets and sizes in density cells, crops that differ by less than a cell pose nearly the same OT problem
+        crop = tuple(
+            tuple(round(v / self.reduction) if isinstance(v, int) and not isinstance(v, bool) else v for v in params)
+            for params in crop_params
+        )
+        return image_name, crop
+
+    def _get_potential(self, key: Tuple) -> Optional[Tensor]:
+        g = self.potentials.get(key)
+        if g is not None:
+            self.potentials.move_to_end(key)
+        return g
+
+    def _set_potential(self, key: Tuple, g: Tensor) -> None:
+        self.potentials[key] = g
+        self.potentials.move_to_end(key)
+        while len(self.potentials) > self.warm_start_cache_size:
+            self.potentials.popitem(last=False)
+
+    def _forward_batched(
+        self,
+        pred_density: Tensor,
+        normed_pred_density: Tensor,
+        target_points: List[Tensor],
+        image_names: Optional[List[str]] = None,
+        crop_params: Optional[List[Tuple]] = None,
+    ) -> Tuple[Tensor, float, Tensor]:
+        batch_size = normed_pred_density.size(0)
+        assert len(target_points) == batch_size, f"Expected target_points to have length {batch_size}, but got {len(target_points)}"
+        assert self.output_size == normed_pred_density.size(2)
+        device = pred_density.device
+
+        # Images without points do not contribute, same as in the per-sample loop
+        indices = [idx for idx, points in enumerate(target_points) if len(points) > 0]
+        if len(indices) == 0:
+            self.iterations = torch.zeros([], device=device)
+            return torch.zeros([1], device=device), 0, torch.zeros([1], device=device)
+        num_points = torch.tensor([len(target_points[idx]) for idx in indices], device=device)
+        points = pad_sequence([target_points[idx].to(device) for idx in indices], batch_first=True)  # [B, #gt_max, 2]
+        mask = torch.arange(points.size(1), device=device).unsqueeze(0) < num_points.unsqueeze(1)  # [B, #gt_max]
+
+        # compute l2 square distance, it should be source target distance. [B, #gt_max, #cood * #cood]
+        cood = self.cood.to(device)
+        points = points / self.input_size * 2 - 1 if self.norm_cood else points
+        x = points[:, :, 0:1]  # [B, #gt_max, 1]
+        y = points[:, :, 1:2]
+        x_dist = (-2 * torch.matmul(x, cood) + x * x + cood * cood).masked_fill(~mask.unsqueeze(2), 0.)  # [B, #gt_max, #cood]
+        y_dist = (-2 * torch.matmul(y, cood) + y * y + cood * cood).masked_fill(~mask.unsqueeze(2), 0.)
+        if not self.separable:
+            dist = y_dist.unsqueeze(3) + x_dist.unsqueeze(2)
+            dist = dist.view(dist.size(0), dist.size(1), -1)
+
+        normed_pred_density, pred_density = normed_pred_density[indices], pred_density[indices]
+        source_prob = normed_pred_density[:, 0].reshape(len(indices), -1).detach()
+        target_prob = mask.to(source_prob.dtype) / num_points.unsqueeze(1)
+        # use sinkhorn to solve all OT problems at once, compute optimal beta.
+        if self.separable:
+            cost, log = sinkhorn_separable_batched(target_prob, source_prob, x_dist, y_dist, self.reg, maxIter=self.num_of_iter_in_ot, stopThr=self.stop_thr)
+        elif self.log_domain:
+            g_init, warm, keys = None, None, None
+            if self.warm_start and image_names is not None and crop_params is not None:
+                assert len(image_names) == batch_size and len(crop_params) == batch_size, f"Expected image_names and crop_params to have length {batch_size}, but got {len(image_names)} and {len(crop_params)}"
+                keys = [self._potential_key(image_names[idx], crop_params[idx]) for idx in indices]
+                cached = [self._get_potential(key) for key in keys]
+                warm = torch.tensor([g is not None for g in cached], device=device)
+                g_init = torch.stack([g.to(device) if g is not None else torch.zeros_like(source_prob[0]) for g in cached]).to(source_prob.dtype)
+            P, log = sinkhorn_log_batched(target_prob, source_prob, dist, self.reg, maxIter=self.num_of_iter_in_ot, stopThr=self.stop_thr, g_init=g_init, warm=warm)
+            if keys is not None:
+                for key, g in zip(keys, log["g"].detach()):
+                    self._set_potential(key, g)
+        else:
+            P, log = sinkhorn_batched(target_prob, source_prob, dist, self.reg, maxIter=self.num_of_iter_in_ot, stopThr=self.stop_thr)
+        self.iterations = log["iterations"].float().mean()
+        beta = log["beta"]  # [B, #cood * #cood]
+        ot_obj_values = torch.sum(normed_pred_density * beta.view(-1, 1, self.output_size, self.output_size)).view(1)
+
+        # compute the gradient of OT loss to predicted density (pred_density).
+        # im_grad = beta / source_count - < beta, source_density> / (source_count)^2
+        source_density = pred_density[:, 0].reshape(len(indices), -1).detach()
+        source_count = source_density.sum(dim=1, keepdim=True)
+        gradient_1 = (source_count) / (source_count * source_count + EPS) * beta
+        gradient_2 = (source_density * beta).sum(dim=1, keepdim=True) / (source_count * source_count + EPS)
+        gradient = (gradient_1 - gradient_2).detach().view(-1, 1, self.output_size, self.output_size)
+        # Define loss = <im_grad, predicted density>. The gradient of loss w.r.t predicted density is im_grad.
+        loss = torch.sum(pred_density * gradient).view(1)
+        wd = cost.sum().item() if self.separable else torch.sum(dist * P).item()
+
+        return loss, wd, ot_obj_values
+
+    def _forward_per_sample(self, pred_density: Tensor, normed_pred_density: Tensor, target_points: List[Tensor]) -> Tuple[Tensor, float, Tensor]:
         batch_size = normed_pred_density.size(0)
         assert len(target_points) == batch_size, f"Expected target_points to have length {batch_size}, but got {len(target_points)}"
         assert self.output_size == normed_pred_density.size(2)
@@ -59,7 +196,7 @@ class OTLoss(nn.Module):
                 source_prob = normed_pred_density[idx][0].view([-1]).detach()
                 target_prob = (torch.ones([len(points)]) / len(points)).to(device)
                 # use sinkhorn to solve OT, compute optimal beta.
-                P, log = sinkhorn(target_prob, source_prob, dist, self.reg, maxIter=self.num_of_iter_in_ot, log=True)
+                P, log = sinkhorn(target_prob, source_prob, dist, self.reg, maxIter=self.num_of_iter_in_ot, stopThr=self.stop_thr, log=True)
                 beta = log["beta"] # size is the same as source_prob: [#cood * #cood]
                 ot_obj_values += torch.sum(normed_pred_density[idx] * beta.view([1, self.output_size, self.output_size]))
                 # compute the gradient of OT loss to predicted density (pred_density).
@@ -94,7 +231,14 @@ class DMLoss(nn.Module):
         self.weight_ot = weight_ot
         self.weight_tv = weight_tv
 
-    def forward(self, pred_density: Tensor, target_density: Tensor, target_points: List[Tensor]) -> Tuple[Tensor, Dict[str, Tensor]]:
+    def forward(
+        self,
+        pred_density: Tensor,
+        target_density: Tensor,
+        target_points: List[Tensor],
+        image_names: Optional[List[str]] = None,
+        crop_params: Optional[List[Tuple]] = None,
+    ) -> Tuple[Tensor, Dict[str, Tensor]]:
         target_density = _reshape_density(target_density, reduction=self.ot_loss.reduction) if target_density.shape[-2:] != pred_density.shape[-2:] else target_density
         assert pred_density.shape == target_density.shape, f"Expected pred_density and target_density to have the same shape, got {pred_density.shape} and {target_density.shape}"
 
@@ -103,7 +247,8 @@ class DMLoss(nn.Module):
         target_count = torch.tensor([len(p) for p in target_points], dtype=torch.float32).to(target_density.device)
         normed_target_density = target_density / (target_count.view(-1, 1, 1, 1) + EPS)
 
-        ot_loss, _, _ = self.ot_loss(pred_density, normed_pred_density, target_points)
+        self.ot_loss.iterations = None
+        ot_loss, _, _ = self.ot_loss(pred_density, normed_pred_density, target_points, image_names, crop_params)
 
         tv_loss = (self.tv_loss(normed_pred_density, normed_target_density).sum(dim=(1, 2, 3)) * target_count).mean()
 
@@ -117,5 +262,7 @@ class DMLoss(nn.Module):
             "tv_loss": tv_loss.detach(),
             "count_loss": count_loss.detach(),
         }
+        if self.ot_loss.iterations is not None:
+            loss_info["ot_iterations"] = self.ot_loss.iterations.detach()
 
         return loss, loss_info
@@ -4,6 +4,7 @@ load_dotenv()
 
 from camera import CameraManager, CameraConfig, Camera
 from ai import AI
+from pipeline import Pipeline, Stage
 import os
 import json
 import time
@@ -11,24 +12,15 @@ from logger import setup_logger
 from sqlalchemy.orm import Session
 from database.db import SessionLocal, init_db
 from database import crud
+from database.writer import PredictionWriter
+from database.lakehouse_exporter import LakehouseExporter
+from datetime import datetime
 import logging
 
 setup_logger()
 logger = logging.getLogger(__name__)
 
 
-def save_results(area_id: int, results: dict):
-    db: Session = SessionLocal()
-    try:
-        db_prediction = crud.create_prediction(db, area_id, results)
-        return db_prediction
-    except Exception as e:
-        logger.error(f"Error saving results to database: {e}")
-        db.rollback()
-    finally:
-        db.close()
-
-
 def create_area(area_name: str, description: str = None):
     db: Session = SessionLocal()
     try:
@@ -74,6 +66,8 @@ def main(config_file_path: str = "config.json"):
         logger.info("Loaded configuration from config.json.")
 
     camera_manager = CameraManager()
+    decode_mode = os.getenv("CAMERA_DECODE_MODE", "continuous")
+    decode_interval = os.getenv("CAMERA_DECODE_INTERVAL")
 
     # areas = config.get("areas", [])
     # if len(areas) == 0:
@@ -88,6 +82,8 @@ def main(config_file_path: str = "config.json"):
 
     cameras = config["cameras"]
     logger.info(f"Found {len(cameras)} cameras in the first area.")
+    # Cameras can override the default resolution policy with e.g. "resolution": {"mode": "adaptive", "min_side": 640}
+    camera_resolution_policies = {camera["name"]: camera["resolution"] for camera in cameras if "resolution" in camera}
     for camera in cameras:
         try:
             name = camera["name"]
@@ -95,7 +91,8 @@ def main(config_file_path: str = "config.json"):
             # Create camera in database
             db_camera = create_camera(name, rtsp_url, db_area.area_id)
             camera_config = CameraConfig(name=name, rtsp_url=rtsp_url, user=os.getenv("CAMERA_USER"),
-                                         password=os.getenv("CAMERA_PASSWORD"))
+                                         password=os.getenv("CAMERA_PASSWORD"), decode_mode=decode_mode,
+                                         decode_interval=float(decode_interval) if decode_interval else None)
             camera_manager.add_camera(Camera(camera_config))
             logger.info(f"Added camera: {camera_config.name}")
         except Exception as e:
@@ -103,28 +100,111 @@ def main(config_file_path: str = "config.json"):
 
     logger.info("Initializing AI.")
     try:
-        ai_system = AI(camera_manager=camera_manager, device=device)
+        max_frame_age = os.getenv("MAX_FRAME_AGE")
+        resolution_max_side = os.getenv("RESOLUTION_MAX_SIDE")
+        window_size, window_stride = os.getenv("WINDOW_SIZE"), os.getenv("WINDOW_STRIDE")
+        resolution_policy = {
+            "mode": os.getenv("RESOLUTION_MODE", "native"),
+            "max_side": int(resolution_max_side) if resolution_max_side else None,
+            "min_side": int(os.getenv("RESOLUTION_MIN_SIDE", "640")),
+        }
+        ai_system = AI(camera_manager=camera_manager, device=device,
+                       max_frame_age=float(max_frame_age) if max_frame_age else None,
+                       image_writer_workers=int(os.getenv("IMAGE_WRITER_WORKERS", "4")),
+                       image_writer_backend=os.getenv("IMAGE_WRITER_BACKEND", "thread"),
+                       precomputed_text_features=os.getenv("PRECOMPUTED_TEXT_FEATURES", "false").lower() == "true",
+                       artifact_path=os.getenv("MODEL_ARTIFACT") or None,
+                       precision=os.getenv("PRECISION", "fp32"),
+                       calibration_dir=os.getenv("CALIBRATION_DIR") or None,
+                       backend=os.getenv("INFERENCE_BACKEND", "torch"),
+                       onnx_path=os.getenv("ONNX_MODEL") or None,
+                       intra_op_threads=int(os.getenv("ORT_INTRA_OP_THREADS", "0")),
+                       inter_op_threads=int(os.getenv("ORT_INTER_OP_THREADS", "0")),
+                       resolution_policy=resolution_policy,
+                       camera_resolution_policies=camera_resolution_policies,
+                       change_detection=os.getenv("CHANGE_DETECTION", "false").lower() == "true",
+                       change_threshold=float(os.getenv("CHANGE_THRESHOLD", "4.0")),
+                       change_refresh_interval=float(os.getenv("CHANGE_REFRESH_INTERVAL", "600")),
+                       window_size=int(window_size) if window_size else None,
+                       window_stride=int(window_stride) if window_stride else None,
+                       window_batch_size=int(os.getenv("WINDOW_BATCH_SIZE", "8")))
         logger.info("AI initialized and ready.")
     except Exception as e:
         logger.error(f"Error initializing AI: {e}")
         exit(1)
 
+    seconds_between_runs = int(os.getenv("SECONDS_BETWEEN_RUNS", "120"))
+    max_queue_size = int(os.getenv("PIPELINE_QUEUE_SIZE", "2"))
+
+    lakehouse_export = os.getenv("LAKEHOUSE_EXPORT", "false").lower() == "true"
+    prediction_writer = PredictionWriter(outbox=lakehouse_export)
+    prediction_writer.start()
+
+    lakehouse_exporter = None
+    if lakehouse_export:
+        lakehouse_exporter = LakehouseExporter(
+            flush_size=int(os.getenv("LAKEHOUSE_FLUSH_SIZE", "100")),
+            flush_interval=float(os.getenv("LAKEHOUSE_FLUSH_INTERVAL", "900")),
+        )
+        lakehouse_exporter.start()
+
+    def capture(cycle: int) -> dict:
+        logger.info(f"Capturing cycle {cycle}...")
+        return {"cycle": cycle, "timestamp": datetime.utcnow(), "camera_frames": camera_manager.get_frames()}
+
+    def preprocess(item: dict) -> dict:
+        item["camera_frames"], item["batches"] = ai_system.preprocess(item["camera_frames"])
+        return item
+
+    def infer(item: dict) -> dict:
+        item["results"], item["predictions"] = ai_system.predict(item["camera_frames"], item.pop("batches"))
+        return item
+
+    def persist(item: dict) -> dict:
+        prediction_writer.submit(db_area.area_id, item["results"], item["timestamp"])
+        logger.info(f"Queued results for cycle {item['cycle']}. {item['results']}")
+        return item if save_images else None
+
+    def render(item: dict) -> None:
+        ai_system.save_images(item["camera_frames"], item["predictions"])
+
+    stages = [
+        Stage("capture", capture, max_queue_size),
+        Stage("preprocess", preprocess, max_queue_size),
+        # Cycles that never reach the model must not leave unchanged-frame references without a prediction
+        Stage("infer", infer, max_queue_size, on_discard=lambda item: ai_system.discard(item["camera_frames"])),
+        Stage("persist", persist, max_queue_size),
+    ]
+    if save_images:
+        stages.append(Stage("render", render, max_queue_size))
+    pipeline = Pipeline(stages, interval=seconds_between_runs)
+
     try:
+        pipeline.start()
         while True:
-            logger.info("Capturing and predicting...")
-            start_time = time.time()
-            results = ai_system.capture_and_predict(save_images=save_images)
-            save_results(db_area.area_id, results)
-            logger.info(f"Prediction took {time.time() - start_time:.2f} seconds.")
-            logger.info(f"Saved results. {results}")
-            seconds_between_runs = 120
-            time_to_wait = max(0, 120 - (time.time() - start_time))
-            time.sleep(time_to_wait)
+            time.sleep(seconds_between_runs)
+            pipeline.log_stats()
+            logger.info(f"Prediction writer: {prediction_writer.pending()} pending, {prediction_writer.written} written, "
+                        f"{prediction_writer.failed_attempts} failed attempts.")
+            if save_images:
+                stats = ai_system.image_writer.stats()
+                logger.info(f"Image writer: {stats['pending']} pending, {stats['written']} written, "
+                            f"{stats['failed']} failed, {stats['dropped']} dropped.")
+            for camera_name, stats in camera_manager.get_stats().items():
+                logger.info(f"Camera {camera_name}: decoded {stats['decoded_frames']}, skipped {stats['skipped_frames']} frames.")
+            if ai_system.change_detector is not None:
+                for camera_name, stats in ai_system.change_detector.stats().items():
+                    logger.info(f"Camera {camera_name}: computed {stats['computed']}, skipped {stats['skipped']} unchanged frames.")
     except KeyboardInterrupt:
         logger.info("Received KeyboardInterrupt, exiting application.")
     except Exception as e:
         logger.error(f"Error in main loop: {e}")
     finally:
+        pipeline.stop()
+        ai_system.close()
+        prediction_writer.stop()
+        if lakehouse_exporter is not None:
+            lakehouse_exporter.stop()
         camera_manager.release_all()
         logger.info("Releasing all cameras.")
         logger.info("Exiting application.")
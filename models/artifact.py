@@ -0,0 +1,95 @@
+import json
+from typing import Tuple, Optional, Union
+
+import torch
+from safetensors import safe_open
+from safetensors.torch import save_file
+
+from . import get_model
+from .clip import VanillaCLIP
+from .clip import _clip
+from .weights import load_weights, assign_state_dict
+
+
+ARTIFACT_FORMAT_VERSION = 1
+
+
+def export_artifact(
+    model: VanillaCLIP,
+    path: str,
+    mean: Tuple[float, float, float] = (0.485, 0.456, 0.406),
+    std: Tuple[float, float, float] = (0.229, 0.224, 0.225),
+    extra: Optional[dict] = None,
+) -> dict:
+    """
+    Pack a trained CLIP-EBC model into a single safetensors file: the weights, the text features and, in the file
+    metadata, everything needed to rebuild the model (backbone, input size, reduction, bins, anchor points,
+    normalization constants and the CLIP image encoder config). The text encoder weights are not included.
+    `extra` is stored with the config, e.g. the dataset and checkpoint the model was trained on. Returns the config.
+    """
+    assert isinstance(model, VanillaCLIP), f"Only CLIP models can be exported, got {type(model).__name__}"
+    assert model.text_features is not None, "Exporting requires fixed text features, i.e. a frozen text encoder"
+
+    config = {
+        "format_version": ARTIFACT_FORMAT_VERSION,
+        "model_name": f"clip_{model.backbone}",
+        "input_size": model.input_size,
+        "reduction": model.reduction,
+        "bins": [list(b) for b in model.bins],
+        "anchor_points": model.anchor_points.flatten().tolist(),
+        "prompt_type": model.prompt_type,
+        "decoding": model.decoder_cfg is not None,
+        "decoder_cfg": model.decoder_cfg,
+        "mean": list(mean),
+        "std": list(std),
+        "image_encoder": _clip.image_encoder_config(model.backbone),
+        "extra": extra if extra is not None else {},
+    }
+
+    tensors = {
+        f"model.{key}": value.detach().cpu().contiguous()
+        for key, value in model.state_dict().items()
+        if not key.startswith("text_encoder.")
+    }
+    tensors["text_features"] = model.text_features.detach().cpu().contiguous()
+    save_file(tensors, path, metadata={"config": json.dumps(config)})
+    return config
+
+
+def read_artifact_config(path: str) -> dict:
+    """Read the config of an artifact without loading its tensors."""
+    with safe_open(path, framework="pt") as f:
+        metadata = f.metadata()
+    assert metadata is not None and "config" in metadata, f"{path} is not a model artifact, it has no config metadata"
+    config = json.loads(metadata["config"])
+    assert config["format_version"] <= ARTIFACT_FORMAT_VERSION, \
+        f"Artifact format version {config['format_version']} is newer than the supported version {ARTIFACT_FORMAT_VERSION}"
+    return config
+
+
+def load_artifact(path: str, device: Union[str, torch.device] = "cpu") -> Tuple[VanillaCLIP, dict]:
+    """
+    Rebuild a model from an artifact written by export_artifact. Neither the CLIP weights, nor the CLIP configs, nor
+    the text encoder are needed. Returns the model in eval mode on `device` and the artifact config.
+    """
+    config = read_artifact_config(path)
+    tensors = load_weights(path)
+
+    model = get_model(
+        backbone=config["model_name"],
+        input_size=config["input_size"],
+        reduction=config["reduction"],
+        bins=[tuple(b) for b in config["bins"]],
+        anchor_points=config["anchor_points"],
+        prompt_type=config["prompt_type"],
+        decoding=config["decoding"],
+        decoder_cfg=config["decoder_cfg"],
+        text_features=tensors.pop("text_features"),
+        pretrained=False,
+        image_encoder_config=config["image_encoder"],
+    )
+    state_dict = {key[len("model."):]: value for key, value in tensors.items()}
+    assign_state_dict(model, state_dict, strict=True)
+    model = model.to(device)
+    model.eval()
+    return model, config
@@ -1,4 +1,3 @@
-import torch
 import os
 from typing import Tuple, Optional, Any, Union
 import json
@@ -8,6 +7,7 @@ from .prepare import prepare
 from .text_encoder import CLIPTextEncoder
 from .image_encoder import ModifiedResNet, VisionTransformer
 from .model import CLIP
+from ...weights import load_weights, assign_state_dict
 
 
 curr_dir = os.path.dirname(os.path.abspath(__file__))
@@ -28,21 +28,62 @@ clip_image_encoder_names = [f"clip_image_encoder_{name[5:]}" for name in clip_mo
 clip_text_encoder_names = [f"clip_text_encoder_{name[5:]}" for name in clip_model_names]
 
 
-for name in clip_model_names + clip_image_encoder_names + clip_text_encoder_names:
-    model_weights_path = os.path.join(curr_dir, "weights", f"{name}.pth")
-    model_config_path = os.path.join(curr_dir, "configs", f"{name}.json")
-    if not os.path.exists(os.path.join(curr_dir, "weights", f"{name}.pth")) or not os.path.exists(os.path.join(curr_dir, "configs", f"{name}.json")):
-        prepare()
-        break
+def _backbone_of(name: str) -> str:
+    for prefix in ["clip_image_encoder_", "clip_text_encoder_", "clip_"]:
+        if name.startswith(prefix):
+            return name[len(prefix):]
+    raise ValueError(f"Unknown CLIP model name {name}")
 
 
-for name in clip_model_names + clip_image_encoder_names + clip_text_encoder_names:
-    assert os.path.exists(os.path.join(curr_dir, "weights", f"{name}.pth")), f"Missing {name}.pth in weights folder. Please run models/clip/prepare.py to download the weights."
-    assert os.path.exists(os.path.join(curr_dir, "configs", f"{name}.json")), f"Missing {name}.json in configs folder. Please run models/clip/prepare.py to download the configs."
+def _weights_path(name: str) -> str:
+    safetensors_path = os.path.join(curr_dir, "weights", f"{name}.safetensors")
+    if os.path.exists(safetensors_path):
+        return safetensors_path
+    return os.path.join(curr_dir, "weights", f"{name}.pth")
 
 
-def _clip(name: str, input_size: Optional[Union[int, Tuple[int, int]]] = None) -> CLIP:
-    with open(os.path.join(curr_dir, "configs", f"clip_{name}.json"), "r") as f:
+def _resolve(name: str, weights: bool = True) -> Tuple[str, str]:
+    """
+    Return the (config, weights) paths of a CLIP model, image encoder or text encoder, e.g. "clip_image_encoder_resnet50".
+    Missing files are prepared for that backbone only, when it is first requested. Set CLIP_OFFLINE=1 to raise an
+    error instead of downloading. With weights=False only the config has to exist.
+    Memory mappable .safetensors weights are preferred over .pth weights.
+    """
+    config_path = os.path.join(curr_dir, "configs", f"{name}.json")
+    weights_path = _weights_path(name)
+    if os.path.exists(config_path) and (not weights or os.path.exists(weights_path)):
+        return config_path, weights_path
+
+    backbone = _backbone_of(name)
+    if os.getenv("CLIP_OFFLINE", "false").lower() in ["1", "true"]:
+        raise FileNotFoundError(f"Missing {name} weights or config and CLIP_OFFLINE is set. Run prepare(['{backbone}']) from models/clip/_clip/prepare.py with network access first.")
+
+    prepare([backbone])
+    weights_path = _weights_path(name)
+    assert not weights or os.path.exists(weights_path), f"Missing {name}.safetensors or {name}.pth in weights folder. Please run models/clip/_clip/prepare.py to download the weights."
+    assert os.path.exists(config_path), f"Missing {name}.json in configs folder. Please run models/clip/_clip/prepare.py to download the configs."
+    return config_path, weights_path
+
+
+def image_encoder_config(name: str) -> dict:
+    """Config of the CLIP image encoder of a backbone, e.g. "resnet50". Does not need the weights."""
+    config_path, _ = _resolve(f"clip_image_encoder_{name}", weights=False)
+    with open(config_path, "r") as f:
+        return json.load(f)
+
+
+def _load_image_encoder_weights(model: Union[ModifiedResNet, VisionTransformer], weights_path: str) -> None:
+    missing_keys, unexpected_keys = assign_state_dict(model, load_weights(weights_path), strict=False)
+    if len(missing_keys) > 0 or len(unexpected_keys) > 0:
+        print(f"Missing keys: {missing_keys}")
+        print(f"Unexpected keys: {unexpected_keys}")
+    else:
+        print(f"All keys matched successfully.")
+
+
+def _clip(name: str, input_size: Optional[Union[int, Tuple[int, int]]] = None, pretrained: bool = True) -> CLIP:
+    config_path, weights_path = _resolve(f"clip_{name}", weights=pretrained)
+    with open(config_path, "r") as f:
         config = json.load(f)
 
     model = CLIP(
@@ -59,8 +100,8 @@ def _clip(name: str, input_size: Optional[Union[int, Tuple[int, int]]] = None) -
         transformer_heads=config["transformer_heads"],
         transformer_layers=config["transformer_layers"]
     )
-    state_dict = torch.load(os.path.join(curr_dir, "weights", f"clip_{name}.pth"), map_location="cpu")
-    model.load_state_dict(state_dict, strict=True)
+    if pretrained:
+        assign_state_dict(model, load_weights(weights_path), strict=True)
 
     if input_size is not None:
         input_size = (input_size, input_size) if isinstance(input_size, int) else input_size
@@ -75,10 +116,19 @@ def _resnet(
     reduction: int = 32,
     features_only: bool = False,
     out_indices: Optional[Tuple[int, ...]] = None,
+    pretrained: bool = True,
+    config: Optional[dict] = None,
     **kwargs: Any
 ) -> ModifiedResNet:
-    with open(os.path.join(curr_dir, "configs", f"clip_image_encoder_{name}.json"), "r") as f:
-        config = json.load(f)
+    """
+    With pretrained=False the CLIP weights are not loaded, e.g. when a checkpoint overwrites them anyway.
+    If config is given as well, no CLIP files are needed at all.
+    """
+    if pretrained or config is None:
+        config_path, weights_path = _resolve(f"clip_image_encoder_{name}", weights=pretrained)
+        if config is None:
+            with open(config_path, "r") as f:
+                config = json.load(f)
     model = ModifiedResNet(
         layers=config["vision_layers"],
         output_dim=config["embed_dim"],
@@ -89,20 +139,25 @@ def _resnet(
         out_indices=out_indices,
         reduction=reduction
     )
-    state_dict = torch.load(os.path.join(curr_dir, "weights", f"clip_image_encoder_{name}.pth"), map_location="cpu")
-    missing_keys, unexpected_keys = model.load_state_dict(state_dict, strict=False)
-    if len(missing_keys) > 0 or len(unexpected_keys) > 0:
-        print(f"Missing keys: {missing_keys}")
-        print(f"Unexpected keys: {unexpected_keys}")
-    else:
-        print(f"All keys matched successfully.")
+    if pretrained:
+        _load_image_encoder_weights(model, weights_path)
 
     return model
 
 
-def _vit(name: str, features_only: bool = False, input_size: Optional[Union[int, Tuple[int, int]]] = None, **kwargs: Any) -> VisionTransformer:
-    with open(os.path.join(curr_dir, "configs", f"clip_image_encoder_{name}.json"), "r") as f:
-        config = json.load(f)
+def _vit(
+    name: str,
+    features_only: bool = False,
+    input_size: Optional[Union[int, Tuple[int, int]]] = None,
+    pretrained: bool = True,
+    config: Optional[dict] = None,
+    **kwargs: Any
+) -> VisionTransformer:
+    if pretrained or config is None:
+        config_path, weights_path = _resolve(f"clip_image_encoder_{name}", weights=pretrained)
+        if config is None:
+            with open(config_path, "r") as f:
+                config = json.load(f)
     model = VisionTransformer(
         input_resolution=config["image_resolution"],
         patch_size=config["vision_patch_size"],
@@ -112,13 +167,8 @@ def _vit(name: str, features_only: bool = False, input_size: Optional[Union[int,
         heads=config["vision_heads"],
         features_only=features_only
     )
-    state_dict = torch.load(os.path.join(curr_dir, "weights", f"clip_image_encoder_{name}.pth"), map_location="cpu")
-    missing_keys, unexpected_keys = model.load_state_dict(state_dict, strict=False)
-    if len(missing_keys) > 0 or len(unexpected_keys) > 0:
-        print(f"Missing keys: {missing_keys}")
-        print(f"Unexpected keys: {unexpected_keys}")
-    else:
-        print(f"All keys matched successfully.")
+    if pretrained:
+        _load_image_encoder_weights(model, weights_path)
 
     if input_size is not None:
         input_size = (input_size, input_size) if isinstance(input_size, int) else input_size
@@ -127,7 +177,8 @@ def _vit(name: str, features_only: bool = False, input_size: Optional[Union[int,
 
 
 def _text_encoder(name: str) -> CLIPTextEncoder:
-    with open(os.path.join(curr_dir, "configs", f"clip_text_encoder_{name}.json"), "r") as f:
+    config_path, weights_path = _resolve(f"clip_text_encoder_{name}")
+    with open(config_path, "r") as f:
         config = json.load(f)
     model = CLIPTextEncoder(
         embed_dim=config["embed_dim"],
@@ -137,8 +188,7 @@ def _text_encoder(name: str) -> CLIPTextEncoder:
         transformer_heads=config["transformer_heads"],
         transformer_layers=config["transformer_layers"]
     )
-    state_dict = torch.load(os.path.join(curr_dir, "weights", f"clip_text_encoder_{name}.pth"), map_location="cpu")
-    missing_keys, unexpected_keys = model.load_state_dict(state_dict, strict=False)
+    missing_keys, unexpected_keys = assign_state_dict(model, load_weights(weights_path), strict=False)
     if len(missing_keys) > 0 or len(unexpected_keys) > 0:
         print(f"Missing keys: {missing_keys}")
         print(f"Unexpected keys: {unexpected_keys}")
@@ -240,6 +290,7 @@ __all__ = [
     # utils
     "tokenize",
     "transform",
+    "image_encoder_config",
     # clip models
     "resnet50_clip",
     "resnet101_clip",
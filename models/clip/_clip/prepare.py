@@ -4,8 +4,10 @@ from torch import nn, Tensor
 import os
 from tqdm import tqdm
 import json
+from typing import List, Optional
 
 from .utils import load
+from ...weights import load_weights, save_weights
 
 
 model_name_map = {
@@ -40,7 +42,11 @@ class CLIPTextEncoderTemp(nn.Module):
         pass
 
 
-def prepare() -> None:
+def prepare(model_names: Optional[List[str]] = None) -> None:
+    """
+    Download the CLIP models and save the weights and configs of the full model, image encoder and text encoder.
+    model_names are the local names, e.g. ["resnet50", "vit_b_16"]. All models are prepared if None.
+    """
     print("Preparing CLIP models...")
     curr_dir = os.path.dirname(os.path.abspath(__file__))
     weight_dir = os.path.join(curr_dir, "weights")
@@ -49,13 +55,19 @@ def prepare() -> None:
     os.makedirs(config_dir, exist_ok=True)
     device = torch.device("cpu")
 
-    for model_name in tqdm(["RN50", "RN101", "RN50x4", "RN50x16", "RN50x64", "ViT-B/32", "ViT-B/16", "ViT-L/14", "ViT-L/14@336px"]):
+    openai_names = list(model_name_map.keys())
+    if model_names is not None:
+        assert all(name in model_name_map.values() for name in model_names), f"Expected model_names to be in {list(model_name_map.values())}, got {model_names}"
+        openai_names = [name for name in openai_names if model_name_map[name] in model_names]
+
+    for model_name in tqdm(openai_names):
         model = load(model_name, device=device).to(device)
         image_encoder = model.visual.to(device)
         text_encoder = CLIPTextEncoderTemp(model).to(device)
-        torch.save(model.state_dict(), os.path.join(weight_dir, f"clip_{model_name_map[model_name]}.pth"))
-        torch.save(image_encoder.state_dict(), os.path.join(weight_dir, f"clip_image_encoder_{model_name_map[model_name]}.pth"))
-        torch.save(text_encoder.state_dict(), os.path.join(weight_dir, f"clip_text_encoder_{model_name_map[model_name]}.pth"))
+        # safetensors so the weights can be memory mapped when loading
+        save_weights(model.state_dict(), os.path.join(weight_dir, f"clip_{model_name_map[model_name]}.safetensors"))
+        save_weights(image_encoder.state_dict(), os.path.join(weight_dir, f"clip_image_encoder_{model_name_map[model_name]}.safetensors"))
+        save_weights(text_encoder.state_dict(), os.path.join(weight_dir, f"clip_text_encoder_{model_name_map[model_name]}.safetensors"))
         model_config = {
             "embed_dim": model.embed_dim,
             # vision
@@ -93,3 +105,20 @@ def prepare() -> None:
         with open(os.path.join(config_dir, f"clip_text_encoder_{model_name_map[model_name]}.json"), "w") as f:
             json.dump(text_encoder_config, f, indent=4)
     print("Done!")
+
+
+def convert_to_safetensors(remove: bool = False) -> None:
+    """Convert weights prepared as .pth files by older versions to .safetensors, optionally removing the .pth files."""
+    weight_dir = os.path.join(os.path.dirname(os.path.abspath(__file__)), "weights")
+    if not os.path.isdir(weight_dir):
+        return
+    for file_name in sorted(os.listdir(weight_dir)):
+        if not file_name.endswith(".pth"):
+            continue
+        pth_path = os.path.join(weight_dir, file_name)
+        safetensors_path = pth_path[:-len(".pth")] + ".safetensors"
+        if not os.path.exists(safetensors_path):
+            save_weights(load_weights(pth_path), safetensors_path)
+            print(f"Converted {file_name} to safetensors.")
+        if remove:
+            os.remove(pth_path)
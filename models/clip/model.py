@@ -8,8 +8,8 @@ import json
 from typing import List, Tuple, Union, Optional
 
 from . import _clip
-from ..utils import _init_weights, make_resnet_layers, Bottleneck, BasicBlock
-from .utils import format_count
+from ..utils import _init_weights, make_resnet_layers, Bottleneck, BasicBlock, _softmax_expectation
+from .text_features import get_text_prompts, load_text_features
 
 curr_dir = os.path.abspath(os.path.dirname(__file__))
 
@@ -37,15 +37,30 @@ class VanillaCLIP(nn.Module):
         decoder_cfg: Optional[List[Union[str, int]]] = None,
         freeze_text_encoder: bool = True,
         prompt_type: str = "number",
+        precomputed_text_features: bool = False,
+        text_features: Optional[Tensor] = None,
+        pretrained: bool = True,
+        image_encoder_config: Optional[dict] = None,
     ) -> None:
         super().__init__()
+        # Text features passed in directly, e.g. from a model artifact, are used like precomputed ones
+        precomputed_text_features = precomputed_text_features or text_features is not None
         assert prompt_type in ["number", "word"], f"Expected prompt_type to be 'number' or 'word', got {prompt_type}"
+        assert not precomputed_text_features or freeze_text_encoder, "Precomputed text features require a frozen text encoder"
         self.prompt_type = prompt_type
-
-        self.image_encoder = getattr(_clip, f"{backbone}_img")(input_size=input_size, features_only=True, out_indices=(-1,), reduction=reduction)
-        self.text_encoder = getattr(_clip, f"{backbone}_txt")()
+        self.backbone = backbone
+        self.input_size = input_size
+        self.decoder_cfg = decoder_cfg
+
+        self.image_encoder = getattr(_clip, f"{backbone}_img")(
+            input_size=input_size, features_only=True, out_indices=(-1,), reduction=reduction,
+            pretrained=pretrained, config=image_encoder_config,
+        )
+        # With precomputed text features the text encoder is never built, its weights in checkpoints are ignored
+        self.precomputed_text_features = precomputed_text_features
+        self.text_encoder = getattr(_clip, f"{backbone}_txt")() if not precomputed_text_features else None
         self.freeze_text_encoder = freeze_text_encoder
-        if self.freeze_text_encoder:
+        if self.freeze_text_encoder and self.text_encoder is not None:
             for param in self.text_encoder.parameters():
                 param.requires_grad = False
 
@@ -55,7 +70,7 @@ class VanillaCLIP(nn.Module):
         self.clip_embed_dim = self.image_encoder.clip_embed_dim
 
         self.bins = bins
-        self.anchor_points = torch.tensor(anchor_points, dtype=torch.float32, requires_grad=False).view(1, -1, 1, 1)
+        self.register_buffer("anchor_points", torch.tensor(anchor_points, dtype=torch.float32).view(1, -1, 1, 1), persistent=False)
 
         if decoder_cfg is not None:
             self.image_decoder = make_resnet_layers(decoder_block, decoder_cfg, in_channels=self.channels, expansion=1, dilation=1)
@@ -71,20 +86,29 @@ class VanillaCLIP(nn.Module):
             self.projection = nn.Identity()
 
         self._get_text_prompts()
-        self._tokenize_text_prompts()
-
-        if self.freeze_text_encoder:
-            self._extract_text_features()
+        if self.precomputed_text_features:
+            self.text_features = text_features if text_features is not None else load_text_features(backbone, self.bins, self.prompt_type)
+            self._register_load_state_dict_pre_hook(self._drop_text_encoder_weights)
         else:
-            self.text_features = None
+            self._tokenize_text_prompts()
+            if self.freeze_text_encoder:
+                self._extract_text_features()
+            else:
+                self.text_features = None
 
         self.logit_scale = nn.Parameter(torch.ones([]) * np.log(1 / 0.07), requires_grad=True)
 
+        # Normalized text features scaled by the logit scale as a 1x1 conv weight, set by fuse_head()
+        self.register_buffer("fused_text_weight", None, persistent=False)
+
     def _get_text_prompts(self) -> None:
-        bins = [b[0] if b[0] == b[1] else b for b in self.bins]
-        self.text_prompts = [format_count(b, self.prompt_type) for b in bins]
+        self.text_prompts = get_text_prompts(self.bins, self.prompt_type)
         print(f"Initialized model with text prompts: {self.text_prompts}")
 
+    def _drop_text_encoder_weights(self, state_dict, prefix, local_metadata, strict, missing_keys, unexpected_keys, error_msgs) -> None:
+        for key in [k for k in state_dict.keys() if k.startswith(f"{prefix}text_encoder.")]:
+            del state_dict[key]
+
     def _tokenize_text_prompts(self) -> None:
         self.text_prompts = _clip.tokenize(self.text_prompts)
 
@@ -92,6 +116,22 @@ class VanillaCLIP(nn.Module):
         with torch.no_grad():
             self.text_features = self.text_encoder(self.text_prompts)
 
+    @torch.no_grad()
+    def fuse_head(self) -> None:
+        """
+        Fold the normalized text features and the logit scale into the weight of a 1x1 convolution for inference.
+        The logits are then computed directly on the (B, C, H, W) features, without permuting them or normalizing the
+        text features on every forward. Only possible with fixed text features, and undone by train().
+        """
+        assert self.text_features is not None, "Fusing the head requires fixed text features, i.e. a frozen text encoder"
+        text_features = F.normalize(self.text_features.to(self.logit_scale.device), p=2, dim=-1) * self.logit_scale.exp()
+        self.fused_text_weight = text_features.view(*text_features.shape, 1, 1)  # (N, C, 1, 1)
+
+    def train(self, mode: bool = True) -> "VanillaCLIP":
+        if mode:
+            self.fused_text_weight = None
+        return super().train(mode)
+
     def forward(self, x: Tensor) -> Union[Tensor, Tuple[Tensor, Tensor]]:
         device = x.device
 
@@ -101,6 +141,11 @@ class VanillaCLIP(nn.Module):
         x = self.image_decoder(x)
         x = self.projection(x)
 
+        if not self.training and self.fused_text_weight is not None:
+            x = F.normalize(x, p=2, dim=1)
+            logits = F.conv2d(x, self.fused_text_weight.to(x.dtype))  # (B, N, H, W)
+            return _softmax_expectation(logits, self.anchor_points)
+
         image_features = x.permute(0, 2, 3, 1)  # shape (B, H, W, C)
         text_features = self.text_encoder(self.text_prompts.to(device)) if self.text_features is None else self.text_features.to(device)  # shape (N, C)
 
@@ -112,8 +157,7 @@ class VanillaCLIP(nn.Module):
         logits = logit_scale * image_features @ text_features.t()  # (B, H, W, N), logits per image
         logits = logits.permute(0, 3, 1, 2)  # (B, N, H, W)
 
-        probs = logits.softmax(dim=1)
-        exp = (probs * self.anchor_points.to(x.device)).sum(dim=1, keepdim=True)  # (B, 1, H, W)
+        exp = _softmax_expectation(logits, self.anchor_points)  # (B, 1, H, W)
 
         if self.training:
             return logits, exp
@@ -131,6 +175,10 @@ def _vanilla_clip(
     decoder_cfg: Optional[List[Union[str, int]]] = None,
     freeze_text_encoder: bool = True,
     prompt_type: str = "number",
+    precomputed_text_features: bool = False,
+    text_features: Optional[Tensor] = None,
+    pretrained: bool = True,
+    image_encoder_config: Optional[dict] = None,
 ) -> VanillaCLIP:
     resnets = ["resnet50", "resnet50x4", "resnet50x16", "resnet50x64", "resnet101"]
     vits = ["vit_b_16", "vit_b_32", "vit_l_14"]
@@ -173,4 +221,8 @@ def _vanilla_clip(
         decoder_cfg=decoder_cfg,
         freeze_text_encoder=freeze_text_encoder,
         prompt_type=prompt_type,
+        precomputed_text_features=precomputed_text_features,
+        text_features=text_features,
+        pretrained=pretrained,
+        image_encoder_config=image_encoder_config,
     )
@@ -0,0 +1,84 @@
+# Cache of the CLIP text features of the bin prompts, so inference does not need the text encoder.
+# Generate a cache file with e.g.:
+#   python -m models.clip.text_features --model clip_resnet50 --dataset qnrf --reduction 8 --truncation 4 --granularity fine --prompt_type word
+import torch
+from torch import Tensor
+import os
+import json
+import hashlib
+from argparse import ArgumentParser
+from typing import List, Tuple
+
+from . import _clip
+from .utils import format_count
+
+curr_dir = os.path.abspath(os.path.dirname(__file__))
+cache_dir = os.path.join(curr_dir, "_clip", "text_feature_cache")
+
+
+def get_text_prompts(bins: List[Tuple[float, float]], prompt_type: str) -> List[str]:
+    bins = [b[0] if b[0] == b[1] else b for b in bins]
+    return [format_count(b, prompt_type) for b in bins]
+
+
+def text_features_path(backbone: str, bins: List[Tuple[float, float]], prompt_type: str) -> str:
+    """Location of the cached text features for (backbone, bins, prompt_type)."""
+    key = json.dumps({"backbone": backbone, "bins": [[float(b[0]), float(b[1])] for b in bins], "prompt_type": prompt_type}, sort_keys=True)
+    digest = hashlib.sha1(key.encode("utf-8")).hexdigest()[:16]
+    return os.path.join(cache_dir, f"{backbone}_{prompt_type}_{digest}.pth")
+
+
+def compute_text_features(backbone: str, bins: List[Tuple[float, float]], prompt_type: str) -> Tensor:
+    text_encoder = getattr(_clip, f"{backbone}_txt")()
+    text_prompts = _clip.tokenize(get_text_prompts(bins, prompt_type))
+    with torch.no_grad():
+        return text_encoder(text_prompts)
+
+
+def save_text_features(backbone: str, bins: List[Tuple[float, float]], prompt_type: str, text_features: Tensor) -> str:
+    path = text_features_path(backbone, bins, prompt_type)
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    torch.save({
+        "backbone": backbone,
+        "bins": [(float(b[0]), float(b[1])) for b in bins],
+        "prompt_type": prompt_type,
+        "text_features": text_features.detach().cpu(),
+    }, path)
+    return path
+
+
+def load_text_features(backbone: str, bins: List[Tuple[float, float]], prompt_type: str) -> Tensor:
+    path = text_features_path(backbone, bins, prompt_type)
+    if not os.path.exists(path):
+        raise FileNotFoundError(f"No cached text features for backbone={backbone}, prompt_type={prompt_type} and bins={bins} at {path}. Generate them with `python -m models.clip.text_features`.")
+    cache = torch.load(path, map_location="cpu")
+    assert cache["backbone"] == backbone and cache["prompt_type"] == prompt_type, f"Cached text features at {path} were made for {cache['backbone']}/{cache['prompt_type']}, expected {backbone}/{prompt_type}"
+    assert len(cache["text_features"]) == len(bins), f"Expected {len(bins)} cached text features, got {len(cache['text_features'])}"
+    return cache["text_features"]
+
+
+parser = ArgumentParser(description="Precompute the CLIP text features of the bin prompts.")
+parser.add_argument("--model", type=str, default="clip_resnet50", help="The CLIP model, e.g. clip_resnet50.")
+parser.add_argument("--dataset", type=str, default="qnrf", help="The dataset the bins were computed for.")
+parser.add_argument("--reduction", type=int, default=8, choices=[8, 16, 32], help="The reduction factor of the model.")
+parser.add_argument("--truncation", type=int, default=4, help="The truncation of the count.")
+parser.add_argument("--granularity", type=str, default="fine", choices=["fine", "dynamic", "coarse"], help="The granularity of bins.")
+parser.add_argument("--prompt_type", type=str, default="word", choices=["word", "number"], help="The prompt type for CLIP.")
+
+
+def main():
+    args = parser.parse_args()
+    backbone = args.model.lower()
+    backbone = backbone[5:] if backbone.startswith("clip_") else backbone
+
+    with open(os.path.join(curr_dir, "..", "..", "configs", f"reduction_{args.reduction}.json"), "r") as f:
+        config = json.load(f)[str(args.truncation)][args.dataset]
+    bins = [(float(b[0]), float(b[1])) for b in config["bins"][args.granularity]]
+
+    text_features = compute_text_features(backbone, bins, args.prompt_type)
+    path = save_text_features(backbone, bins, args.prompt_type, text_features)
+    print(f"Saved text features of shape {tuple(text_features.shape)} to {path}")
+
+
+if __name__ == "__main__":
+    main()
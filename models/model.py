@@ -4,7 +4,7 @@ import os
 from typing import List, Tuple, Union, Callable
 from functools import partial
 
-from .utils import _init_weights
+from .utils import _init_weights, _softmax_expectation
 
 from . import encoder
 from . import encoder_decoder
@@ -50,7 +50,7 @@ class VanillaClassifier(nn.Module):
         assert all(bin[0] <= p <= bin[1] for bin, p in zip(bins, anchor_points)), f"Expected anchor_points to be within the range of the corresponding bin, got {bins} and {anchor_points}"
 
         self.bins = bins
-        self.anchor_points = torch.tensor(anchor_points, dtype=torch.float32, requires_grad=False).view(1, -1, 1, 1)
+        self.register_buffer("anchor_points", torch.tensor(anchor_points, dtype=torch.float32).view(1, -1, 1, 1), persistent=False)
 
         if backbone.channels > 512:
             self.classifier = nn.Sequential(
@@ -67,8 +67,7 @@ class VanillaClassifier(nn.Module):
         x = self.backbone(x)
         x = self.classifier(x)  # shape (B, C, H, W), where C = len(bins), x is the logits
 
-        probs = x.softmax(dim=1)  # shape (B, C, H, W)
-        exp = (probs * self.anchor_points.to(x.device)).sum(dim=1, keepdim=True)  # shape (B, 1, H, W)
+        exp = _softmax_expectation(x, self.anchor_points)  # shape (B, 1, H, W)
         if self.training:
             return x, exp
         else:
@@ -0,0 +1,131 @@
+import json
+from typing import List, Optional, Sequence, Tuple
+
+import numpy as np
+import torch
+from torch import nn, Tensor
+
+
+def has_fixed_input_size(model: nn.Module) -> bool:
+    """
+    CLIP ViT backbones interpolate their positional embeddings only when the input size differs from the training size.
+    The tracer records that branch for the example input, so their ONNX graphs only work at the export size.
+    """
+    return any(hasattr(module, "positional_embedding") and hasattr(module, "num_patches_h") for module in model.modules())
+
+
+def export_onnx(
+    model: nn.Module,
+    path: str,
+    input_size: int = 448,
+    opset_version: int = 17,
+    mean: Tuple[float, float, float] = (0.485, 0.456, 0.406),
+    std: Tuple[float, float, float] = (0.229, 0.224, 0.225),
+) -> None:
+    """
+    Export a model returned by get_model (regressor, classifier or CLIP) to ONNX. The input "image" is a normalized
+    (B, 3, H, W) batch with dynamic batch size, height and width, the output "density" is the (B, 1, H / r, W / r)
+    density map. CLIP heads are fused first. The reduction, bins and normalization constants are stored as metadata
+    so OnnxModel can be used without the PyTorch model. For ViT backbones (see has_fixed_input_size) only the batch
+    size is dynamic, H and W are fixed to input_size.
+    """
+    import onnx
+
+    model = model.cpu().eval()
+    if hasattr(model, "fuse_head"):
+        model.fuse_head()
+
+    fixed_size = has_fixed_input_size(model)
+    image = torch.randn(1, 3, input_size, input_size)
+    dynamic_axes = {"image": {0: "batch"}, "density": {0: "batch"}} if fixed_size else {
+        "image": {0: "batch", 2: "height", 3: "width"},
+        "density": {0: "batch", 2: "density_height", 3: "density_width"},
+    }
+    torch.onnx.export(
+        model,
+        image,
+        path,
+        input_names=["image"],
+        output_names=["density"],
+        dynamic_axes=dynamic_axes,
+        opset_version=opset_version,
+    )
+
+    metadata = {
+        "reduction": model.reduction,
+        "encoder_reduction": getattr(model, "encoder_reduction", model.reduction),
+        "bins": [list(b) for b in model.bins] if model.bins is not None else None,
+        "anchor_points": model.anchor_points.flatten().tolist() if model.anchor_points is not None else None,
+        "mean": list(mean),
+        "std": list(std),
+        "fixed_size": [input_size, input_size] if fixed_size else None,
+    }
+    onnx_model = onnx.load(path)
+    for key, value in metadata.items():
+        entry = onnx_model.metadata_props.add()
+        entry.key = key
+        entry.value = json.dumps(value)
+    onnx.save(onnx_model, path)
+
+
+class OnnxModel:
+    """
+    Runs an exported model with ONNX Runtime, called like the PyTorch model with a normalized (B, 3, H, W) tensor.
+    intra_op_threads parallelizes single operators, inter_op_threads runs independent operators in parallel,
+    0 lets ONNX Runtime decide.
+    """
+
+    def __init__(
+        self,
+        path: str,
+        intra_op_threads: int = 0,
+        inter_op_threads: int = 0,
+        providers: Optional[List[str]] = None,
+    ) -> None:
+        import onnxruntime as ort
+
+        options = ort.SessionOptions()
+        options.intra_op_num_threads = intra_op_threads
+        options.inter_op_num_threads = inter_op_threads
+        if inter_op_threads > 1:
+            options.execution_mode = ort.ExecutionMode.ORT_PARALLEL
+        options.graph_optimization_level = ort.GraphOptimizationLevel.ORT_ENABLE_ALL
+
+        providers = providers if providers is not None else ["CPUExecutionProvider"]
+        self.session = ort.InferenceSession(path, sess_options=options, providers=providers)
+        self.metadata = {key: json.loads(value) for key, value in self.session.get_modelmeta().custom_metadata_map.items()}
+        self.reduction = self.metadata["reduction"]
+        self.encoder_reduction = self.metadata["encoder_reduction"]
+        self.bins = self.metadata["bins"]
+        self.fixed_size = self.metadata.get("fixed_size")
+        self.training = False
+
+    def __call__(self, image: Tensor) -> Tensor:
+        if self.fixed_size is not None:
+            assert list(image.shape[-2:]) == self.fixed_size, f"This ONNX model only accepts {self.fixed_size[0]}x{self.fixed_size[1]} inputs, got {tuple(image.shape[-2:])}. Use the torch backend for other sizes."
+        image = image.detach().cpu().float().numpy()
+        density = self.session.run(["density"], {"image": image})[0]
+        return torch.from_numpy(density)
+
+    def eval(self) -> "OnnxModel":
+        return self
+
+
+@torch.no_grad()
+def verify_onnx(
+    model: nn.Module,
+    path: str,
+    sizes: Sequence[Tuple[int, int]] = ((448, 448), (512, 768)),
+    batch_size: int = 2,
+) -> List[float]:
+    """Compare the ONNX Runtime output with the PyTorch output on random inputs of several sizes. Returns the max absolute difference per size."""
+    model = model.cpu().eval()
+    onnx_model = OnnxModel(path)
+    diffs = []
+    for height, width in sizes:
+        image = torch.randn(batch_size, 3, height, width)
+        expected = model(image)
+        actual = onnx_model(image)
+        assert actual.shape == expected.shape, f"ONNX output shape {tuple(actual.shape)} differs from PyTorch {tuple(expected.shape)} for input {height}x{width}"
+        diffs.append(float(np.abs(actual.numpy() - expected.numpy()).max()))
+    return diffs
@@ -0,0 +1,77 @@
+import copy
+from typing import Iterable, List
+
+import torch
+from torch import nn, Tensor
+from torch.ao.quantization import quantize_dynamic, get_default_qconfig_mapping
+from torch.ao.quantization.quantize_fx import prepare_fx, convert_fx
+
+
+def _conv_submodules(model: nn.Module) -> List[str]:
+    """Names of the convolutional parts of a model that are quantized statically: the image encoder and decoder of
+    CLIP models, the backbone of the classifiers and regressors. The heads stay in floating point."""
+    if hasattr(model, "image_encoder"):
+        return [name for name in ["image_encoder", "image_decoder"] if not isinstance(getattr(model, name), nn.Identity)]
+    return ["backbone"]
+
+
+def linear_parameter_fraction(model: nn.Module) -> float:
+    """Fraction of the parameters of a model that are in Linear layers, i.e. what dynamic quantization can affect."""
+    total = sum(p.numel() for p in model.parameters())
+    linear = sum(p.numel() for m in model.modules() if isinstance(m, nn.Linear) for p in m.parameters(recurse=False))
+    return linear / max(total, 1)
+
+
+def quantize_dynamic_int8(model: nn.Module) -> nn.Module:
+    """
+    Quantize the weights of all Linear layers to INT8, activations are quantized on the fly. CPU only.
+
+    Only Linear layers are affected, so this helps the CLIP ViT backbones, but is close to a no-op for the VGG, ResNet
+    and CLIP ResNet backbones, whose compute is almost entirely in convolutions (the fused CLIP head is a 1x1 conv).
+    """
+    return quantize_dynamic(copy.deepcopy(model).eval(), {nn.Linear}, dtype=torch.qint8)
+
+
+@torch.no_grad()
+def quantize_static_int8(model: nn.Module, calibration_batches: Iterable[Tensor], backend: str = "x86") -> nn.Module:
+    """
+    Experimental. Post-training static INT8 quantization of the convolutional parts of a model with FX graph mode.
+    It has not been validated on every backbone: FX symbolic tracing of the CLIP ModifiedResNet (attention pooling,
+    in-place ops) may fail or lose accuracy, so check a model with benchmarks/precision_report.py before using it.
+
+    Observers are
+    inserted, the model is run on the calibration batches (normalized (B, 3, H, W) images, e.g. saved camera frames)
+    to collect activation ranges, and the observed modules are converted to quantized ones. Linear layers are
+    quantized dynamically afterwards. CPU only.
+    """
+    torch.backends.quantized.engine = backend
+    model = copy.deepcopy(model).cpu().eval()
+    qconfig_mapping = get_default_qconfig_mapping(backend)
+
+    calibration_batches = list(calibration_batches)
+    assert len(calibration_batches) > 0, "Static quantization needs at least one calibration batch"
+    names = _conv_submodules(model)
+
+    # The inputs of every quantized part on the first batch serve as example inputs, the shapes stay dynamic
+    example_inputs = {}
+
+    def store_inputs(name: str):
+        def hook(module: nn.Module, args: tuple) -> None:
+            example_inputs.setdefault(name, args)
+        return hook
+
+    hooks = [getattr(model, name).register_forward_pre_hook(store_inputs(name)) for name in names]
+    model(calibration_batches[0])
+    for hook in hooks:
+        hook.remove()
+
+    for name in names:
+        setattr(model, name, prepare_fx(getattr(model, name), qconfig_mapping, example_inputs=example_inputs[name]))
+
+    for batch in calibration_batches:
+        model(batch)
+
+    for name in names:
+        setattr(model, name, convert_fx(getattr(model, name)))
+    # Only matters for Linear layers outside the quantized parts, e.g. the heads of the classifiers
+    return quantize_dynamic(model, {nn.Linear}, dtype=torch.qint8)
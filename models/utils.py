@@ -442,3 +442,12 @@ def make_resnet_layers(
     layers = nn.Sequential(*layers)
     layers.apply(_init_weights)
     return layers
+
+
+def _softmax_expectation(logits: Tensor, anchor_points: Tensor) -> Tensor:
+    """
+    Expected count per pixel: the softmax over the bins (dim 1) weighted by the (1, N, 1, 1) anchor points.
+    The weighted sum is done as a 1x1 convolution with the anchor points as weight, a single kernel instead of a
+    multiplication, a reduction and their intermediate tensors.
+    """
+    return F.conv2d(logits.softmax(dim=1), anchor_points.to(logits.dtype))
@@ -0,0 +1,40 @@
+import pickle
+from typing import Dict, Union
+
+import torch
+from torch import nn, Tensor
+from safetensors.torch import load_file, save_file
+
+
+def load_weights(path: str, map_location: Union[str, torch.device] = "cpu") -> Dict[str, Tensor]:
+    """
+    Load a state dict without reading the whole file into memory first. safetensors files and checkpoints written by
+    torch.save (zip format) are memory mapped, so tensors are only read when they are used. Legacy checkpoints and
+    checkpoints that are not plain state dicts fall back to a regular torch.load.
+    """
+    path = str(path)
+    if path.endswith(".safetensors"):
+        return load_file(path, device=str(map_location))
+    try:
+        return torch.load(path, map_location=map_location, mmap=True, weights_only=True)
+    except (RuntimeError, pickle.UnpicklingError):
+        return torch.load(path, map_location=map_location)
+
+
+def save_weights(state_dict: Dict[str, Tensor], path: str) -> None:
+    """Save a state dict as safetensors, which can be memory mapped by load_weights."""
+    save_file({key: value.detach().cpu().contiguous() for key, value in state_dict.items()}, str(path))
+
+
+def assign_state_dict(model: nn.Module, state_dict: Dict[str, Tensor], strict: bool = True):
+    """
+    Like model.load_state_dict, but the loaded tensors become the parameters and buffers instead of being copied
+    into them, so memory mapped weights are not duplicated. Tensors whose dtype differs from the parameter they
+    replace are cast first, which does copy them.
+    """
+    own_state = model.state_dict()
+    state_dict = {
+        key: value.to(own_state[key].dtype) if key in own_state and value.dtype != own_state[key].dtype else value
+        for key, value in state_dict.items()
+    }
+    return model.load_state_dict(state_dict, strict=strict, assign=True)
@@ -0,0 +1,145 @@
+import threading
+import time
+import logging
+from queue import Queue, Full, Empty
+from typing import Callable, List, Optional
+
+logger = logging.getLogger(__name__)
+
+
+class Stage:
+    """
+    One step of the pipeline, run by its own worker thread.
+
+    Items are taken from a bounded input queue and the output of `fn` is handed to the next stage.
+    If `fn` returns None the item is not passed on. When the input queue is full the oldest item is
+    dropped, so a slow stage never blocks the stages before it. `on_discard` is called with items that are
+    dropped or for which `fn` raised.
+    """
+
+    def __init__(self, name: str, fn: Callable, max_queue_size: int = 2, on_discard: Optional[Callable] = None):
+        self.name = name
+        self.fn = fn
+        self.on_discard = on_discard
+        self.queue = Queue(maxsize=max_queue_size)
+        self.next_stage: Optional["Stage"] = None
+        self.thread = None
+
+        self.lock = threading.Lock()
+        self.processed = 0
+        self.dropped = 0
+        self.failed = 0
+        self.last_latency = 0.0
+        self.total_latency = 0.0
+
+    def put(self, item):
+        """Put an item on the input queue, dropping the oldest item if the queue is full."""
+        while True:
+            try:
+                self.queue.put_nowait(item)
+                return
+            except Full:
+                try:
+                    dropped = self.queue.get_nowait()
+                    with self.lock:
+                        self.dropped += 1
+                    logger.warning(f"Stage {self.name} is falling behind, dropped the oldest item.")
+                    self.discard(dropped)
+                except Empty:
+                    pass
+
+    def discard(self, item):
+        if self.on_discard is None:
+            return
+        try:
+            self.on_discard(item)
+        except Exception as e:
+            logger.exception(f"Error discarding an item of stage {self.name}: {e}")
+
+    def run(self, stop_event: threading.Event):
+        while not stop_event.is_set():
+            try:
+                item = self.queue.get(timeout=0.5)
+            except Empty:
+                continue
+
+            start_time = time.time()
+            try:
+                output = self.fn(item)
+            except Exception as e:
+                logger.exception(f"Error in stage {self.name}: {e}")
+                with self.lock:
+                    self.failed += 1
+                self.discard(item)
+                continue
+            latency = time.time() - start_time
+
+            with self.lock:
+                self.processed += 1
+                self.last_latency = latency
+                self.total_latency += latency
+
+            if output is not None and self.next_stage is not None:
+                self.next_stage.put(output)
+
+    def stats(self) -> dict:
+        with self.lock:
+            return {
+                "queue_depth": self.queue.qsize(),
+                "processed": self.processed,
+                "dropped": self.dropped,
+                "failed": self.failed,
+                "last_latency": self.last_latency,
+                "avg_latency": self.total_latency / self.processed if self.processed > 0 else 0.0,
+            }
+
+
+class Pipeline:
+    """
+    Chain of stages with a worker thread per stage, fed by a ticker that emits a cycle number every `interval` seconds.
+
+    Because every stage runs in its own thread, different cycles are processed at the same time, e.g. inference
+    on cycle N while cycle N-1 is written to the database and the images of cycle N-2 are saved.
+    """
+
+    def __init__(self, stages: List[Stage], interval: float = 120):
+        assert len(stages) > 0, "Expected at least one stage."
+        self.stages = stages
+        self.interval = interval
+        for stage, next_stage in zip(stages[:-1], stages[1:]):
+            stage.next_stage = next_stage
+
+        self.stop_event = threading.Event()
+        self.ticker_thread = None
+
+    def tick(self):
+        cycle = 0
+        next_run = time.time()
+        while not self.stop_event.is_set():
+            self.stages[0].put(cycle)
+            cycle += 1
+            next_run += self.interval
+            self.stop_event.wait(max(0, next_run - time.time()))
+
+    def start(self):
+        self.stop_event.clear()
+        for stage in self.stages:
+            stage.thread = threading.Thread(target=stage.run, args=(self.stop_event,), name=f"stage-{stage.name}", daemon=True)
+            stage.thread.start()
+        self.ticker_thread = threading.Thread(target=self.tick, name="stage-ticker", daemon=True)
+        self.ticker_thread.start()
+
+    def stop(self):
+        self.stop_event.set()
+        self.ticker_thread.join()
+        for stage in self.stages:
+            stage.thread.join()
+
+    def stats(self) -> dict:
+        return {stage.name: stage.stats() for stage in self.stages}
+
+    def log_stats(self):
+        for name, stats in self.stats().items():
+            logger.info(f"Stage {name}: queue depth {stats['queue_depth']}, processed {stats['processed']}, "
+                        f"dropped {stats['dropped']}, failed {stats['failed']}, "
+                        f"last latency {stats['last_latency']:.2f}s, avg latency {stats['avg_latency']:.2f}s")
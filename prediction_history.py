@@ -0,0 +1,69 @@
+import threading
+from collections import deque
+from itertools import islice
+from typing import Optional, Tuple
+
+from PIL import Image
+
+
+class PredictionHistory:
+    """
+    Bounded history of predictions per camera.
+
+    Keeps the last `depth` predictions of every camera in a ring buffer. Instead of the full frame, each entry holds
+    a small thumbnail (if thumbnail_size is set) and the paths of the saved images, if any.
+    """
+
+    def __init__(self, depth: int = 10, thumbnail_size: Optional[Tuple[int, int]] = (320, 240)):
+        assert depth > 0, f"Expected depth to be positive, got {depth}"
+        self.depth = depth
+        self.thumbnail_size = thumbnail_size
+        self.lock = threading.Lock()
+        self.history = {}
+
+    def add(self, camera: str, timestamp: str, count: int, frame: Optional[Image.Image] = None) -> dict:
+        thumbnail = None
+        if frame is not None and self.thumbnail_size is not None:
+            thumbnail = frame.copy()
+            thumbnail.thumbnail(self.thumbnail_size, Image.LANCZOS)
+
+        entry = {
+            "camera": camera,
+            "timestamp": timestamp,
+            "count": count,
+            "thumbnail": thumbnail,
+            "image_path": None,
+            "density_map_path": None,
+        }
+        with self.lock:
+            if camera not in self.history:
+                self.history[camera] = deque(maxlen=self.depth)
+            self.history[camera].append(entry)
+        return entry
+
+    def set_paths(self, camera: str, timestamp: str, image_path=None, density_map_path=None) -> None:
+        """Record where the images of a prediction were saved."""
+        with self.lock:
+            for entry in reversed(self.history.get(camera, ())):
+                if entry["timestamp"] == timestamp:
+                    entry["image_path"] = image_path
+                    entry["density_map_path"] = density_map_path
+                    return
+
+    def last(self, camera: str, n: int = 1) -> list:
+        """The last n predictions of a camera, newest first. The entries are shared, not copied."""
+        with self.lock:
+            return list(islice(reversed(self.history.get(camera, ())), n))
+
+    def latest(self) -> dict:
+        """The newest prediction of every camera."""
+        with self.lock:
+            return {camera: entries[-1] for camera, entries in self.history.items() if len(entries) > 0}
+
+    def cameras(self) -> list:
+        with self.lock:
+            return list(self.history.keys())
+
+    def __len__(self) -> int:
+        with self.lock:
+            return sum(len(entries) for entries in self.history.values())
@@ -1,10 +1,13 @@
+import time
+from contextlib import nullcontext
+
 import torch
 from torch import nn
 from torch.optim import Optimizer
 from torch.utils.data import DataLoader
 import numpy as np
 from tqdm import tqdm
-from typing import Dict, Tuple
+from typing import Dict, Tuple, Optional
 
 
 from utils import barrier, reduce_mean, update_loss_info
@@ -18,28 +21,53 @@ def train(
     device: torch.device,
     rank: int,
     nprocs: int,
+    amp: str = "off",
+    scaler: Optional[torch.cuda.amp.GradScaler] = None,
+    channels_last: bool = False,
 ) -> Tuple[nn.Module, Optimizer, Dict[str, float]]:
+    """
+    amp="fp16" or "bf16" runs the forward pass of the model under autocast, the loss (including the Sinkhorn solve of
+    the dmcount loss) is always computed in FP32. With fp16 the loss is scaled by scaler. The returned info also has
+    the training throughput in images per second over all processes.
+    """
+    assert amp in ["off", "fp16", "bf16"], f"Expected amp to be one of ['off', 'fp16', 'bf16'], got {amp}"
+    assert amp != "fp16" or scaler is not None, "fp16 training needs a GradScaler"
     model.train()
     info = None
     data_iter = tqdm(data_loader) if rank == 0 else data_loader
     ddp = nprocs > 1
     regression = (model.module.bins is None) if ddp else (model.bins is None)
+    autocast = torch.autocast(device.type, dtype=torch.float16 if amp == "fp16" else torch.bfloat16) if amp != "off" else nullcontext()
+    num_images, start = 0, time.perf_counter()
 
-    for image, target_points, target_density in data_iter:
-        image = image.to(device)
+    for batch in data_iter:
+        # (image, points, density), plus the image names and the crop parameters when the OT warm starts need them
+        image, target_points, target_density = batch[:3]
+        image_names = batch[3] if len(batch) >= 4 else None
+        crop_params = batch[4] if len(batch) >= 5 else None
+        image = image.to(device, memory_format=torch.channels_last) if channels_last else image.to(device)
         target_points = [p.to(device) for p in target_points]
         target_density = target_density.to(device)
         with torch.set_grad_enabled(True):
+            with autocast:
+                outputs = model(image)
+            # The loss stays in FP32, the OT solve is not stable in half precision
             if not regression:
-                pred_class, pred_density = model(image)
-                loss, loss_info = loss_fn(pred_class, pred_density, target_density, target_points)
+                pred_class, pred_density = (o.float() for o in outputs)
+                loss, loss_info = loss_fn(pred_class, pred_density, target_density, target_points, image_names, crop_params)
             else:
-                pred_density = model(image)
-                loss, loss_info = loss_fn(pred_density, target_density, target_points)
+                pred_density = outputs.float()
+                loss, loss_info = loss_fn(pred_density, target_density, target_points, image_names, crop_params)
 
             optimizer.zero_grad()
-            loss.backward()
-            optimizer.step()
+            if scaler is not None:
+                scaler.scale(loss).backward()
+                scaler.step(optimizer)
+                scaler.update()
+            else:
+                loss.backward()
+                optimizer.step()
+        num_images += image.size(0)
 
         loss_info = {k: reduce_mean(v.detach(), nprocs).item() if ddp else v.detach().item() for k, v in loss_info.items()}
         # if rank == 0:
@@ -48,4 +76,6 @@ def train(
 
         barrier(ddp)
 
-    return model, optimizer, {k: np.mean(v) for k, v in info.items()}
+    info = {k: np.mean(v) for k, v in info.items()}
+    info["images_per_sec"] = num_images * nprocs / (time.perf_counter() - start)
+    return model, optimizer, info
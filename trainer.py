@@ -57,6 +57,13 @@ parser.add_argument("--zero_pad_to_multiple", action="store_true", help="Zero pa
 # Parameters for loss function
 parser.add_argument("--weight_count_loss", type=float, default=1.0, help="The weight for count loss.")
 parser.add_argument("--count_loss", type=str, default="mae", choices=["mae", "mse", "dmcount"], help="The loss function for count.")
+parser.add_argument("--per_sample_ot", action="store_true", help="Solve the OT problems of the dmcount loss image by image instead of batched.")
+parser.add_argument("--num_of_iter_in_ot", type=int, default=100, help="Maximum number of Sinkhorn iterations in the OT loss.")
+parser.add_argument("--ot_tol", type=float, default=1e-9, help="Sinkhorn stops once the marginal error of every image is below this tolerance.")
+parser.add_argument("--ot_log_domain", action="store_true", help="Use the log-domain stabilized Sinkhorn solver.")
+parser.add_argument("--ot_warm_start", action="store_true", help="Start Sinkhorn from the potentials of an earlier solve of the same image and crop position. Requires --ot_log_domain.")
+parser.add_argument("--ot_warm_start_cache_size", type=int, default=4096, help="Maximum number of crops whose OT potentials are kept for warm starts.")
+parser.add_argument("--ot_separable", action="store_true", help="Apply the OT kernel as separate x and y factors instead of building the full [#gt, H*W] cost.")
 
 # Parameters for optimizer (Adam)
 parser.add_argument("--lr", type=float, default=1e-4, help="The learning rate.")
@@ -71,6 +78,8 @@ parser.add_argument("--eta_min", type=float, default=1e-7, help="Minimum learnin
 
 # Parameters for training
 parser.add_argument("--total_epochs", type=int, default=2600, help="Number of epochs to train.")
+parser.add_argument("--amp", type=str, default="off", choices=["off", "fp16", "bf16"], help="Mixed precision for the forward pass, the loss is always computed in FP32.")
+parser.add_argument("--channels_last", action="store_true", help="Use the channels-last memory format for the model and the images.")
 parser.add_argument("--eval_start", type=int, default=50, help="Start to evaluate after this number of epochs.")
 parser.add_argument("--eval_freq", type=int, default=1, help="Evaluate every this number of epochs.")
 parser.add_argument("--num_workers", type=int, default=4, help="Number of workers for data loading.")
@@ -109,7 +118,7 @@ def run(local_rank: int, nprocs: int, args: ArgumentParser) -> None:
         prompt_type=args.prompt_type
     )
 
-    model = model.to(device)
+    model = model.to(device, memory_format=torch.channels_last) if args.channels_last else model.to(device)
 
     loss_fn = get_loss_fn(args).to(device)
     optimizer, scheduler = get_optimizer(args, model)
@@ -135,6 +144,8 @@ def run(local_rank: int, nprocs: int, args: ArgumentParser) -> None:
 
     model = DDP(nn.SyncBatchNorm.convert_sync_batchnorm(model), device_ids=[local_rank], output_device=local_rank) if ddp else model
 
+    scaler = torch.cuda.amp.GradScaler() if args.amp == "fp16" else None
+
     for epoch in range(start_epoch, args.total_epochs + 1):  # start from 1
         if local_rank == 0:
             message = f"\tlr: {optimizer.param_groups[0]['lr']:.3e}"
@@ -143,7 +154,7 @@ def run(local_rank: int, nprocs: int, args: ArgumentParser) -> None:
         if sampler is not None:
             sampler.set_epoch(epoch)
 
-        model, optimizer, loss_info = train(model, train_loader, loss_fn, optimizer, device, local_rank, nprocs)
+        model, optimizer, loss_info = train(model, train_loader, loss_fn, optimizer, device, local_rank, nprocs, args.amp, scaler, args.channels_last)
         scheduler.step()
         barrier(ddp)
 
@@ -203,6 +214,10 @@ def main():
         assert args.zero_pad_to_multiple or args.resize_to_multiple, "Sliding window strategy requires zero pad or resize to multiple."
 
     assert not (args.zero_pad_to_multiple and args.resize_to_multiple), "Cannot use both zero pad and resize to multiple."
+    assert not (args.ot_warm_start and not args.ot_log_domain), "OT warm starts require --ot_log_domain."
+    assert not (args.per_sample_ot and args.ot_log_domain), "The log-domain OT solver is only available batched."
+    assert not (args.per_sample_ot and args.ot_separable), "The separable OT solver is only available batched."
+    assert not (args.ot_separable and args.ot_log_domain), "Cannot use both --ot_separable and --ot_log_domain."
     args.nprocs = torch.cuda.device_count()
     print(f"Using {args.nprocs} GPUs.")
     if args.nprocs > 1:
@@ -1,7 +1,9 @@
+import threading
+import time
+from typing import Optional
+
 import cv2
 import numpy as np
-import torch
-import torch.nn.functional as F
 
 
 def convert_to_pixel_coords(mask_points, width, height):
@@ -23,8 +25,121 @@ def apply_mask(image, mask, fill_color=(255, 255, 255)):
     return masked_image
 
 
-def resize_density_map(x, size):
-    x_sum = torch.sum(x, dim=(-1, -2))
-    x = F.interpolate(x, size=size, mode="bilinear")
-    scale_factor = torch.nan_to_num(torch.sum(x, dim=(-1, -2)) / x_sum, nan=0.0, posinf=0.0, neginf=0.0)
-    return x * scale_factor
+class ResolutionPolicy:
+    """
+    Chooses the resolution at which the frames of one camera are fed to the model.
+
+    "native" keeps the frame as is, "fixed" downscales frames whose longest side exceeds max_side. "adaptive" uses the
+    last count of the camera: at or below sparse_count frames are downscaled to min_side, at or above dense_count they
+    are downscaled to max_side (None for native resolution), with the longest side interpolated linearly in between.
+    Until the first count is known, adaptive frames are fed at max_side. Frames are never upscaled.
+    """
+
+    modes = ["native", "fixed", "adaptive"]
+
+    def __init__(self, mode: str = "native", max_side: int = None, min_side: int = 640,
+                 sparse_count: float = 10, dense_count: float = 100):
+        assert mode in self.modes, f"Expected mode to be in {self.modes}, got {mode}"
+        assert mode != "fixed" or max_side is not None, "The fixed resolution policy needs a max_side"
+        assert sparse_count < dense_count, f"Expected sparse_count < dense_count, got {sparse_count} and {dense_count}"
+        self.mode = mode
+        self.max_side = max_side
+        self.min_side = min_side
+        self.sparse_count = sparse_count
+        self.dense_count = dense_count
+        self.last_count = None
+
+    def update(self, count: float):
+        self.last_count = count
+
+    def longest_side(self, width: int, height: int) -> int:
+        native_side = max(width, height)
+        max_side = native_side if self.max_side is None else min(self.max_side, native_side)
+        if self.mode == "native":
+            return native_side
+        if self.mode == "fixed" or self.last_count is None:
+            return max_side
+
+        min_side = min(self.min_side, max_side)
+        fraction = (self.last_count - self.sparse_count) / (self.dense_count - self.sparse_count)
+        fraction = min(max(fraction, 0.0), 1.0)
+        return int(round(min_side + fraction * (max_side - min_side)))
+
+    def target_size(self, width: int, height: int) -> tuple:
+        """(width, height) to resize a frame to, keeping the aspect ratio."""
+        side = self.longest_side(width, height)
+        if side >= max(width, height):
+            return width, height
+        scale = side / max(width, height)
+        return max(1, round(width * scale)), max(1, round(height * scale))
+
+
+class FrameChangeDetector:
+    """
+    Detects whether a camera frame changed enough since the last frame that was run through the model.
+
+    Frames are compared as small grayscale thumbnails (the masked ROI from Camera.get_frame, so changes outside the
+    crop polygon are ignored). A frame counts as changed when the mean absolute pixel difference to the reference
+    thumbnail is at least threshold (on a 0-255 scale), when there is no reference yet, or when the reference is
+    older than refresh_interval seconds. The reference is only replaced by changed frames, so slow changes add up.
+
+    Comparing (match) and replacing the reference (update) are separate steps: the reference is only replaced once
+    the prediction of the new frame exists, and every reference has an id that is stored with that prediction. A
+    frame may only reuse a prediction made for the reference it was compared against.
+    """
+
+    def __init__(self, threshold: float = 4.0, thumbnail_width: int = 64, refresh_interval: float = 600.0):
+        self.threshold = threshold
+        self.thumbnail_width = thumbnail_width
+        self.refresh_interval = refresh_interval
+        self.references = {}  # camera name -> (thumbnail, time, id)
+        self.next_id = 0
+        self.lock = threading.Lock()
+        self.computed = {}
+        self.skipped = {}
+
+    def thumbnail(self, frame) -> np.ndarray:
+        frame = np.asarray(frame)
+        if frame.ndim == 3:
+            frame = cv2.cvtColor(frame, cv2.COLOR_RGB2GRAY)
+        height, width = frame.shape
+        size = (min(self.thumbnail_width, width), max(1, round(height * min(self.thumbnail_width, width) / width)))
+        return cv2.resize(frame, size, interpolation=cv2.INTER_AREA).astype(np.float32)
+
+    def match(self, camera_name: str, frame, now: float = None) -> Optional[int]:
+        """Compare the frame with the reference of the camera. Returns the id of the reference if the frame did not change, else None."""
+        now = time.time() if now is None else now
+        thumbnail = self.thumbnail(frame)
+        with self.lock:
+            reference = self.references.get(camera_name)
+            changed = (
+                reference is None
+                or reference[0].shape != thumbnail.shape
+                or now - reference[1] >= self.refresh_interval
+                or float(np.abs(thumbnail - reference[0]).mean()) >= self.threshold
+            )
+            if changed:
+                self.computed[camera_name] = self.computed.get(camera_name, 0) + 1
+            else:
+                self.skipped[camera_name] = self.skipped.get(camera_name, 0) + 1
+        return None if changed else reference[2]
+
+    def update(self, camera_name: str, frame, now: float = None) -> int:
+        """Make the frame the reference of the camera, once its prediction is available. Returns the id of the new reference."""
+        now = time.time() if now is None else now
+        thumbnail = self.thumbnail(frame)
+        with self.lock:
+            reference_id = self.next_id
+            self.next_id += 1
+            self.references[camera_name] = (thumbnail, now, reference_id)
+        return reference_id
+
+    def reset(self, camera_name: str):
+        """Forget the reference of a camera, so its next frame is computed."""
+        with self.lock:
+            self.references.pop(camera_name, None)
+
+    def stats(self) -> dict:
+        with self.lock:
+            cameras = set(self.computed) | set(self.skipped)
+            return {name: {"computed": self.computed.get(name, 0), "skipped": self.skipped.get(name, 0)} for name in cameras}
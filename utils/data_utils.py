@@ -38,7 +38,8 @@ def get_dataloader(args: ArgumentParser, split: str = "train", ddp: bool = False
         transforms=transforms,
         percentage=args.percentage,
         sigma=None,
-        return_filename=False,
+        return_filename=split == "train" and args.ot_warm_start,  # warm starts of the OT potentials are keyed by image name and crop
+        return_crop_params=split == "train" and args.ot_warm_start,
         num_crops=args.num_crops if split == "train" else 1,
     )
 
@@ -1,8 +1,9 @@
 import torch
 from torch import Tensor, nn
 import torch.nn.functional as F
-import torchvision.transforms.functional as TF
 import numpy as np
+from collections import Counter
+from functools import lru_cache
 from typing import Dict, Tuple, Union, Iterable, List, Optional
 
 
@@ -22,9 +23,10 @@ def calculate_errors(pred_counts: np.ndarray, target_counts: np.ndarray) -> Dict
 
 
 def resize_density_map(x: Tensor, size: Tuple[int, int]) -> Tensor:
-    x_sum = torch.sum(x, dim=(-1, -2))
+    """Resize (B, C, H, W) density maps bilinearly, rescaled so every map keeps its sum (the count)."""
+    x_sum = torch.sum(x, dim=(-1, -2), keepdim=True)
     x = F.interpolate(x, size=size, mode="bilinear")
-    scale_factor = torch.nan_to_num(torch.sum(x, dim=(-1, -2)) / x_sum, nan=0.0, posinf=0.0, neginf=0.0)
+    scale_factor = torch.nan_to_num(x_sum / torch.sum(x, dim=(-1, -2), keepdim=True), nan=0.0, posinf=0.0, neginf=0.0)
     return x * scale_factor
 
 
@@ -34,16 +36,22 @@ def sliding_window_predict(
     window_size: Union[int, Tuple[int, int]],
     stride: Optional[Union[int, Tuple[int, int]]] = None,
     strategy: str = "mean",
+    batch_size: int = 8,
 ) -> Tensor:
     """
     Use the sliding window strategy to predict the density map of an image.
 
+    The windows are cut from the image and run through the model batch_size windows at a time. Their predictions are
+    accumulated in place into a single output map, which is divided by the number of windows covering each pixel
+    (cached per image size, window, stride and reduction) for the "mean" strategy.
+
     Args:
         model (nn.Module): The model to use for prediction.
         image (Tensor): The image to predict.
         window_size (Union[int, Tuple[int, int]]): The size of the window.
         stride (Optional[Union[int, Tuple[int, int]]], optional): The stride of the window. Defaults to None. If None, stride is equal to window_size.
         strategy (str, optional): The strategy to use to aggregate the predictions. Defaults to "mean".
+        batch_size (int, optional): The number of windows per forward pass. Defaults to 8.
 
     Returns:
         Tensor: The predicted density map.
@@ -51,96 +59,80 @@ def sliding_window_predict(
     window = (window_size, window_size) if isinstance(window_size, (int, float)) else window_size
     stride = (stride, stride) if isinstance(stride, (int, float)) else stride
     stride = window if stride is None else stride
+    window, stride = (int(window[0]), int(window[1])), (int(stride[0]), int(stride[1]))
     assert isinstance(window, Iterable) and len(window) == 2 and window[0] > 0 and window[1] > 0, f"Window size must be a positive integer tuple (h, w), got {window}"
     assert isinstance(stride, Iterable) and len(stride) == 2 and stride[0] > 0 and stride[1] > 0, f"Stride must be a positive integer tuple (h, w), got {stride}"
     assert stride[0] <= window[0] and stride[1] <= window[1], f"Stride must be smaller than window size, got {stride} and {window}"
     assert strategy in ["mean", "max"], f"Strategy must be either 'mean' or 'max', got {strategy}"
+    assert batch_size > 0, f"Batch size must be positive, got {batch_size}"
     image = image.unsqueeze(0) if len(image.shape) == 3 else image
     assert len(image.shape) == 4, f"Image must be a 3D tensor (h, w, c) or 4D tensor (b, h, w, c), got {image.shape}"
 
-    preds = []
-    for x, y, patch in _sliding_window(image, window_size=window, step_size=stride):
-        patch_density_map = _process_patch(model, patch)
-        preds.append((x, y, patch_density_map))
-
-    return _combine_patches(preds, image.shape[-2:], window, model.reduction, strategy)
-
-
-def _sliding_window(image: Tensor, window_size: Tuple[int, int], step_size: Tuple[int, int]) -> Iterable[Tuple[int, int, Tensor]]:
+    img_h, img_w = image.shape[-2:]
+    p_h, p_w = window
+    reduction = model.reduction
+    positions = _window_positions((img_h, img_w), window, stride)
+    out_p_h, out_p_w = p_h // reduction, p_w // reduction
+
+    output = None
+    for start in range(0, len(positions), batch_size):
+        chunk = positions[start : start + batch_size]
+        patches = torch.cat([image[:, :, y : y + p_h, x : x + p_w] for (x, y), _ in chunk], dim=0)  # (n * b, c, p_h, p_w)
+        preds = model(patches)
+        preds = preds.view(len(chunk), image.shape[0], *preds.shape[1:])  # (n, b, c, p_h / r, p_w / r)
+        if output is None:
+            output = torch.zeros((image.shape[0], preds.shape[2], img_h // reduction, img_w // reduction), dtype=preds.dtype, device=preds.device)
+
+        for ((x, y), multiplicity), pred in zip(chunk, preds):
+            x, y = x // reduction, y // reduction
+            region = output[:, :, y : y + out_p_h, x : x + out_p_w]
+            if strategy == "mean":
+                region += pred if multiplicity == 1 else pred * multiplicity
+            else:
+                region.copy_(torch.maximum(region, pred))
+
+    if strategy == "mean":
+        output /= _count_map((img_h, img_w), window, stride, reduction, output.device).to(output.dtype)
+    return output
+
+
+@lru_cache(maxsize=32)
+def _window_positions(image_size: Tuple[int, int], window_size: Tuple[int, int], step_size: Tuple[int, int]) -> List[Tuple[Tuple[int, int], int]]:
     """
-    Sliding window generator over the image.
+    Top left corners (x, y) of the sliding windows over an image, with the number of times each one occurs. Windows
+    that would cross the bottom or right border are shifted back inside the image, so the last row and column of
+    windows end at the border. Shifted windows can land on the same position several times; each position is run
+    through the model once, but keeps its multiplicity in the "mean" weighting, as when every window was predicted.
 
     Args:
-        image (Tensor): The image (b, c, h, w) to slide over.
+        image_size (Tuple[int, int]): The size (h, w) of the image.
         window_size (Tuple[int, int]): The size (h, w) of the window.
         step_size (Tuple[int, int]): The step size (h, w) of the window.
     """
-    assert len(image.shape) == 4, f"Image must be a 4D tensor (b, c, h, w), got {image.shape}"
-    img_h, img_w = image.shape[2:]
+    img_h, img_w = image_size
     p_h, p_w = window_size
     s_h, s_w = step_size
-    assert p_h <= img_h and p_w <= img_w, f"Window size must be smaller than image size, got window_size={window_size} and image.shape={image.shape}"
+    assert p_h <= img_h and p_w <= img_w, f"Window size must be smaller than image size, got window_size={window_size} and image_size={image_size}"
     assert s_h <= p_h and s_w <= p_w, f"Step size must be smaller than window size, got step_size={step_size} and window_size={window_size}"
 
-    for y in range(0, img_h + s_h, s_h):
-        for x in range(0, img_w + s_w, s_w):
-            if y + p_h <= img_h and x + p_w <= img_w: # yield current window
-                yield (x, y, TF.crop(image, y, x, p_h, p_w))
-            elif y + p_h > img_h and x + p_w <= img_w: # yield the last window
-                yield (x, img_h - p_h, TF.crop(image, img_h - p_h, x, p_h, p_w))
-            elif y + p_h <= img_h and x + p_w > img_w: # yield the last window
-                yield (img_w - p_w, y, TF.crop(image, y, img_w - p_w, p_h, p_w))
-            else: # yield the last window
-                yield (img_w - p_w, img_h - p_h, TF.crop(image, img_h - p_h, img_w - p_w, p_h, p_w))
-
-
-def _process_patch(model: nn.Module, patch: Tensor) -> Tensor:
-    """
-    Process a patch with the given model.
-
-    Args:
-        model (nn.Module): The model to use.
-        patch (Tensor): The patch to process.
-    """
-    assert len(patch.shape) == 4, f"Patch must be a 4D tensor (b, c, h, w), got {patch.shape}"
-    return model(patch)
+    ys = Counter(min(y, img_h - p_h) for y in range(0, img_h + s_h, s_h))
+    xs = Counter(min(x, img_w - p_w) for x in range(0, img_w + s_w, s_w))
+    return [((x, y), ys[y] * xs[x]) for y in sorted(ys) for x in sorted(xs)]
 
 
-def _combine_patches(
-    preds: List[Tuple[int, int, Tensor]],
+@lru_cache(maxsize=32)
+def _count_map(
     image_size: Tuple[int, int],
     window_size: Tuple[int, int],
-    reduction: int = 1,
-    strategy: str = "mean",
+    step_size: Tuple[int, int],
+    reduction: int,
+    device: torch.device,
 ) -> Tensor:
-    """
-    Combine the density maps of the patches into a single density map.
-
-    Args:
-        density_maps (List[Tuple[int, int, Tensor]]): The list of density maps of the patches.
-        image_size (Tuple[int, int]): The size of the image.
-        window_size (Tuple[int, int]): The size of the window.
-        step_size (Tuple[int, int]): The step size of the window.
-        strategy (str, optional): The strategy to use to aggregate the predictions. Defaults to "mean".
-    """
-    assert strategy in ["mean", "max"], f"Strategy must be either 'mean' or 'max', got {strategy}"
-    channels, dtype, device = preds[0][2].shape[-3], preds[0][2].dtype, preds[0][2].device
+    """Number of windows covering each pixel of the (1, 1, h / r, w / r) output map. Cached, do not modify the result in place."""
     img_h, img_w = image_size
-    p_h, p_w = window_size
-
-    img_h, img_w = img_h // reduction, img_w // reduction
-    p_h, p_w = p_h // reduction, p_w // reduction
-
-    full_map = torch.zeros((1, channels, img_h, img_w), dtype=dtype, device=device)
-    count_map = torch.zeros(1, channels, img_h, img_w, dtype=dtype, device=device)  # keep track of how many times a pixel has been visited
-    max_map = torch.zeros(1, channels, img_h, img_w, dtype=dtype, device=device)
-
-    for x, y, pred in preds:
+    p_h, p_w = window_size[0] // reduction, window_size[1] // reduction
+    count_map = torch.zeros((1, 1, img_h // reduction, img_w // reduction), dtype=torch.float32, device=device)
+    for (x, y), multiplicity in _window_positions(image_size, window_size, step_size):
         x, y = x // reduction, y // reduction
-        full_map[:, :, y : y + p_h, x : x + p_w] += pred
-        count_map[:, :, y : y + p_h, x : x + p_w] += 1
-        max_map[:, :, y : y + p_h, x : x + p_w] = torch.maximum(
-            max_map[:, :, y : y + p_h, x : x + p_w], pred
-        )
-
-    return full_map / count_map if strategy == "mean" else max_map
+        count_map[:, :, y : y + p_h, x : x + p_w] += multiplicity
+    return count_map
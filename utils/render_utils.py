@@ -0,0 +1,69 @@
+import cv2
+import numpy as np
+
+
+# Segment data of matplotlib's "jet" colormap: (x, value) breakpoints per channel
+_jet_data = {
+    "red": [(0.0, 0.0), (0.35, 0.0), (0.66, 1.0), (0.89, 1.0), (1.0, 0.5)],
+    "green": [(0.0, 0.0), (0.125, 0.0), (0.375, 1.0), (0.64, 1.0), (0.91, 0.0), (1.0, 0.0)],
+    "blue": [(0.0, 0.5), (0.11, 1.0), (0.34, 1.0), (0.65, 0.0), (1.0, 0.0)],
+}
+
+
+def make_jet_lut(n: int = 256) -> np.ndarray:
+    """ Build an (n, 3) uint8 RGB lookup table matching matplotlib's jet colormap"""
+    x = np.linspace(0, 1, n)
+    channels = []
+    for channel in ["red", "green", "blue"]:
+        xp, fp = zip(*_jet_data[channel])
+        channels.append(np.interp(x, xp, fp))
+    return np.round(np.stack(channels, axis=-1) * 255).astype(np.uint8)
+
+
+JET_LUT = make_jet_lut()
+
+
+def render_density_overlay(frame, density: np.ndarray, alpha: float = 0.5, vmax_scale: float = 0.5, max_side: int = None) -> np.ndarray:
+    """
+    Blend a jet colored density map over an RGB frame, like imshow(frame) + imshow(density, cmap="jet", alpha=alpha,
+    vmin=0, vmax=density.max() * vmax_scale) in matplotlib. Returns an RGB uint8 image.
+    If max_side is given, the output is downscaled so that its longest side is at most max_side.
+    """
+    frame = np.asarray(frame)
+    if frame.ndim == 2:
+        frame = cv2.cvtColor(frame, cv2.COLOR_GRAY2RGB)
+    density = np.asarray(density, dtype=np.float32).squeeze()
+
+    height, width = frame.shape[:2]
+    if max_side is not None and max(height, width) > max_side:
+        scale = max_side / max(height, width)
+        size = (max(1, round(width * scale)), max(1, round(height * scale)))
+        frame = cv2.resize(frame, size, interpolation=cv2.INTER_AREA)
+        density = cv2.resize(density, size, interpolation=cv2.INTER_LINEAR)
+    elif density.shape != (height, width):
+        density = cv2.resize(density, (width, height), interpolation=cv2.INTER_LINEAR)
+
+    vmax = float(density.max()) * vmax_scale
+    if vmax > 0:
+        # Same binning as matplotlib: index = int(value / vmax * N), clipped to [0, N - 1]
+        indices = np.clip(density * (len(JET_LUT) / vmax), 0, len(JET_LUT) - 1).astype(np.uint8)
+    else:
+        indices = np.zeros(density.shape, dtype=np.uint8)
+
+    colors = JET_LUT[indices]
+    return cv2.addWeighted(colors, alpha, frame, 1 - alpha, 0)
+
+
+def save_density_overlay(frame, density: np.ndarray, path, alpha: float = 0.5, vmax_scale: float = 0.5, max_side: int = None) -> None:
+    """ Render the density overlay and write it to path, the format is taken from the file extension"""
+    overlay = render_density_overlay(frame, density, alpha=alpha, vmax_scale=vmax_scale, max_side=max_side)
+    if not cv2.imwrite(str(path), cv2.cvtColor(overlay, cv2.COLOR_RGB2BGR)):
+        raise IOError(f"Could not write density map to {path}")
+
+
+def save_frame(frame, path, format: str = "JPEG", quality: int = 70) -> None:
+    """ Save a PIL frame, as JPEG with the given quality or as an optimized PNG"""
+    if format == "JPEG":
+        frame.save(path.with_suffix(".jpg"), format, quality=quality)
+    else:
+        frame.save(path, format, optimize=True, compress_level=9)
@@ -64,6 +64,13 @@ def get_loss_fn(args: ArgumentParser) -> nn.Module:
         loss_fn = losses.DMLoss(
             input_size=args.input_size,
             reduction=args.reduction,
+            num_of_iter_in_ot=args.num_of_iter_in_ot,
+            batched=not args.per_sample_ot,
+            log_domain=args.ot_log_domain,
+            stop_thr=args.ot_tol,
+            warm_start=args.ot_warm_start,
+            warm_start_cache_size=args.ot_warm_start_cache_size,
+            separable=args.ot_separable,
         )
     else:
         loss_fn = losses.DACELoss(
@@ -72,6 +79,13 @@ def get_loss_fn(args: ArgumentParser) -> nn.Module:
             weight_count_loss=args.weight_count_loss,
             count_loss=args.count_loss,
             input_size=args.input_size,
+            num_of_iter_in_ot=args.num_of_iter_in_ot,
+            batched=not args.per_sample_ot,
+            log_domain=args.ot_log_domain,
+            stop_thr=args.ot_tol,
+            warm_start=args.ot_warm_start,
+            warm_start_cache_size=args.ot_warm_start_cache_size,
+            separable=args.ot_separable,
         )
     return loss_fn
 